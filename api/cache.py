@@ -0,0 +1,46 @@
+"""
+In-process caches. Every worker keeps its own copy, so entries expire after `ttl` seconds to pick up changes made
+through other workers.
+"""
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded mapping whose entries expire, the least recently used entry is evicted when full
+    """
+    def __init__(self, ttl, maxsize=100_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value, expires_at = self.data[key]
+        except KeyError:
+            return default
+        if expires_at < time.monotonic():
+            del self.data[key]
+            return default
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = (value, time.monotonic() + self.ttl)
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key):
+        self.data.pop(key, None)
+
+    def invalidate(self, predicate):
+        """
+        Drops every entry whose key matches `predicate`
+        """
+        for key in [key for key in self.data if predicate(key)]:
+            del self.data[key]
+
+    def __len__(self):
+        return len(self.data)
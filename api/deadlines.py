@@ -0,0 +1,72 @@
+"""
+In-memory queue of prediction deadlines, so results are computed as soon as predictions end instead of polling.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from piccolo.columns.combination import WhereRaw
+from .tables import Prediction
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineQueue:
+    """
+    Min-heap of (ends_at, prediction id), `on_due` is awaited with the ids of the predictions that just ended.
+    `queued` maps each prediction to its current deadline, heap entries that no longer match it are stale and skipped
+    """
+    def __init__(self, on_due):
+        self.on_due = on_due
+        self.heap = []
+        self.queued = {}
+        self.changed = asyncio.Event()
+
+    def push(self, prediction_id, ends_at: datetime):
+        """
+        Queues a prediction, or moves it to a new deadline if it is queued already
+        """
+        if self.queued.get(prediction_id) == ends_at:
+            return
+        self.queued[prediction_id] = ends_at
+        heapq.heappush(self.heap, (ends_at, prediction_id))
+        if self.heap[0] == (ends_at, prediction_id):
+            # new earliest deadline, wake up the runner
+            self.changed.set()
+
+    async def load(self):
+        """
+        Queues every prediction that is yet to be settled
+        """
+        rows = await Prediction.select(Prediction.id, Prediction.ends_at).where(WhereRaw("NOT processed"))
+        for row in rows:
+            self.push(row["id"], row["ends_at"])
+
+    def pop_due(self, now: datetime):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            ends_at, prediction_id = heapq.heappop(self.heap)
+            if self.queued.get(prediction_id) != ends_at:
+                # replaced by a later push
+                continue
+            del self.queued[prediction_id]
+            due.append(prediction_id)
+        return due
+
+    async def run(self):
+        while True:
+            self.changed.clear()
+            timeout = (self.heap[0][0] - datetime.now()).total_seconds() if self.heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            due = self.pop_due(datetime.now())
+            if due:
+                try:
+                    await self.on_due(due)
+                except Exception:
+                    # the periodic sweep retries them, the queue keeps serving the next deadlines
+                    logger.exception("Deadline queue: processing predictions %s failed", due)
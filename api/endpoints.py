@@ -1,75 +1,132 @@
 from typing import Annotated
-from fastapi import Body, FastAPI, Header, Query, HTTPException, Request
-from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from fastapi import Body, Depends, FastAPI, Header, Query, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from .tables import *
 from .models import *
-import requests
-import secrets
+from .auth import signer, InvalidToken
+from .cache import TTLCache
+from .notify import notify, listener, PREDICTION_CREATED, BET_PLACED, CLUB_UPDATED, SESSION_REVOKED
+from .events import pools
+from .heartbeats import heartbeats
+from .leaderboard import leaderboards
+from .responses import responses
+from .serialization import FastJSONResponse, dumps
+from .ratelimit import SharedRateLimiter
 import asyncio
+import httpx
+import math
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from uuid import UUID
+from piccolo_conf import RATE_LIMIT_PATH
 
-limiter = Limiter(key_func=get_remote_address)
-app = FastAPI()
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+OPENPLANET_URL = "https://openplanet.dev"
 
+# responses are encoded with orjson, endpoints return rows as they are instead of pydantic models
+app = FastAPI(default_response_class=FastJSONResponse)
+# validates the tokens the plugin gets from openplanet, benchmarks swap it for a local stand-in
+app.state.openplanet = httpx.AsyncClient(base_url=OPENPLANET_URL, timeout=10)
+# (player id, club id) -> whether the player is admin of the club
+memberships = TTLCache(ttl=60)
+# rows fetched from the database cursor at a time by streaming exports
+EXPORT_BATCH_SIZE = 500
+# bets a client can send at once
+MAX_BATCH_BETS = 50
+# records a client can upload at once
+MAX_BATCH_RECORDS = 1000
+# token buckets shared by every worker of the host, keyed per endpoint and player
+limiter = SharedRateLimiter(RATE_LIMIT_PATH)
+# (requests, seconds) allowed to each caller of an endpoint.
+# Logins are limited per address before the player is known, several players may share one behind a NAT
+AUTH_LIMIT = (10, 60)
+LOGIN_LIMIT = (1, 60)
+CLUB_LIMIT = (5, 3600)
+PREDICTION_LIMIT = (30, 3600)
+BET_LIMIT = (60, 60)
+RECORD_LIMIT = (30, 60)
+HEARTBEAT_LIMIT = (10, 60)
 
-@app.post('/auth')
-@limiter.limit("1/minute")
-async def auth(request: Request, auth: Auth):
+
+def enforce_limit(key, limit):
+    retry_after = limiter.hit(key, *limit)
+    if retry_after:
+        raise HTTPException(429, "Too many requests.", headers={"Retry-After": str(math.ceil(retry_after))})
+
+def rate_limit(endpoint, limit):
+    """
+    Dependency allowing each player `limit` calls of the endpoint, callers without a valid session are limited
+    by address
+    """
+    async def check(request: Request):
+        try:
+            caller = f"player:{signer.verify(request.headers.get('secret', ''))['sub']}"
+        except InvalidToken:
+            caller = f"address:{request.client.host if request.client else None}"
+        enforce_limit(f"{endpoint}:{caller}", limit)
+    return Depends(check)
+
+
+@app.post('/auth', response_model=Auth, dependencies=[rate_limit("auth", AUTH_LIMIT)])
+async def auth(auth: Auth):
     # send authentication from plugin to openplanet to verify client
-    op_url = "https://openplanet.dev/api/auth/validate"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-        "token": auth.token,
-        "secret": None
-    }
-    r = requests.post(op_url, data=data, headers=headers)
+    r = await app.state.openplanet.post("/api/auth/validate", data={"token": auth.token})
     user = r.json()
     if "error" in user:
         raise HTTPException(status_code=400, detail="Invalid authentication")
-    # generate unique secret and update player table
-    # TODO move to jwt
-    token = secrets.token_hex(32)
-    while await Player.exists().where(Player.secret == token):
-        token = secrets.token_hex(32)
-    await Player.insert(
-        Player(uuid=user["account_id"], name=user["display_name"], secret=token)
+    enforce_limit(f"login:{user['account_id']}", LOGIN_LIMIT)
+    rows = await Player.insert(
+        Player(uuid=user["account_id"], name=user["display_name"])
     ).on_conflict(
+        target=Player.uuid,
         action="DO UPDATE",
-        values=[Player.name, Player.secret]
-    )
-    return Auth(token=token)
+        values=[Player.name]
+    ).returning(Player.id)
+    return FastJSONResponse({"token": signer.issue(rows[0]["id"])})
 
-async def verify_secret(secret: Annotated[str, Header()]):
-    p = await Player.objects().get(Player.secret == secret)
-    if not p:
+@app.delete('/auth')
+async def logout(secret: Annotated[str, Header()]):
+    """
+    Revoke the session token used for this request
+    """
+    claims = verify_claims(secret)
+    signer.revoke(claims)
+    # stored for the workers that start later, and sent to the running ones
+    async with RevokedToken._meta.db.transaction():
+        await RevokedToken.add(claims)
+        await notify(SESSION_REVOKED, {"jti": claims["jti"], "exp": claims["exp"]})
+    return FastJSONResponse("Logged out successfully")
+
+async def load_revocations():
+    signer.revoke(*await RevokedToken.get_active(int(time.time())))
+
+listener.subscribe({SESSION_REVOKED: signer.revoke}, on_connect=load_revocations)
+
+def verify_claims(secret):
+    try:
+        return signer.verify(secret)
+    except InvalidToken:
         raise HTTPException(status_code=400, detail="secret invalid")
-    return p
 
-@app.post('/clubs')
+async def verify_secret(secret: Annotated[str, Header()]):
+    """
+    Returns the id of the player the session token was issued to
+    """
+    return verify_claims(secret)["sub"]
+
+@app.post('/clubs', dependencies=[rate_limit("post_club", CLUB_LIMIT)])
 async def post_club(secret: Annotated[str, Header()], club: ClubModel):
     """
     Create a club
     """
+    creator = await verify_secret(secret)
     if not club.name or len(club.name) < 3:
         raise HTTPException(status_code=400, detail="Club name must be at least 3 characters long")
     if await Club.exists().where(Club.name == club.name):
         raise HTTPException(status_code=409, detail="Club name already exists")
-    creator = await verify_secret(secret)
-    g = Club(club.model_dump(exclude_none=True))
-    await creator.add_m2m(
-        g,
-        m2m=Player.clubs,
-        extra_column_values={"admin": True}
-    )
-    g = await Club.objects().get(Club.name == club.name)
-    return JSONResponse({"id": g.id})
+    async with Club._meta.db.transaction():
+        g = await Club.insert(Club(club.model_dump(exclude_none=True))).returning(Club.id)
+        await PlayerToClub.insert(PlayerToClub(player=creator, club=g[0]["id"], admin=True))
+    return FastJSONResponse({"id": g[0]["id"]})
 
 async def get_player_and_club(secret, club_name):
     club, player = await asyncio.gather(
@@ -80,22 +137,19 @@ async def get_player_and_club(secret, club_name):
         raise HTTPException(404, f"Club with name {club_name} does not exist.")
     return club, player
 
-@app.put('/clubs/players')
-async def join_club(secret: Annotated[str, Header()], name: str) -> ClubOut:
+@app.put('/clubs/players', response_model=ClubSummary)
+async def join_club(secret: Annotated[str, Header()], name: str):
     """
     Join club
     """
     club, player = await get_player_and_club(secret, name)
-    await club.add_m2m(
-        player,
-        m2m=Club.players
-    )
-    out = club.to_dict()
-    members = await PlayerToClub.objects(PlayerToClub.player).where(PlayerToClub.club.id == club.id)
-    tracks = await club.get_m2m(Club.tracks)
-    out["players"] = [PlayerOut(points=p.points, admin=p.admin, **p.player.to_dict()) for p in members]
-    out["tracks"] = [TrackModel(**t.to_dict()) for t in tracks]
-    return ClubOut(**out)
+    await PlayerToClub.insert(
+        PlayerToClub(player=player, club=club.id)
+    ).on_conflict(action="DO NOTHING")
+    memberships.pop((player, club.id))
+    leaderboards.invalidate(club.id)
+    await responses.changed(club.id)
+    return FastJSONResponse(await club_summary(club))
 
 @app.delete('/clubs/players')
 async def leave_club(secret: Annotated[str, Header()], name: str):
@@ -103,78 +157,223 @@ async def leave_club(secret: Annotated[str, Header()], name: str):
     leave club
     """
     club, player = await get_player_and_club(secret, name)
-    await club.remove_m2m(
-        player,
-        m2m=Club.players
+    await PlayerToClub.delete().where(
+        (PlayerToClub.player == player) & (PlayerToClub.club == club.id)
     )
-    return JSONResponse("Club left successfully")
+    memberships.pop((player, club.id))
+    leaderboards.invalidate(club.id)
+    await responses.changed(club.id)
+    return FastJSONResponse("Club left successfully")
 
 async def validate_membership(secret, club_id, requires_admin=False):
-    club, members, player = await asyncio.gather(
-        Club.objects().get(Club.id == club_id),
-        PlayerToClub.objects(PlayerToClub.player).where(PlayerToClub.club.id == club_id),
-        verify_secret(secret)
+    """
+    Checks that the caller is part of the club (and one of its admins, if required) and returns the caller's id.
+    Only the caller's membership row is read, and the result is cached for a short while.
+    """
+    player = await verify_secret(secret)
+    admin = memberships.get((player, club_id))
+    if admin is None:
+        m = await PlayerToClub.select(PlayerToClub.admin).where(
+            (PlayerToClub.player == player) & (PlayerToClub.club == club_id)
+        ).first()
+        if not m:
+            if not await Club.exists().where(Club.id == club_id):
+                raise HTTPException(404, "Club does not exist.")
+            raise HTTPException(403, "You are not part of this club.")
+        admin = m["admin"]
+        memberships.set((player, club_id), admin)
+    if requires_admin and not admin:
+        raise HTTPException(403, "You must be club admin to perform this action.")
+    return player
+
+def on_club_updated(payload):
+    # endpoints changing memberships notify it, so the other workers drop what they cached
+    memberships.invalidate(lambda key: key[1] == payload["club"])
+
+async def clear_memberships():
+    memberships.invalidate(lambda key: True)
+
+listener.subscribe({CLUB_UPDATED: on_club_updated}, on_connect=clear_memberships)
+
+async def club_summary(club):
+    """
+    `ClubSummary` of a club row, as a dict ready to encode
+    """
+    player_count, track_count = await asyncio.gather(
+        PlayerToClub.count().where(PlayerToClub.club == club.id),
+        TrackToClub.count().where(TrackToClub.club == club.id)
     )
-    if not club:
-        raise HTTPException(404, "Club does not exist.")
+    return {**club.to_dict(), "player_count": player_count, "track_count": track_count}
+
+def encode_cursor(*values):
+    return urlsafe_b64encode(":".join(str(v) for v in values).encode()).decode()
+
+def decode_cursor(cursor, length):
     try:
-        m = next(m for m in members if m.player.id == player.id)
-        if requires_admin and not m.admin:
-            raise HTTPException(403, "You must be club admin to perform this action.")
-    except StopIteration:
-        raise HTTPException(403, "You are not part of this club.")
-    return club, members
+        values = [int(v) for v in urlsafe_b64decode(cursor.encode()).decode().split(":")]
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor.")
+    if len(values) != length:
+        raise HTTPException(400, "Invalid cursor.")
+    return values
+
+ROSTER_COLUMNS = (
+    PlayerToClub.player.as_alias("id"),
+    PlayerToClub.player.uuid.as_alias("uuid"),
+    PlayerToClub.player.name.as_alias("name"),
+    PlayerToClub.points,
+    PlayerToClub.admin,
+)
+
+def roster_query(club_id):
+    """
+    Members of a club, richest first. Points are the balance snapshots, which lag behind the points ledger by a
+    compaction interval at most, the leaderboard has the exact balances.
+    """
+    return PlayerToClub.select(*ROSTER_COLUMNS).where(
+        PlayerToClub.club == club_id
+    ).order_by(PlayerToClub.points, ascending=False).order_by(PlayerToClub.player)
+
+def cached_response(cached, if_none_match):
+    """
+    Sends a cached (body, etag), or 304 if the client has it already
+    """
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get('/clubs/{club_id}', response_model=ClubSummary)
+async def get_club(secret: Annotated[str, Header()], club_id: int,
+                   if_none_match: Annotated[str | None, Header()] = None):
+    """
+    Get club info, players and tracks are listed by their own endpoints
+    """
+    await validate_membership(secret, club_id)
+
+    async def build():
+        club = await Club.objects().get(Club.id == club_id)
+        return dumps(await club_summary(club))
+
+    return cached_response(await responses.get(club_id, ("summary",), build), if_none_match)
+
+@app.get('/clubs/{club_id}/players', response_model=PlayerPage)
+async def get_club_players(secret: Annotated[str, Header()], club_id: int, cursor: str = None,
+                           limit: Annotated[int, Query(ge=1, le=200)] = 50):
+    """
+    Get a page of club members, sorted by points
+    """
+    await validate_membership(secret, club_id)
+    query = roster_query(club_id)
+    if cursor:
+        points, player = decode_cursor(cursor, 2)
+        query = query.where(
+            (PlayerToClub.points < points) | ((PlayerToClub.points == points) & (PlayerToClub.player > player))
+        )
+    rows = await query.limit(limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]["points"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return FastJSONResponse({"players": rows[:limit], "next_cursor": next_cursor})
+
+@app.get('/clubs/{club_id}/leaderboard', response_model=LeaderboardOut)
+async def get_club_leaderboard(secret: Annotated[str, Header()], club_id: int,
+                               limit: Annotated[int, Query(ge=1, le=100)] = 10):
+    """
+    Get the richest members of the club and the caller's own rank
+    """
+    player = await validate_membership(secret, club_id)
+    board = await leaderboards.get(club_id)
+    rank = board.rank(player)
+    if rank is None:
+        # joined through another worker since the leaderboard was loaded
+        leaderboards.invalidate(club_id)
+        board = await leaderboards.get(club_id)
+        rank = board.rank(player)
+        if rank is None:
+            raise HTTPException(403, "You are not part of this club.")
+    return FastJSONResponse({"top": board.top(limit), "me": board.entry(player, rank)})
+
+@app.get('/clubs/{club_id}/players/export')
+async def export_club_players(secret: Annotated[str, Header()], club_id: int):
+    """
+    Stream every club member as newline delimited JSON, rows are sent as they are read from the database cursor
+    """
+    await validate_membership(secret, club_id, requires_admin=True)
+
+    async def rows():
+        async with await roster_query(club_id).batch(batch_size=EXPORT_BATCH_SIZE) as batch:
+            async for chunk in batch:
+                yield b"".join(dumps(row) + b"\n" for row in chunk)
 
-@app.get('/clubs/{club_id}')
-async def get_club(secret: Annotated[str, Header()], club_id: int) -> ClubOut:
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+@app.get('/clubs/{club_id}/tracks', response_model=TrackPage)
+async def get_club_tracks(secret: Annotated[str, Header()], club_id: int, cursor: str = None,
+                          limit: Annotated[int, Query(ge=1, le=200)] = 50):
     """
-    Get club info
+    Get a page of club tracks
     """
-    club, members = await validate_membership(secret, club_id)
-    tracks = await club.get_m2m(Club.tracks)
-    out = club.to_dict()
-    out["players"] = [PlayerOut(points=p.points, admin=p.admin, **p.player.to_dict()) for p in members]
-    out["tracks"] = [TrackModel(**t.to_dict()) for t in tracks]
-    return ClubOut(**out)
+    await validate_membership(secret, club_id)
+    query = TrackToClub.select(
+        TrackToClub.track.as_alias("id"),
+        TrackToClub.track.uuid.as_alias("uuid"),
+        TrackToClub.track.name.as_alias("name"),
+    ).where(TrackToClub.club == club_id).order_by(TrackToClub.track)
+    if cursor:
+        track, = decode_cursor(cursor, 1)
+        query = query.where(TrackToClub.track > track)
+    rows = await query.limit(limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]["id"]) if len(rows) > limit else None
+    return FastJSONResponse({"tracks": rows[:limit], "next_cursor": next_cursor})
 
 @app.post('/clubs/{club_id}')
 async def update_club(secret: Annotated[str, Header()], club_id: int, club: ClubUpdate):
     """
     Update club settings
     """
-    g, _ = await validate_membership(secret, club_id, requires_admin=True)
+    await validate_membership(secret, club_id, requires_admin=True)
+    g = await Club.objects().get(Club.id == club_id)
     for k,v in club.model_dump(exclude_none=True).items():
         setattr(g, k, v)
     await g.save()
-    return JSONResponse("Values updated successfully")
+    await responses.changed(club_id)
+    return FastJSONResponse("Values updated successfully")
 
 @app.delete('/clubs/{club_id}')
 async def delete_club(secret: Annotated[str, Header()], club_id: int):
     """
     Delete club
     """
-    g, _ = await validate_membership(secret, club_id, requires_admin=True)
-    await g.remove()
-    return JSONResponse("Club deleted successfully.")
+    await validate_membership(secret, club_id, requires_admin=True)
+    await Club.delete().where(Club.id == club_id)
+    memberships.invalidate(lambda key: key[1] == club_id)
+    leaderboards.invalidate(club_id)
+    await responses.changed(club_id)
+    return FastJSONResponse("Club deleted successfully.")
 
 @app.put('/clubs/{club_id}/tracks')
 async def add_club_tracks(secret: Annotated[str, Header()], club_id: int, tracks: list[TrackModel]):
     """
     add track(s) to a club
     """
-    g, _ = await validate_membership(secret, club_id, requires_admin=True)
+    await validate_membership(secret, club_id, requires_admin=True)
+    g = await Club.objects().get(Club.id == club_id)
     ts = await asyncio.gather(*[Track.objects().get_or_create(
         Track.uuid == t.uuid, defaults={Track.name: t.name}
     ) for t in tracks])
     await g.add_m2m(*ts, m2m=Club.tracks)
-    return JSONResponse("Tracks added successfully")
+    await responses.changed(club_id)
+    return FastJSONResponse("Tracks added successfully")
 
 @app.delete('/clubs/{club_id}/tracks')
 async def remove_club_tracks(secret: Annotated[str, Header()], club_id: int, uuids: Annotated[list[UUID], Query()]):
     """
     remove track(s) from a club
     """
-    g, _ = await validate_membership(secret, club_id, requires_admin=True)
+    await validate_membership(secret, club_id, requires_admin=True)
+    g = await Club.objects().get(Club.id == club_id)
     ts = await Track.objects().where(
         Track.uuid.is_in(uuids)
     )
@@ -182,27 +381,158 @@ async def remove_club_tracks(secret: Annotated[str, Header()], club_id: int, uui
         *ts,
         m2m=Club.tracks
     )
-    return JSONResponse("Tracks removed successfully")
+    await responses.changed(club_id)
+    return FastJSONResponse("Tracks removed successfully")
 
-@app.get('/clubs/{club_id}/predictions')
-async def get_club_predictions(secret: Annotated[str, Header()], club_id: int, hours: int = 1) -> list[PredictionOut]:
+@app.get('/clubs/{club_id}/predictions', response_model=list[PredictionOut])
+async def get_club_predictions(secret: Annotated[str, Header()], club_id: int, hours: int = 1,
+                               if_none_match: Annotated[str | None, Header()] = None):
     """
     get active predictions of the club, or those that ended at most "hours" ago
     """
-    g, _ = await validate_membership(secret, club_id)
-    predictions = await Prediction.get_club_predictions(hours=min(hours, 24))
-    return [PredictionOut.from_dict(**p) for p in predictions]
+    await validate_membership(secret, club_id)
+    hours = min(hours, 24)
+
+    async def build():
+        # the feed is encoded by the database already
+        return (await Prediction.get_club_feed(club_id, hours=hours)).encode()
+
+    return cached_response(await responses.get(club_id, ("feed", hours), build), if_none_match)
 
-@app.post('/clubs/{club_id}/predictions')
-async def post_club_prediction(secret: Annotated[str, Header()], club_id: int, prediction: PredictionIn) -> PredictionOut:
+@app.get('/clubs/{club_id}/events')
+async def get_club_events(secret: Annotated[str, Header()], club_id: int):
     """
-    get active predictions of the club, or those that ended at most "hours" ago
+    Server-sent events of the club: a snapshot of the open pools, then "created", "pool" and "settled" events.
+    Clients that can't keep up are disconnected and should reconnect.
+    """
+    await validate_membership(secret, club_id)
+    subscription = pools.subscribe(club_id)
+
+    async def events():
+        try:
+            async for event in subscription.stream():
+                yield event
+        finally:
+            pools.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post('/clubs/{club_id}/predictions', response_model=PredictionOut,
+          dependencies=[rate_limit("post_prediction", PREDICTION_LIMIT)])
+async def post_club_prediction(secret: Annotated[str, Header()], club_id: int, prediction: PredictionIn):
+    """
+    create a prediction in the club
     """
     club = await Club.objects().get(Club.id == club_id)
-    requires_admin = club.restricted
-    await validate_membership(secret, club_id, requires_admin=requires_admin)
-    p = await Prediction.insert(Prediction(
-            created_at=datetime.now(), 
-            **PredictionIn.model_dump(exclude_none=True)
-        )).returning(Prediction.all_columns())
-    return PredictionOut.from_dict(protagonists=prediction.protagonists, **p)
\ No newline at end of file
+    if not club:
+        raise HTTPException(404, "Club does not exist.")
+    await validate_membership(secret, club_id, requires_admin=club.restricted)
+    async with Prediction._meta.db.transaction():
+        p = await Prediction.insert(Prediction(
+            club=club_id,
+            created_at=datetime.now() + club.automated_open,
+            **prediction.model_dump(exclude_none=True, exclude={"protagonists", "club"})
+        )).returning(*Prediction.all_columns())
+        protagonists = await Player.select(Player.id, Player.uuid, Player.name).where(
+            Player.uuid.is_in([player.uuid for player in prediction.protagonists])
+        )
+        if protagonists:
+            await PlayerToPrediction.insert(*[
+                PlayerToPrediction(player=player["id"], prediction=p[0]["id"]) for player in protagonists
+            ])
+        # lets the settlement leader schedule it, delivered once the transaction commits
+        await notify(PREDICTION_CREATED, {
+            "id": p[0]["id"], "club": club_id, "created_at": p[0]["created_at"], "ends_at": p[0]["ends_at"]
+        })
+    responses.bump(club_id)
+    return FastJSONResponse({
+        **p[0], "protagonists": [{"uuid": player["uuid"], "name": player["name"]} for player in protagonists], "pool": {}
+    })
+
+async def bet_refusal(player, club_id, prediction_id, outcome, now):
+    """
+    Finds out why a bet was refused, only looked up once placing it failed
+    """
+    prediction = await Prediction.objects().get((Prediction.id == prediction_id) & (Prediction.club == club_id))
+    if not prediction:
+        return HTTPException(404, "Prediction does not exist.")
+    if prediction.processed or prediction.created_at <= now:
+        return HTTPException(409, "Bets on this prediction are closed.")
+    if await Bet.exists().where((Bet.player == player) & (Bet.prediction == prediction_id)):
+        return HTTPException(409, "You already bet on this prediction.")
+    if prediction.type == PredictionType.VERSUS and not await PlayerToPrediction.exists().where(
+        (PlayerToPrediction.prediction == prediction_id) & (PlayerToPrediction.player == outcome)
+    ):
+        return HTTPException(400, "Invalid outcome.")
+    if not await PlayerToClub.exists().where((PlayerToClub.player == player) & (PlayerToClub.club == club_id)):
+        return HTTPException(403, "You are not part of this club.")
+    return HTTPException(400, "Not enough points.")
+
+async def place_bet(player, club_id, prediction_id, outcome):
+    """
+    Places the bet, the caller bumps the club's responses once it's committed
+    """
+    now = datetime.now()
+    placed = await Bet.place(player, club_id, prediction_id, outcome, now)
+    if not placed:
+        raise await bet_refusal(player, club_id, prediction_id, outcome, now)
+    # updates the live pools and leaderboards of every worker
+    await notify(BET_PLACED, {
+        "club": club_id, "prediction": prediction_id, "outcome": outcome, "player": player, "points": placed[1]
+    })
+    return {"id": placed[0], "points": placed[1]}
+
+@app.post('/clubs/{club_id}/predictions/{prediction_id}/bets', response_model=BetOut,
+          dependencies=[rate_limit("post_bet", BET_LIMIT)])
+async def post_bet(secret: Annotated[str, Header()], club_id: int, prediction_id: int, bet: BetIn):
+    """
+    bet on a prediction, the entry fee is taken from the player's points
+    """
+    player = await validate_membership(secret, club_id)
+    placed = await place_bet(player, club_id, prediction_id, bet.outcome)
+    # the pool in the feed changed
+    responses.bump(club_id)
+    return FastJSONResponse(placed)
+
+@app.post('/clubs/{club_id}/bets', response_model=list[BatchBetOut], dependencies=[rate_limit("post_bets", BET_LIMIT)])
+async def post_bets(secret: Annotated[str, Header()], club_id: int, bets: list[BatchBetIn]):
+    """
+    place several bets at once, each one is accepted or refused on its own
+    """
+    if len(bets) > MAX_BATCH_BETS:
+        raise HTTPException(400, f"Can't place more than {MAX_BATCH_BETS} bets at once.")
+    player = await validate_membership(secret, club_id)
+    results = []
+    # the bets all lock the player's membership row: they're placed one after the other on a single connection
+    async with Bet._meta.db.transaction():
+        for bet in bets:
+            try:
+                placed = await place_bet(player, club_id, bet.prediction, bet.outcome)
+            except HTTPException as e:
+                results.append({"prediction": bet.prediction, "status": e.status_code, "bet": None, "detail": e.detail})
+            else:
+                results.append({"prediction": bet.prediction, "status": 200, "bet": placed, "detail": None})
+    if any(result["bet"] for result in results):
+        responses.bump(club_id)
+    return FastJSONResponse(results)
+
+@app.post('/records', response_model=RecordsOut, dependencies=[rate_limit("post_records", RECORD_LIMIT)])
+async def post_records(secret: Annotated[str, Header()], records: list[RecordIn]):
+    """
+    upload records fetched with the client's own nadeo token, stored with a single statement
+    """
+    if len(records) > MAX_BATCH_RECORDS:
+        raise HTTPException(400, f"Can't upload more than {MAX_BATCH_RECORDS} records at once.")
+    player = await verify_secret(secret)
+    unique = {(r.player, r.track, r.time, r.timestamp) for r in records}
+    inserted = await TrackmaniaRecord.ingest(unique, checked_by=player, now=datetime.now())
+    return FastJSONResponse({"received": len(records), "inserted": inserted})
+
+@app.post('/heartbeat', status_code=204, dependencies=[rate_limit("heartbeat", HEARTBEAT_LIMIT)])
+async def post_heartbeat(secret: Annotated[str, Header()], heartbeat: Heartbeat):
+    """
+    sent by the plugin every minute while a track is played, buffered and written in bulk
+    """
+    player = await verify_secret(secret)
+    heartbeats.add(player, heartbeat.track, datetime.now())
+    return Response(status_code=204)
@@ -0,0 +1,153 @@
+"""
+Live prediction events for plugin clients. Every worker keeps the bet pools of the open predictions in memory,
+updated from the notifications sent when predictions are created, bets are placed and predictions settle, and fans
+the events out to the club's subscribers.
+"""
+import asyncio
+from collections import Counter
+from .tables import Prediction
+from .notify import listener, PREDICTION_CREATED, BET_PLACED, PREDICTION_SETTLED
+from .serialization import dumps
+
+# events a subscriber can fall behind by before it's dropped
+SUBSCRIBER_BUFFER = 64
+# seconds between comments sent to idle streams, so dead connections are noticed
+KEEPALIVE = 15
+
+
+class Subscription:
+    """
+    Bounded queue of the events of a club to send to one client, `None` closes the stream
+    """
+    def __init__(self, club, maxsize=SUBSCRIBER_BUFFER):
+        self.club = club
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def put(self, event):
+        """
+        Queues an event, a subscriber whose buffer is full is dropped instead of letting it hold memory:
+        the client reconnects and starts over from a fresh snapshot
+        """
+        if self.dropped:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+    async def stream(self, keepalive=KEEPALIVE):
+        """
+        Yields the queued events in the server-sent events format
+        """
+        while True:
+            try:
+                event = await asyncio.wait_for(self.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield event
+
+
+def encode_event(name, data):
+    return f"event: {name}\ndata: {dumps(data).decode()}\n\n"
+
+
+class PoolAggregator:
+    """
+    Amount of bets on each outcome of the open predictions, and the subscribers of each club
+    """
+    def __init__(self):
+        # prediction id -> club id
+        self.clubs = {}
+        # prediction id -> outcome -> amount of bets
+        self.pools = {}
+        # club id -> subscriptions
+        self.subscribers = {}
+        self.callbacks = {
+            PREDICTION_CREATED: self.on_prediction_created,
+            BET_PLACED: self.on_bet_placed,
+            PREDICTION_SETTLED: self.on_prediction_settled,
+        }
+
+    def subscribe(self, club, maxsize=SUBSCRIBER_BUFFER):
+        """
+        Registers a subscriber, its stream starts with the pools of the club's open predictions
+        """
+        subscription = Subscription(club, maxsize)
+        self.subscribers.setdefault(club, set()).add(subscription)
+        subscription.put(encode_event("snapshot", [
+            {"prediction": prediction, "pool": pool}
+            for prediction, pool in self.pools.items() if self.clubs[prediction] == club
+        ]))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self.subscribers.get(subscription.club)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.club]
+
+    def publish(self, club, name, data):
+        """
+        Sends an event to every subscriber of the club, encoded once for all of them
+        """
+        subscribers = self.subscribers.get(club)
+        if not subscribers:
+            return
+        event = encode_event(name, data)
+        for subscription in list(subscribers):
+            if not subscription.put(event):
+                self.unsubscribe(subscription)
+
+    async def load(self):
+        """
+        Rebuilds the pools of every open prediction, called whenever the listener (re)connects
+        """
+        rows = await Prediction.raw(
+            """
+            SELECT p.id, p.club, b.outcome, count(b.id)::integer AS bets
+            FROM prediction p LEFT JOIN bet b ON b.prediction = p.id
+            WHERE NOT p.processed
+            GROUP BY p.id, p.club, b.outcome
+            """
+        )
+        self.clubs, self.pools = {}, {}
+        for row in rows:
+            self.clubs[row["id"]] = row["club"]
+            pool = self.pools.setdefault(row["id"], Counter())
+            if row["outcome"] is not None:
+                pool[row["outcome"]] = row["bets"]
+
+    def on_prediction_created(self, payload):
+        if payload["id"] in self.pools:
+            return
+        self.clubs[payload["id"]] = payload["club"]
+        self.pools[payload["id"]] = Counter()
+        self.publish(payload["club"], "created", payload)
+
+    def on_bet_placed(self, payload):
+        pool = self.pools.get(payload["prediction"])
+        if pool is None:
+            return
+        pool[payload["outcome"]] += 1
+        self.publish(payload["club"], "pool", {"prediction": payload["prediction"], "pool": pool})
+
+    def on_prediction_settled(self, payload):
+        self.clubs.pop(payload["prediction"], None)
+        self.pools.pop(payload["prediction"], None)
+        self.publish(payload["club"], "settled", {
+            "club": payload["club"], "prediction": payload["prediction"], "void": payload.get("void", False)
+        })
+
+
+pools = PoolAggregator()
+listener.subscribe(pools.callbacks, on_connect=pools.load)
@@ -0,0 +1,69 @@
+"""
+Coalesces the playtime heartbeats sent by plugin clients, so each (player, track) pair is written at most once per
+flush instead of once per heartbeat.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from .tables import PlayerToTrack
+
+logger = logging.getLogger(__name__)
+
+# seconds between flushes of the buffered heartbeats
+FLUSH_INTERVAL = 30
+
+
+class HeartbeatBuffer:
+    """
+    Latest heartbeat of each (player id, track uuid) pair, written with one bulk upsert by `flush`
+    """
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending = {}
+        # heartbeats received and rows written, the difference is the amount of writes saved
+        self.received = 0
+        self.written = 0
+
+    @property
+    def saved(self):
+        return self.received - len(self.pending) - self.written
+
+    def add(self, player, track, ts: datetime):
+        self.received += 1
+        key = (player, track)
+        if key not in self.pending or self.pending[key] < ts:
+            self.pending[key] = ts
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        try:
+            await PlayerToTrack.record_played_bulk([(player, track, ts) for (player, track), ts in pending.items()])
+        except Exception:
+            # keep them for the next flush, unless newer heartbeats arrived in the meantime
+            for key, ts in pending.items():
+                if key not in self.pending or self.pending[key] < ts:
+                    self.pending[key] = ts
+            raise
+        self.written += len(pending)
+
+    async def run(self):
+        """
+        Flushes periodically, and one last time when cancelled
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Heartbeat flush failed, %s pairs kept for the next one", len(self.pending))
+        finally:
+            await self.flush()
+            logger.info(
+                "Heartbeats: %s received, %s rows written, %s writes saved", self.received, self.written, self.saved
+            )
+
+
+heartbeats = HeartbeatBuffer()
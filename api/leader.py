@@ -0,0 +1,79 @@
+"""
+Leader election between API workers, so that background jobs like settlement run in exactly one of them.
+"""
+import asyncio
+import asyncpg
+from piccolo.engine import engine_finder
+
+# identifies our lock among the advisory locks of the database
+LEADER_LOCK_ID = 4_206_942
+# how often followers try to take the lock and the leader checks its connection, in seconds
+CHECK_INTERVAL = 2
+# a connection whose peer vanished without closing it is dropped by postgres after about idle + interval * count
+KEEPALIVE_SETTINGS = {"tcp_keepalives_idle": "5", "tcp_keepalives_interval": "2", "tcp_keepalives_count": "3"}
+
+
+class LeaderElection:
+    """
+    Calls `on_elected` once this process takes a session level advisory lock and `on_deposed` if it loses it.
+    The lock is held by a dedicated connection: when the leader dies postgres closes its session and releases the
+    lock, and another worker takes over within `interval` seconds.
+    """
+    def __init__(self, on_elected, on_deposed, lock_id=LEADER_LOCK_ID, interval=CHECK_INTERVAL):
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.lock_id = lock_id
+        self.interval = interval
+        self.is_leader = False
+        self.connection = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.depose()
+        await self.disconnect()
+
+    async def connect(self):
+        self.connection = await engine_finder().get_new_connection()
+        for setting, value in KEEPALIVE_SETTINGS.items():
+            await self.connection.execute(f"SET {setting} = {value}")
+
+    async def disconnect(self):
+        if self.connection and not self.connection.is_closed():
+            # closing the session releases the lock as well
+            await self.connection.close()
+        self.connection = None
+
+    def depose(self):
+        if self.is_leader:
+            self.is_leader = False
+            self.on_deposed()
+
+    async def check(self):
+        if self.connection is None or self.connection.is_closed():
+            self.depose()
+            await self.connect()
+        if self.is_leader:
+            # the lock is ours as long as the session holding it is alive
+            await self.connection.fetchval("SELECT 1", timeout=self.interval)
+        elif await self.connection.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_id, timeout=self.interval):
+            self.is_leader = True
+            self.on_elected()
+
+    async def run(self):
+        while True:
+            try:
+                await self.check()
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                print(f"Leader election: lost database connection ({e})")
+                self.depose()
+                await self.disconnect()
+            await asyncio.sleep(self.interval)
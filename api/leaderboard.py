@@ -0,0 +1,114 @@
+"""
+Club leaderboards kept in memory by every worker. A club is ranked by the database once, then kept up to date from
+the notifications sent when bets are placed and predictions settle.
+"""
+import asyncio
+from bisect import bisect_left, insort
+from .cache import TTLCache
+from .tables import PlayerToClub
+from .notify import listener, BET_PLACED, PREDICTION_SETTLED, CLUB_UPDATED
+
+# leaderboards are reloaded after a while anyway, to pick up members who joined or left through other workers
+LEADERBOARD_TTL = 300
+
+
+class Leaderboard:
+    """
+    Members of a club sorted by points, descending, then by id
+    """
+    def __init__(self, rows):
+        self.members = {row["id"]: {"id": row["id"], "uuid": row["uuid"], "name": row["name"]} for row in rows}
+        self.points = {row["id"]: row["points"] for row in rows}
+        self.order = sorted((-points, player) for player, points in self.points.items())
+
+    def __len__(self):
+        return len(self.order)
+
+    def set(self, player, points):
+        """
+        Moves a member to its new place, returns False for players that aren't known members
+        """
+        if player not in self.points:
+            return False
+        old = (-self.points[player], player)
+        del self.order[bisect_left(self.order, old)]
+        self.points[player] = points
+        insort(self.order, (-points, player))
+        return True
+
+    def rank(self, player):
+        """
+        1 + the amount of members with more points, or None for non members
+        """
+        if player not in self.points:
+            return None
+        return bisect_left(self.order, (-self.points[player],)) + 1
+
+    def entry(self, player, rank):
+        return {**self.members[player], "points": self.points[player], "rank": rank}
+
+    def top(self, n):
+        entries = []
+        for i, (points, player) in enumerate(self.order[:n]):
+            rank = entries[-1]["rank"] if entries and entries[-1]["points"] == -points else i + 1
+            entries.append(self.entry(player, rank))
+        return entries
+
+
+class LeaderboardCache:
+    """
+    Leaderboards of the clubs that were asked for recently
+    """
+    def __init__(self, ttl=LEADERBOARD_TTL, maxsize=1000):
+        self.boards = TTLCache(ttl, maxsize)
+        # club id -> task loading its leaderboard, so concurrent requests share one query
+        self.loading = {}
+        self.callbacks = {
+            BET_PLACED: self.on_bet_placed,
+            PREDICTION_SETTLED: self.on_prediction_settled,
+            CLUB_UPDATED: self.on_club_updated,
+        }
+
+    async def get(self, club):
+        board = self.boards.get(club)
+        if board is not None:
+            return board
+        if club not in self.loading:
+            self.loading[club] = asyncio.ensure_future(PlayerToClub.get_ranking(club).run())
+        try:
+            rows = await asyncio.shield(self.loading[club])
+        finally:
+            self.loading.pop(club, None)
+        board = Leaderboard(rows)
+        self.boards.set(club, board)
+        return board
+
+    def update(self, club, player, points):
+        board = self.boards.get(club)
+        if board is not None and not board.set(player, points):
+            self.invalidate(club)
+
+    def invalidate(self, club):
+        self.boards.pop(club)
+
+    async def clear(self):
+        # updates sent while the listener was disconnected are lost
+        self.boards.invalidate(lambda club: True)
+
+    def on_bet_placed(self, payload):
+        self.update(payload["club"], payload["player"], payload["points"])
+
+    def on_club_updated(self, payload):
+        # members may have joined or left through another worker
+        self.invalidate(payload["club"])
+
+    def on_prediction_settled(self, payload):
+        if payload.get("balances") is None:
+            self.invalidate(payload["club"])
+            return
+        for player, points in payload["balances"]:
+            self.update(payload["club"], player, points)
+
+
+leaderboards = LeaderboardCache()
+listener.subscribe(leaderboards.callbacks, on_connect=leaderboards.clear)
@@ -2,11 +2,12 @@ from piccolo.utils.pydantic import create_pydantic_model
 from pydantic import BaseModel, field_validator
 from .tables import *
 from datetime import timedelta
+from uuid import UUID
 
 class Auth(BaseModel):
     token: str
 
-PlayerModel = create_pydantic_model(Player, exclude_columns=(Player.secret,))
+PlayerModel = create_pydantic_model(Player)
 class PlayerOut(PlayerModel):
     points: int
     admin: bool
@@ -50,12 +51,64 @@ class ClubUpdate(ClubModel):
             raise ValueError("Predictions can't last longer than a day, and have a minimum duration of 1 hour")
         return f
 
-class ClubOut(ClubModel):
+class ClubSummary(ClubModel):
     id: int
+    player_count: int
+    track_count: int
+
+class PlayerPage(BaseModel):
     players: list[PlayerOut]
+    # pass as `cursor` to get the next page, null on the last one
+    next_cursor: str | None
+
+class RankedPlayer(PlayerModel):
+    id: int
+    points: int
+    rank: int
+
+class LeaderboardOut(BaseModel):
+    top: list[RankedPlayer]
+    # the caller's own entry, wherever it ranks
+    me: RankedPlayer
+
+class TrackPage(BaseModel):
     tracks: list[TrackModel]
+    next_cursor: str | None
 
 TrackmaniaRecordModel = create_pydantic_model(TrackmaniaRecord)
+class RecordIn(BaseModel):
+    # nadeo account and map ids
+    player: UUID
+    track: UUID
+    time: int
+    timestamp: datetime
+
+    @field_validator('time')
+    @classmethod
+    def ensure_positive_time(cls, t):
+        if t <= 0:
+            raise ValueError("Record time must be positive")
+        return t
+
+    @field_validator('timestamp')
+    @classmethod
+    def ensure_past_timestamp(cls, dt):
+        # nadeo timestamps are timezone aware, the table stores local time
+        if dt.tzinfo:
+            dt = dt.astimezone().replace(tzinfo=None)
+        # account for clock skew
+        if dt > datetime.now() + timedelta(minutes=1):
+            raise ValueError("Record timestamp can't be in the future")
+        return dt
+
+class Heartbeat(BaseModel):
+    # nadeo map id of the track being played
+    track: UUID
+
+class RecordsOut(BaseModel):
+    received: int
+    # records that weren't stored already
+    inserted: int
 PredictionModel = create_pydantic_model(Prediction)
 class PredictionIn(create_pydantic_model(Prediction, exclude_columns=(Prediction.created_at, Prediction.processed))):
     track: int
@@ -68,11 +121,29 @@ class PredictionIn(create_pydantic_model(Prediction, exclude_columns=(Prediction
         # account for max request delay
         if dt < offset_request_time + timedelta(hours=1) or dt > offset_request_time + timedelta(days=1):
             raise ValueError("Prediction must be open for at least 1 hour and can't last longer than a day")
+        return dt
 
 class PredictionOut(PredictionModel):
+    id: int
     protagonists: list[PlayerModel]
+    # amount of bets placed on each outcome
+    pool: dict[int, int] = {}
 
-    @classmethod
-    def from_dict(cls, **kwargs):
-        kwargs["protagonists"] = [PlayerModel(**p) for p in kwargs["protagonists"]]
-        return cls(kwargs)
\ No newline at end of file
+class BetIn(BaseModel):
+    # id of the protagonist for versus predictions, the guessed time in milliseconds otherwise
+    outcome: int
+
+class BatchBetIn(BetIn):
+    prediction: int
+
+class BetOut(BaseModel):
+    id: int
+    # points left after paying the entry fee
+    points: int
+
+class BatchBetOut(BaseModel):
+    prediction: int
+    # http status the bet would have been answered with on its own
+    status: int
+    bet: BetOut | None = None
+    detail: str | None = None
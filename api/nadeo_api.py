@@ -1,35 +1,189 @@
-import time
-import nadeo_api
-import nadeo_api.auth
-import nadeo_api.core
-import nadeo_api.live
-import nadeo_api.config
+import asyncio
+import base64
+import json
 import pickle
-from pathlib import Path 
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+import httpx
 from piccolo_conf import NADEO_PASSWORD, NADEO_USER, NADEO_USER_AGENT, DATA_DIR
 
-nadeo_api.config.wait_between_requests_ms = 3000
-nadeo_api.config.debug_logging = True
+CORE_URL = "https://prod.trackmania.core.nadeo.online"
+AUDIENCES = ("NadeoServices", "NadeoLiveServices")
+# minimum spacing between two calls to the Nadeo services, in seconds
+WAIT_BETWEEN_REQUESTS = 3
+# tokens are renewed when they are this close to expiring, in seconds
+REFRESH_MARGIN = 300
+# how many accounts a single mapRecords request can carry, it takes one map
+MAX_ACCOUNTS_PER_REQUEST = 100
+
+
+def plan_record_requests(pairs, max_accounts=MAX_ACCOUNTS_PER_REQUEST):
+    """
+    Groups (account id, map id) pairs into as few mapRecords requests as the account limit allows.
+    Returns a list of (account ids, map id).
+    """
+    accounts_by_map = defaultdict(set)
+    for account_id, map_id in pairs:
+        accounts_by_map[map_id].add(account_id)
+    requests = []
+    for map_id, accounts in accounts_by_map.items():
+        accounts = sorted(accounts)
+        for i in range(0, len(accounts), max_accounts):
+            requests.append((accounts[i:i + max_accounts], map_id))
+    return requests
+
+
+@dataclass
+class NadeoToken:
+    access_token: str
+    refresh_token: str
+
+    @property
+    def expires_at(self):
+        """
+        Expiration of the access token, read from the (unverified) JWT payload
+        """
+        payload = self.access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))["exp"]
+
+    def expires_soon(self, margin=REFRESH_MARGIN):
+        return self.expires_at - time.time() < margin
+
 
 class NadeoAPI:
-    def __init__(self):
+    """
+    Async client for the Nadeo services.
+    Requests share a pooled HTTP session, are spaced by `wait_between_requests` without blocking the event loop and
+    tokens are renewed before they expire. `base_url` and `transport` can point the client to a fake server.
+    """
+    def __init__(self, base_url=CORE_URL, transport=None, wait_between_requests=WAIT_BETWEEN_REQUESTS,
+                 token_dir=DATA_DIR):
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            headers={"User-Agent": NADEO_USER_AGENT},
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+            timeout=10,
+        )
+        self.wait_between_requests = wait_between_requests
+        self.token_dir = token_dir
         self.tokens = {}
-        for audience in ("NadeoServices", "NadeoLiveServices"):
-            try:
-                filename = Path(DATA_DIR, audience).with_suffix(".pkl")
-                with open(filename, 'rb') as f:
-                    token = pickle.load(f)
+        self.token_lock = asyncio.Lock()
+        self.rate_lock = asyncio.Lock()
+        self.next_request_at = 0.0
+        # requests sent so far, tokens included, to keep callers within a budget
+        self.requests_sent = 0
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def throttle(self):
+        """
+        Waits until the next request is allowed, other coroutines keep running in the meantime
+        """
+        async with self.rate_lock:
+            delay = self.next_request_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_request_at = time.monotonic() + self.wait_between_requests
+
+    async def request(self, method, endpoint, **kwargs):
+        await self.throttle()
+        self.requests_sent += 1
+        r = await self.client.request(method, endpoint, **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+    def token_path(self, audience):
+        return Path(self.token_dir, audience).with_suffix(".pkl")
+
+    def load_token(self, audience):
+        try:
+            with open(self.token_path(audience), 'rb') as f:
+                token = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        return token if isinstance(token, NadeoToken) else None
+
+    def save_token(self, audience, token):
+        with open(self.token_path(audience), 'wb') as f:
+            pickle.dump(token, f)
+
+    async def authenticate(self, audience):
+        data = await self.request(
+            "POST", "/v2/authentication/token/basic",
+            auth=(NADEO_USER, NADEO_PASSWORD),
+            json={"audience": audience}
+        )
+        return NadeoToken(data["accessToken"], data["refreshToken"])
+
+    async def refresh(self, token: NadeoToken):
+        data = await self.request(
+            "POST", "/v2/authentication/token/refresh",
+            headers={"Authorization": f"nadeo_v1 t={token.refresh_token}"}
+        )
+        return NadeoToken(data["accessToken"], data["refreshToken"])
+
+    async def get_token(self, audience):
+        """
+        Returns a valid token for the given audience, renewing (and persisting) it if it's about to expire
+        """
+        async with self.token_lock:
+            token = self.tokens.get(audience) or self.load_token(audience)
+            if token is None:
+                token = await self.authenticate(audience)
+            elif token.expires_soon():
+                try:
+                    token = await self.refresh(token)
+                except httpx.HTTPStatusError:
+                    # refresh token expired as well, log in again
+                    token = await self.authenticate(audience)
+            if token is not self.tokens.get(audience):
                 self.tokens[audience] = token
-            except IOError:
-                token = nadeo_api.auth.get_token(audience, NADEO_USER, NADEO_PASSWORD, NADEO_USER_AGENT, server_account=True)
-                time.sleep(1)
-                with open(filename, 'wb') as f:
-                    pickle.dump(token, f)
+                self.save_token(audience, token)
+            return token
 
-    def get_records(self, player_uuids, track_uuid):
+    async def get(self, audience, endpoint, params=None):
+        token = await self.get_token(audience)
+        return await self.request(
+            "GET", endpoint,
+            params=params,
+            headers={"Authorization": f"nadeo_v1 t={token.access_token}"}
+        )
+
+    async def get_records(self, player_uuids, track_uuid):
         endpoint = "/v2/mapRecords/"
         params = {
-            "accountIdList": player_uuids,
-            "mapId": track_uuid
+            "accountIdList": ",".join(str(uuid) for uuid in player_uuids),
+            "mapId": str(track_uuid)
         }
-        return nadeo_api.core.get(self.tokens["NadeoServices"], endpoint, params)
+        return await self.get("NadeoServices", endpoint, params)
+
+    async def get_records_bulk(self, pairs, budget=None):
+        """
+        Looks up the records of many (account id, map id) pairs with as few requests as possible, issuing at most
+        `budget` of them, authentication and token refreshes included. Returns the records keyed by
+        (account id, map id) and the pairs left for a later call. Pairs without a record on Nadeo are just missing
+        from the result.
+        """
+        pairs = {(str(account_id), str(map_id)) for account_id, map_id in pairs}
+        plan = plan_record_requests(pairs)
+        if plan and budget is not None:
+            if budget <= 0:
+                return {}, pairs
+            # the token is renewed up front, so that the requests it took are known before planning the rest
+            sent = self.requests_sent
+            await self.get_token("NadeoServices")
+            plan = plan[:max(budget - (self.requests_sent - sent), 0)]
+        responses = await asyncio.gather(*[self.get_records(accounts, map_id) for accounts, map_id in plan])
+        records = {}
+        for response in responses:
+            for record in response:
+                key = (record["accountId"], record["mapId"])
+                if key in pairs:
+                    records[key] = record
+        requested = {(account_id, map_id) for accounts, map_id in plan for account_id in accounts}
+        return records, pairs - requested
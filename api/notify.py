@@ -0,0 +1,98 @@
+"""
+Postgres LISTEN/NOTIFY helpers, used to tell every worker about changes made by any of them.
+"""
+import asyncio
+import json
+import asyncpg
+from piccolo.engine import engine_finder
+from .tables import Prediction
+
+PREDICTION_CREATED = "prediction_created"
+BET_PLACED = "bet_placed"
+PREDICTION_SETTLED = "prediction_settled"
+CLUB_UPDATED = "club_updated"
+SESSION_REVOKED = "session_revoked"
+
+
+async def notify(channel, payload: dict):
+    """
+    Sends `payload` to every process listening on `channel`, if called in a transaction it's delivered on commit
+    """
+    await Prediction.raw("SELECT pg_notify({}, {})", channel, json.dumps(payload, default=str))
+
+
+async def notify_many(channel, payloads: list[dict]):
+    """
+    Sends several notifications on `channel` in one statement
+    """
+    if payloads:
+        await Prediction.raw(
+            "SELECT pg_notify({}, payload) FROM unnest({}::text[]) AS payload",
+            channel, [json.dumps(payload, default=str) for payload in payloads]
+        )
+
+
+class Listener:
+    """
+    Listens on the channels callbacks subscribed to with a dedicated connection, and passes the decoded payloads to
+    them. If the connection drops it reconnects and calls the `on_connect` hooks again, notifications sent in the
+    meantime are lost so that's where to reload any state they would have updated.
+    One listener is shared by the whole process, see `listener`.
+    """
+    def __init__(self, interval=2):
+        # channel -> callbacks
+        self.callbacks = {}
+        self.on_connect = []
+        self.interval = interval
+
+    def subscribe(self, callbacks: dict, on_connect=None):
+        """
+        Adds callbacks to some channels, channels are only listened to if they are subscribed to before `run`
+        """
+        for channel, callback in callbacks.items():
+            self.callbacks.setdefault(channel, []).append(callback)
+        if on_connect:
+            self.on_connect.append(on_connect)
+
+    def unsubscribe(self, callbacks: dict, on_connect=None):
+        """
+        Removes callbacks added by `subscribe`, their channels are still listened to until the listener reconnects
+        """
+        for channel, callback in callbacks.items():
+            if callback in self.callbacks.get(channel, ()):
+                self.callbacks[channel].remove(callback)
+        if on_connect in self.on_connect:
+            self.on_connect.remove(on_connect)
+
+    def dispatch(self, connection, pid, channel, payload):
+        payload = json.loads(payload)
+        for callback in self.callbacks[channel]:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Listener: {channel} callback failed: {e!r}")
+
+    async def run(self):
+        connection = None
+        try:
+            while True:
+                try:
+                    if connection is None or connection.is_closed():
+                        connection = await engine_finder().get_new_connection()
+                        for channel in self.callbacks:
+                            await connection.add_listener(channel, self.dispatch)
+                        for on_connect in self.on_connect:
+                            await on_connect()
+                    await connection.fetchval("SELECT 1", timeout=self.interval)
+                except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    print(f"Listener: lost database connection ({e})")
+                    if connection:
+                        connection.terminate()
+                    connection = None
+                await asyncio.sleep(self.interval)
+        finally:
+            if connection and not connection.is_closed():
+                await connection.close()
+
+
+listener = Listener()
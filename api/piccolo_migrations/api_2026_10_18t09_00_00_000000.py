@@ -0,0 +1,107 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T09:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'initial schema'
+
+FK = "INTEGER REFERENCES {} (id) ON DELETE CASCADE ON UPDATE CASCADE"
+
+TABLES = {
+    "player": f"""
+        id SERIAL PRIMARY KEY,
+        uuid UUID NOT NULL DEFAULT gen_random_uuid() UNIQUE,
+        name VARCHAR(255) NOT NULL DEFAULT ''
+    """,
+    "track": f"""
+        id SERIAL PRIMARY KEY,
+        uuid UUID NOT NULL DEFAULT gen_random_uuid() UNIQUE,
+        name VARCHAR(255) NOT NULL DEFAULT ''
+    """,
+    "player_to_track": f"""
+        id SERIAL PRIMARY KEY,
+        player {FK.format("player")},
+        track {FK.format("track")},
+        last_played_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+        CONSTRAINT player_track_constraint UNIQUE (player, track)
+    """,
+    "trackmania_record": f"""
+        id SERIAL PRIMARY KEY,
+        player {FK.format("player")},
+        track {FK.format("track")},
+        time INTEGER NOT NULL DEFAULT 0,
+        nadeo_timestamp TIMESTAMP NOT NULL DEFAULT current_timestamp,
+        created_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+        checked_by VARCHAR(255) DEFAULT ''
+    """,
+    "club": f"""
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL DEFAULT '' UNIQUE,
+        points_name VARCHAR(255) NOT NULL DEFAULT 'points',
+        restricted BOOLEAN NOT NULL DEFAULT false,
+        visibility BOOLEAN NOT NULL DEFAULT false,
+        automated_amount SMALLINT NOT NULL DEFAULT 2,
+        automated_frequency INTERVAL NOT NULL DEFAULT interval '30 minutes',
+        automated_open INTERVAL NOT NULL DEFAULT interval '5 minutes',
+        automated_end INTERVAL NOT NULL DEFAULT interval '6 hours'
+    """,
+    "player_to_club": f"""
+        id SERIAL PRIMARY KEY,
+        player {FK.format("player")},
+        club {FK.format("club")},
+        points INTEGER NOT NULL DEFAULT 1000,
+        admin BOOLEAN NOT NULL DEFAULT false,
+        CONSTRAINT player_club_constraint UNIQUE (player, club)
+    """,
+    "track_to_club": f"""
+        id SERIAL PRIMARY KEY,
+        track {FK.format("track")},
+        club {FK.format("club")},
+        counter INTEGER NOT NULL DEFAULT 0,
+        CONSTRAINT track_club_constraint UNIQUE (track, club)
+    """,
+    "prediction": f"""
+        id SERIAL PRIMARY KEY,
+        track {FK.format("track")},
+        club {FK.format("club")},
+        type SMALLINT NOT NULL DEFAULT 0,
+        entry_fee INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+        ends_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+        processed BOOLEAN NOT NULL DEFAULT false
+    """,
+    "player_to_prediction": f"""
+        id SERIAL PRIMARY KEY,
+        player {FK.format("player")},
+        prediction {FK.format("prediction")},
+        CONSTRAINT player_prediction_constraint UNIQUE (player, prediction)
+    """,
+    "bet": f"""
+        id SERIAL PRIMARY KEY,
+        player {FK.format("player")},
+        prediction {FK.format("prediction")},
+        outcome INTEGER NOT NULL DEFAULT 0,
+        CONSTRAINT bet_constraint UNIQUE (player, prediction)
+    """,
+}
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        for name, columns in TABLES.items():
+            await RawTable.raw(f"CREATE TABLE {name} ({columns})")
+
+    async def run_backwards():
+        for name in reversed(TABLES):
+            await RawTable.raw(f"DROP TABLE {name}")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
@@ -0,0 +1,37 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T09:30:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'indexes for the hot query shapes'
+
+INDEXES = {
+    # first record after a timestamp, per player and track
+    "trackmania_record_player_track_created_at": "ON trackmania_record (player, track, created_at)",
+    # settlement scan, only unprocessed predictions are ever looked up by end date
+    "prediction_unprocessed_ends_at": "ON prediction (ends_at) WHERE NOT processed",
+    "bet_prediction": "ON bet (prediction)",
+    "player_to_club_club": "ON player_to_club (club)",
+    "player_to_prediction_prediction": "ON player_to_prediction (prediction)",
+}
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        for name, definition in INDEXES.items():
+            await RawTable.raw(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+
+    async def run_backwards():
+        for name in INDEXES:
+            await RawTable.raw(f"DROP INDEX IF EXISTS {name}")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
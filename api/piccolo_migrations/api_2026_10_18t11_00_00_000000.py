@@ -0,0 +1,36 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T11:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'points ledger with idempotency key'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        await RawTable.raw("""
+            CREATE TABLE points_ledger (
+                id SERIAL PRIMARY KEY,
+                player INTEGER REFERENCES player (id) ON DELETE CASCADE ON UPDATE CASCADE,
+                club INTEGER REFERENCES club (id) ON DELETE CASCADE ON UPDATE CASCADE,
+                prediction INTEGER NULL REFERENCES prediction (id) ON DELETE CASCADE ON UPDATE CASCADE,
+                reason SMALLINT NOT NULL DEFAULT 0,
+                delta INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+                CONSTRAINT points_ledger_constraint UNIQUE (prediction, player, reason)
+            )
+        """)
+
+    async def run_backwards():
+        await RawTable.raw("DROP TABLE points_ledger")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
@@ -0,0 +1,25 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T12:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'track when clubs last got automated predictions'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        await RawTable.raw("ALTER TABLE club ADD COLUMN last_automated_at TIMESTAMP NULL DEFAULT null")
+
+    async def run_backwards():
+        await RawTable.raw("ALTER TABLE club DROP COLUMN last_automated_at")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
@@ -0,0 +1,33 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T13:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'store each trackmania record once'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        # keep the earliest copy of records fetched more than once
+        await RawTable.raw(
+            "DELETE FROM trackmania_record a USING trackmania_record b "
+            "WHERE a.player = b.player AND a.track = b.track AND a.nadeo_timestamp = b.nadeo_timestamp AND a.id > b.id"
+        )
+        await RawTable.raw(
+            "ALTER TABLE trackmania_record "
+            "ADD CONSTRAINT record_constraint UNIQUE (player, track, nadeo_timestamp)"
+        )
+
+    async def run_backwards():
+        await RawTable.raw("ALTER TABLE trackmania_record DROP CONSTRAINT record_constraint")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
@@ -0,0 +1,27 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T14:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'index club members by points for leaderboards'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        await RawTable.raw(
+            "CREATE INDEX IF NOT EXISTS player_to_club_club_points ON player_to_club (club, points DESC, player)"
+        )
+
+    async def run_backwards():
+        await RawTable.raw("DROP INDEX IF EXISTS player_to_club_club_points")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
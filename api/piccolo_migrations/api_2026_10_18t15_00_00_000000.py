@@ -0,0 +1,38 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T15:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'compact the points ledger into balance snapshots'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        # every credit so far was already added to the members' points
+        await RawTable.raw("ALTER TABLE points_ledger ADD COLUMN compacted BOOLEAN NOT NULL DEFAULT true")
+        await RawTable.raw("ALTER TABLE points_ledger ALTER COLUMN compacted SET DEFAULT false")
+        await RawTable.raw(
+            "CREATE INDEX IF NOT EXISTS points_ledger_tail ON points_ledger (club, player) WHERE NOT compacted"
+        )
+
+    async def run_backwards():
+        # points are changed in place again, so fold whatever is left first
+        await RawTable.raw(
+            "UPDATE player_to_club SET points = player_to_club.points + tail.delta "
+            "FROM (SELECT player, club, sum(delta)::integer AS delta FROM points_ledger WHERE NOT compacted "
+            "GROUP BY player, club) AS tail "
+            "WHERE player_to_club.player = tail.player AND player_to_club.club = tail.club"
+        )
+        await RawTable.raw("DROP INDEX IF EXISTS points_ledger_tail")
+        await RawTable.raw("ALTER TABLE points_ledger DROP COLUMN compacted")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
@@ -0,0 +1,33 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T16:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'share session token revocations between workers'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        await RawTable.raw(
+            """
+            CREATE TABLE revoked_token (
+                id SERIAL PRIMARY KEY,
+                jti VARCHAR(16) NOT NULL DEFAULT '' UNIQUE,
+                expires_at BIGINT NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+    async def run_backwards():
+        await RawTable.raw("DROP TABLE revoked_token")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
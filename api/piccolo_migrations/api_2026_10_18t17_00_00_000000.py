@@ -0,0 +1,27 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+class RawTable(Table):
+    pass
+
+
+ID = '2026-10-18T17:00:00:000000'
+VERSION = '1.22.0'
+DESCRIPTION = 'drop the player secrets replaced by signed session tokens'
+
+
+async def forwards():
+    manager = MigrationManager(migration_id=ID, app_name="api", description=DESCRIPTION)
+
+    async def run():
+        # databases created before the migrations still have the column, the initial schema doesn't
+        await RawTable.raw("ALTER TABLE player DROP COLUMN IF EXISTS secret")
+
+    async def run_backwards():
+        # the old secrets are gone, players get a new one when they authenticate again
+        await RawTable.raw("ALTER TABLE player ADD COLUMN IF NOT EXISTS secret VARCHAR(64) NULL UNIQUE")
+
+    manager.add_raw(run)
+    manager.add_raw_backwards(run_backwards)
+    return manager
@@ -1,143 +1,329 @@
-from apscheduler.schedulers.background import BlockingScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from .tables import *
-from datetime import datetime
-from enum import IntEnum
+from datetime import datetime, timedelta
 import asyncio
+import logging
+import numpy as np
 from .nadeo_api import NadeoAPI
-from collections import defaultdict
+from .deadlines import DeadlineQueue
+from .notify import listener, notify, notify_many, PREDICTION_CREATED, PREDICTION_SETTLED
 from random import choice
 
+logger = logging.getLogger(__name__)
+
+# with 3 seconds between requests, a settlement run never waits on nadeo for more than about 45 seconds
+NADEO_CALLS_PER_TICK = 15
+SETTLEMENT_WORKERS = 4
+# how often clubs are checked for due automated predictions, and how much these cost to enter
+AUTOMATION_MINUTES = 1
+AUTOMATED_ENTRY_FEE = 100
+# marks predictions to be voided instead of paid out
+VOID = object()
+# notifications are limited to 8000 bytes, leaderboards of predictions with more winners are reloaded instead
+MAX_NOTIFIED_BALANCES = 200
+# seconds between compactions of the points ledger into the balance snapshots
+COMPACTION_SECONDS = 10
+# predictions are settled as soon as they end, this periodic run only catches anything that slipped through
+SWEEP_MINUTES = 10
+# predictions that failed to settle are tried again after this delay
+SETTLEMENT_RETRY_SECONDS = 30
 
-class PredictionType(IntEnum):
-    VERSUS = 0
-    GUESS = 1
-    RAFFLE = 2
 
 class PredictionManager:
-    def __init__(self):
-        self.nadeo_api = NadeoAPI()
-        self.scheduler = BlockingScheduler()
-        # todo add nadeo api token initialization
+    def __init__(self, calls_per_tick=NADEO_CALLS_PER_TICK, workers=SETTLEMENT_WORKERS, nadeo_api=None):
+        self.nadeo_api = nadeo_api or NadeoAPI()
+        # max amount of nadeo requests performed on each settlement tick
+        self.calls_per_tick = calls_per_tick
+        # predictions settled concurrently, each worker uses its own database connection
+        self.workers = workers
+        self.scheduler = AsyncIOScheduler()
+        self.deadlines = DeadlineQueue(on_due=self.settle)
+        self.callbacks = {PREDICTION_CREATED: self.on_prediction_created}
+        listener.subscribe(self.callbacks, on_connect=self.on_listener_connect)
+        self.settlement_lock = asyncio.Lock()
+        self.tasks = []
 
-    def start(self, interval_minutes=1):
-        self.scheduler.add_job(self.process_expired_predictions, trigger='interval', minutes=interval_minutes)
+    def start(self, interval_minutes=SWEEP_MINUTES):
+        """
+        Runs the settlement loop on the current event loop, starting with a tick to catch up with anything that
+        expired while no worker was running it
+        """
+        self.scheduler.add_job(
+            self.settle, trigger='interval', minutes=interval_minutes,
+            id="settlement", replace_existing=True, next_run_time=datetime.now()
+        )
+        self.scheduler.add_job(
+            self.create_automated_predictions, trigger='interval', minutes=AUTOMATION_MINUTES,
+            id="automation", replace_existing=True
+        )
+        self.scheduler.add_job(
+            self.compact_ledger, trigger='interval', seconds=COMPACTION_SECONDS,
+            id="compaction", replace_existing=True
+        )
         self.scheduler.start()
+        # deadlines are pushed by the process' listener from now on, and loaded again whenever it reconnects
+        self.tasks = [asyncio.create_task(self.deadlines.load()), asyncio.create_task(self.deadlines.run())]
 
     def shutdown(self):
-        self.scheduler.shutdown()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def close(self):
+        self.shutdown()
+        listener.unsubscribe(self.callbacks, on_connect=self.on_listener_connect)
+        await self.nadeo_api.close()
+
+    @property
+    def leading(self):
+        return bool(self.tasks)
+
+    async def on_listener_connect(self):
+        if self.leading:
+            await self.deadlines.load()
+
+    def on_prediction_created(self, payload):
+        # only the leader settles predictions
+        if self.leading:
+            self.deadlines.push(payload["id"], datetime.fromisoformat(payload["ends_at"]))
+
+    async def settle(self, ids=None):
+        """
+        Entry point of the deadline queue, with the ids of the predictions that just ended, and of the periodic sweep,
+        over every expired prediction. Runs never overlap
+        """
+        async with self.settlement_lock:
+            await self.process_expired_predictions(ids)
 
     async def create_automated_predictions(self):
-        pass
+        """
+        Creates the automated predictions of every club that is due, in one statement, and queues their deadlines
+        """
+        async with Prediction._meta.db.transaction():
+            predictions = await Prediction.create_automated(
+                datetime.now(), PredictionType.GUESS, AUTOMATED_ENTRY_FEE
+            )
+            # for the live pools of every worker, the leader has its deadlines already
+            await notify_many(PREDICTION_CREATED, predictions)
+        for prediction in predictions:
+            self.deadlines.push(prediction["id"], prediction["ends_at"])
 
-    async def process_expired_predictions(self):
+    async def compact_ledger(self):
+        """
+        Folds the points ledger into the balance snapshots, one batch at a time until it's caught up
+        """
+        while await PointsLedger.compact() == COMPACTION_BATCH:
+            pass
+
+    async def process_expired_predictions(self, ids=None):
         now = datetime.now()
-        queue = await Prediction.objects(Prediction.track).where(
-            (Prediction.ends_at < now()) & (not Prediction.processed)
+        queue = await Prediction.get_expired(now, ids)
+        contests = [prediction for prediction in queue if prediction.type != PredictionType.RAFFLE]
+        protagonists = await PlayerToPrediction.get_protagonists([prediction.id for prediction in contests])
+        # records that clients have already uploaded, keyed by (player, prediction)
+        records = await TrackmaniaRecord.get_first_created_after_bulk([
+            (prediction.id, player.id, prediction.track.id, prediction.ends_at)
+            for prediction in contests for player in protagonists[prediction.id]
+        ])
+        uploaded = {(record["player"], record["key"]): record for record in records}
+        # every (player, track) pair that is still missing is looked up on nadeo at once for the whole tick
+        missing = {
+            (player.id, player.uuid, prediction.track.id, prediction.track.uuid)
+            for prediction in contests for player in protagonists[prediction.id]
+            if (player.id, prediction.id) not in uploaded
+        }
+        fetched, deferred = await self.update_records(missing)
+        # when each protagonist last played the track, for the void rule
+        last_played = await PlayerToTrack.get_last_played_bulk({
+            (player.id, prediction.track.id) for prediction in contests for player in protagonists[prediction.id]
+        })
+        # prediction id -> (prediction, records to compute the payout with or VOID)
+        ready = {}
+        # the budget is spent once the requests of this tick have been spaced out
+        budget_reopens_at = datetime.now() + timedelta(
+            seconds=self.calls_per_tick * self.nadeo_api.wait_between_requests
         )
         for prediction in queue:
-            bets = await prediction.get_bets()
-            distributor = PointsDistributor(prediction, bets)
             records = None
             if prediction.type != PredictionType.RAFFLE:
-                protagonists = await prediction.get_m2m(Prediction.protagonists)
-                records = await prediction.get_records(protagonists)
-                # call nadeo api if no client has yet uploaded valid records for this prediction
-                if not records:
-                    records = await self.update_records(prediction, protagonists)
-                # if nobody improved their time since the prediction was created, the prediction is considered void
-                # and all points are returned without modification
-                # TODO change this such that it checks just if a player PLAYED the map, not if he improved on it
-                # add endpoint to "claim" points for playing a track, with op plugin that tracks playtime
+                players = protagonists[prediction.id]
+                # records didn't fit in this tick's nadeo budget, try again once it reopens
+                if any((player.id, prediction.track.id) in deferred for player in players):
+                    self.deadlines.push(prediction.id, budget_reopens_at)
+                    continue
+                records = [
+                    uploaded.get((player.id, prediction.id)) or fetched.get((player.id, prediction.track.id))
+                    for player in players
+                ]
+                records = [record for record in records if record]
+                # if nobody improved their time or played the track since the prediction was created, the prediction
+                # is considered void and all points are returned without modification
                 no_new_records_since_prediction_close = all(record["nadeo_timestamp"] < prediction.created_at for record in records)
                 no_playtime_since_prediction_close = all(
-                    await PlayerToTrack.get_last_played(player.id, prediction.track) < prediction.created_at for player in protagonists
+                    last_played.get((player.id, prediction.track.id), datetime.min) < prediction.created_at
+                    for player in players
                 )
-                if no_new_records_since_prediction_close and no_playtime_since_prediction_close:
-                    await distributor.void_prediction()
-                    continue
-            await distributor.handle_payout(records)
+                if not records or (no_new_records_since_prediction_close and no_playtime_since_prediction_close):
+                    records = VOID
+            ready[prediction.id] = (prediction, records)
+        await asyncio.gather(*[self.settlement_worker(ready) for _ in range(self.workers)])
 
+    async def settlement_worker(self, ready):
+        """
+        Claims the ready predictions one at a time and settles each in its own transaction.
+        The claim locks the prediction until the transaction ends, so concurrent workers (in this or other processes)
+        skip it, and a crash halfway through rolls back the whole payout. A prediction that fails to settle stays
+        unprocessed and is queued again for a later attempt.
+        """
+        while ready:
+            prediction_id = None
+            try:
+                async with Prediction._meta.db.transaction():
+                    prediction_id = await Prediction.claim(ready.keys())
+                    if prediction_id is None:
+                        return
+                    prediction, records = ready[prediction_id]
+                    distributor = await PointsDistributor.load(prediction)
+                    if records is VOID:
+                        balances = await distributor.void_prediction()
+                    else:
+                        balances = await distributor.handle_payout(records)
+                    await notify(PREDICTION_SETTLED, {
+                        "prediction": prediction_id, "club": prediction.club, "void": records is VOID,
+                        # lets leaderboards be updated in place, unless it would make the payload too large
+                        "balances": list(balances.items()) if len(balances) <= MAX_NOTIFIED_BALANCES else None
+                    })
+            except Exception:
+                if prediction_id is None:
+                    logger.exception("Claiming a prediction to settle failed")
+                    return
+                logger.exception(
+                    "Settlement of prediction %s failed, retrying in %s seconds", prediction_id, SETTLEMENT_RETRY_SECONDS
+                )
+                self.deadlines.push(prediction_id, datetime.now() + timedelta(seconds=SETTLEMENT_RETRY_SECONDS))
+            # done with it in this run either way
+            ready.pop(prediction_id)
 
-    async def update_records(self, prediction: Prediction, protagonists: list[Player]):
-        records = self.nadeo_api.get_records([player.uuid for player in protagonists], prediction.track.uuid)
+    async def update_records(self, pairs):
+        """
+        Fetches from nadeo the records of (player id, player uuid, track id, track uuid) pairs and stores them.
+        Requests are shared across predictions and capped by `calls_per_tick`, returns the new records keyed by
+        (player id, track id) and the (player id, track id) pairs that were left for the next tick.
+        """
+        ids = {(str(player_uuid), str(track_uuid)): (player, track) for player, player_uuid, track, track_uuid in pairs}
+        if not ids:
+            return {}, set()
+        records, deferred = await self.nadeo_api.get_records_bulk(ids.keys(), budget=self.calls_per_tick)
         now = datetime.now()
-        q = TrackmaniaRecord.insert()
-        for player, record in zip(protagonists, records):
-            record_time = record["recordScore"]["time"]
-            ts = datetime.fromisoformat(record["timestamp"])
-            r = TrackmaniaRecord(
-                player=player.uuid,
-                track=prediction.track.uuid,
-                time=record_time,
+        rows = []
+        for key, record in records.items():
+            player, track = ids[key]
+            # nadeo timestamps are timezone aware, the table stores local time
+            ts = datetime.fromisoformat(record["timestamp"]).astimezone().replace(tzinfo=None)
+            rows.append(TrackmaniaRecord(
+                player=player,
+                track=track,
+                time=record["recordScore"]["time"],
                 nadeo_timestamp=ts,
                 created_at=now,
-            )
-            q.add(r)
-        # TODO check for nadeo api errors
-        return await q.returning(TrackmaniaRecord.all_columns())
+            ))
+        if rows:
+            # clients may have uploaded some of them already
+            await TrackmaniaRecord.insert(*rows).on_conflict(action="DO NOTHING")
+        return {(r.player, r.track): r.to_dict() for r in rows}, {ids[key] for key in deferred}
 
 class PointsDistributor:
     """
     Class that handles points distribution for predictions.
-    NOTE: it assumes each player enters with the same fee
+    Bets are held as (player, outcome, stake) NumPy columns, payouts are computed with vectorized operations and applied
+    as (players, reasons, deltas) columns with a constant number of statements by `Prediction.settle`.
     """
-    def __init__(self, prediction: Prediction, bets: list[Bet]):
+    def __init__(self, prediction: Prediction, players, outcomes, stakes=None):
         self.prediction = prediction
-        self.bet_buckets = defaultdict(list)
-        self.total_bets = 0
-        for bet in bets:
-            self.total_bets += 1
-            self.bet_buckets[bet.outcome].append(bet)
+        self.players = np.asarray(players, dtype=np.int64)
+        self.outcomes = np.asarray(outcomes, dtype=np.int64)
+        if stakes is None:
+            # raffles are free to enter, everyone else pays the same fee
+            fee = 0 if prediction.type == PredictionType.RAFFLE else prediction.entry_fee
+            stakes = np.full(len(self.players), fee)
+        self.stakes = np.asarray(stakes, dtype=np.int64)
+        self.total_bets = len(self.players)
 
-    async def handle_payout(self, records):
-        qs = []
+    @classmethod
+    async def load(cls, prediction: Prediction):
+        return cls(prediction, *await prediction.get_bet_columns())
+
+    def split_pool(self, winners):
+        """
+        Shares the whole pool between the winning bets in proportion to their stakes, the points left over by the
+        integer division go one each to the earliest winners
+        """
+        pool = int(self.stakes.sum())
+        stakes = self.stakes[winners]
+        if not stakes.sum():
+            return np.zeros(len(winners), dtype=np.int64)
+        shares = stakes * pool // stakes.sum()
+        shares[:pool - int(shares.sum())] += 1
+        return shares
+
+    def compute_payouts(self, records):
+        """
+        Returns the (players, reasons, deltas) columns of the points won for this prediction
+        """
+        payouts = []
         # amount to be paid to the protagonist of the prediction (incentive for people to play the map)
         # this should only be added if the protagonist set a pb on the map after the prediction window closed
         # NOTE: gets 5% of total bets
-        protagonist_bonus = int(self.prediction.entry_fee * self.total_bets * 0.05)
-        if self.prediction.type == PredictionType.VERSUS:
-            # in this case we just give the points to the players that bet correctly
-            fastest_record = min(records, key=lambda r: r["time"])
-            fastest_player = fastest_record["player"]
-            multiplier = self.total_bets / len(self.bet_buckets[fastest_player])
-            # distribute bet points
-            for bet in self.bet_buckets[fastest_player]:
-                win = int(multiplier * self.prediction.entry_fee)
-                qs.append(PlayerToClub.give_points(bet.player.id, self.prediction.club, win))
+        protagonist_bonus = int(self.stakes.sum() * 0.05)
+        if self.prediction.type in (PredictionType.VERSUS, PredictionType.GUESS):
+            if self.prediction.type == PredictionType.VERSUS:
+                # in this case we just give the points to the players that bet on the fastest protagonist
+                protagonist = min(records, key=lambda r: r["time"])
+                winners = np.flatnonzero(self.outcomes == protagonist["player"])
+            else:
+                # closest guess to target time wins, shared if multiple guessed the same time
+                protagonist = records[0]
+                distance = np.abs(self.outcomes - protagonist["time"])
+                winners = np.flatnonzero(distance == distance.min()) if self.total_bets else np.empty(0, dtype=np.int64)
+            if len(winners):
+                payouts.append((self.players[winners], LedgerReason.PAYOUT, self.split_pool(winners)))
             # distribute bonus points to bet protagonist if he improved on the map after the prediction was created
-            if fastest_record["nadeo_timestamp"] > self.prediction.created_at:
-                qs.append(PlayerToClub.give_points(fastest_player, self.prediction.club, protagonist_bonus))
-            qs.append(PlayerToClub.give_points(fastest_player, self.prediction.club))
-        elif self.prediction.type == PredictionType.GUESS:
-            # closest guess to target time wins, shared if multiple guessed the same time
-            target = records[0]["time"]
-            closest_guess = min(self.bet_buckets.keys(), key=lambda guess: abs(target - guess))
-            win = int(self.prediction.entry_fee * self.total_bets / len(self.bet_buckets[closest_guess])) 
-            for bet in self.bet_buckets[target]:
-                qs.append(PlayerToClub.give_points(bet.player.id, self.prediction.club, win))
-            if records[0]["nadeo_timestamp"] > self.prediction.created_at:
-                qs.append(PlayerToClub.give_points(records[0]["player"], self.prediction.club, protagonist_bonus))
+            if protagonist["nadeo_timestamp"] > self.prediction.created_at and protagonist_bonus:
+                payouts.append(([protagonist["player"]], LedgerReason.PROTAGONIST_BONUS, [protagonist_bonus]))
         elif self.prediction.type == PredictionType.RAFFLE:
-            winner = choice(self.bet_buckets[0])
-            # in case of raffles, the entry fee field is used to indicate the amount to pay out
-            qs.append(PlayerToClub.give_points(winner.player.id, self.prediction.club, self.prediction.entry_fee))
+            entrants = np.flatnonzero(self.outcomes == 0)
+            if len(entrants):
+                # in case of raffles, the entry fee field is used to indicate the amount to pay out
+                payouts.append(([self.players[choice(entrants)]], LedgerReason.PAYOUT, [self.prediction.entry_fee]))
+        return self.columns(payouts)
+
+    def compute_refunds(self):
+        """
+        Returns the (players, reasons, deltas) columns of the stakes to give back
+        """
+        return self.columns([(self.players, LedgerReason.REFUND, self.stakes)])
+
+    @staticmethod
+    def columns(payouts):
+        """
+        Concatenates (players, reason, deltas) parts into plain lists, ready to be sent to the database
+        """
+        if not payouts:
+            return [], [], []
+        return (
+            np.concatenate([np.asarray(players, dtype=np.int64) for players, _, _ in payouts]).tolist(),
+            np.concatenate([np.full(len(players), reason) for players, reason, _ in payouts]).tolist(),
+            np.concatenate([np.asarray(deltas, dtype=np.int64) for _, _, deltas in payouts]).tolist(),
+        )
 
+    async def handle_payout(self, records):
         # marks this prediction as processed so it doesn't get picked up in the future
-        self.prediction.processed = True
-        qs.append(self.prediction.save())
-        await asyncio.gather(*qs)
+        return await self.prediction.settle(self.compute_payouts(records))
 
     async def void_prediction(self):
         """
         Return to everyone their points
         """
-        qs = []
-        for bets in self.bet_buckets.values():
-            for bet in bets:
-                qs.append(PlayerToClub.give_points(bet.player.id, self.prediction.club, bet.points))
-        self.prediction.processed = True
-        qs.append(self.prediction.save())
-        await asyncio.gather(*qs)
-        
-
-monitor = PredictionManager()
\ No newline at end of file
+        return await self.prediction.settle(self.compute_refunds())
@@ -0,0 +1,99 @@
+"""
+Rate limits shared by every worker process of a host. Token buckets live in a memory mapped file, so a limit holds
+whichever worker a request lands on, and each check only costs a byte range lock and a few struct reads.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from functools import lru_cache
+
+# a key always lives in the same set of WAYS buckets, and takes over its least recently used one when it's new.
+# Buckets left alone long enough to refill are lost without changing anything, the table is sized so that busy
+# ones aren't
+SETS = 16384
+WAYS = 4
+# key fingerprint (0 for free buckets), tokens left, time of the last check (monotonic clock, shared by processes)
+BUCKET = struct.Struct("=Qdd")
+BUCKET_SET = struct.Struct("=" + "Qdd" * WAYS)
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+@lru_cache(maxsize=65536)
+def key_digest(key: str):
+    """
+    Stable across processes, unlike `hash`
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class SharedRateLimiter:
+    """
+    Token buckets in shared memory, `hit` takes a token from the bucket of a key
+    """
+    def __init__(self, path=None, sets=SETS):
+        self.path = path or os.path.join(SHARED_DIR, "predictions-rate-limits")
+        self.sets = sets
+        self.set_size = BUCKET_SET.size
+        self.enabled = True
+        self.fd = None
+        self.buckets = None
+
+    def open(self):
+        """
+        Maps the file, created by whichever worker gets there first
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.sets * self.set_size
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self.buckets = mmap.mmap(fd, size)
+        self.fd = fd
+
+    def close(self):
+        if self.buckets is not None:
+            self.buckets.close()
+            os.close(self.fd)
+            self.fd = self.buckets = None
+
+    def hit(self, key: str, capacity, seconds, now=None):
+        """
+        Takes a token from the bucket of `key`, which holds `capacity` tokens and refills them over `seconds`.
+        Returns 0 if there was one, otherwise the seconds until there is.
+        """
+        if not self.enabled:
+            return 0
+        if self.buckets is None:
+            self.open()
+        if now is None:
+            now = time.monotonic()
+        digest = key_digest(key)
+        fingerprint = digest | 1
+        offset = (digest >> 32) % self.sets * self.set_size
+        # posix record locks are per process, so each worker waits for the others but never for itself
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.set_size, offset)
+        try:
+            buckets = BUCKET_SET.unpack_from(self.buckets, offset)
+            bucket = oldest = None
+            for way in range(0, len(buckets), 3):
+                if buckets[way] == fingerprint:
+                    bucket, tokens, checked_at = way, buckets[way + 1], buckets[way + 2]
+                    break
+                if oldest is None or buckets[way + 2] < buckets[oldest + 2]:
+                    oldest = way
+            if bucket is None:
+                bucket, tokens = oldest, capacity
+            else:
+                # the file may have outlived a reboot, which resets the clock
+                tokens = min(capacity, tokens + max(now - checked_at, 0) * capacity / seconds)
+            position = offset + bucket // 3 * BUCKET.size
+            if tokens >= 1:
+                BUCKET.pack_into(self.buckets, position, fingerprint, tokens - 1, now)
+                return 0
+            BUCKET.pack_into(self.buckets, position, fingerprint, tokens, now)
+            return (1 - tokens) * seconds / capacity
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, self.set_size, offset)
@@ -0,0 +1,66 @@
+"""
+Encoded responses of the club reads that plugins poll. Every worker keeps a version per club, bumped by the endpoints
+that change the club and by the notifications of changes made through any worker, and caches the encoded responses
+of the current versions, so polling an unchanged club neither queries the database nor encodes JSON.
+"""
+import hashlib
+from .cache import TTLCache
+from .notify import listener, notify, CLUB_UPDATED, PREDICTION_CREATED, BET_PLACED, PREDICTION_SETTLED
+
+# responses also expire, finished predictions leave the feed as time passes
+RESPONSE_TTL = 60
+RESPONSE_CACHE_SIZE = 10_000
+
+
+class ClubResponses:
+    """
+    Bounded LRU of (body, etag) keyed by (club id, club version, response key)
+    """
+    def __init__(self, ttl=RESPONSE_TTL, maxsize=RESPONSE_CACHE_SIZE):
+        # club id -> version, responses of older versions are never read again and get evicted
+        self.versions = {}
+        self.responses = TTLCache(ttl, maxsize)
+        self.callbacks = {
+            CLUB_UPDATED: self.on_change,
+            PREDICTION_CREATED: self.on_change,
+            BET_PLACED: self.on_change,
+            PREDICTION_SETTLED: self.on_change,
+        }
+
+    def version(self, club):
+        return self.versions.get(club, 0)
+
+    def bump(self, club):
+        self.versions[club] = self.version(club) + 1
+
+    async def changed(self, club):
+        """
+        Called by endpoints that change a club, bumps its version right away here and in the other workers once
+        the notification is delivered
+        """
+        self.bump(club)
+        await notify(CLUB_UPDATED, {"club": club})
+
+    def on_change(self, payload):
+        self.bump(payload["club"])
+
+    async def clear(self):
+        # changes made while the listener was disconnected are lost
+        self.responses.invalidate(lambda key: True)
+
+    async def get(self, club, key, build):
+        """
+        Returns the body and etag of a response, `build` returns the encoded body when it isn't cached.
+        The version is read first, so a response built while the club changes is stored under the old version.
+        """
+        cache_key = (club, self.version(club), *key)
+        cached = self.responses.get(cache_key)
+        if cached is None:
+            body = await build()
+            cached = (body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+            self.responses.set(cache_key, cached)
+        return cached
+
+
+responses = ClubResponses()
+listener.subscribe(responses.callbacks, on_connect=responses.clear)
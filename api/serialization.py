@@ -0,0 +1,54 @@
+"""
+Fast JSON encoding of API responses. Rows read from the database are trusted, so endpoints encode them straight to
+bytes with orjson instead of validating them into pydantic models that FastAPI would then validate and encode again.
+"""
+from datetime import timedelta
+from uuid import UUID
+import orjson
+from fastapi.responses import Response
+
+# int keys (bet pools) are sent as strings, like json.dumps does
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def iso_duration(value: timedelta):
+    """
+    ISO 8601 duration, as pydantic encodes intervals and parses them back
+    """
+    sign = "-" if value < timedelta(0) else ""
+    value = abs(value)
+    minutes, seconds = divmod(value.seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    time = ""
+    if hours:
+        time += f"{hours}H"
+    if minutes:
+        time += f"{minutes}M"
+    if seconds or value.microseconds:
+        time += f"{seconds}.{value.microseconds:06d}".rstrip("0").rstrip(".") + "S"
+    if not time and not value.days:
+        time = "0S"
+    return f"{sign}P{f'{value.days}D' if value.days else ''}{f'T{time}' if time else ''}"
+
+
+def default(value):
+    if isinstance(value, timedelta):
+        return iso_duration(value)
+    # orjson only encodes uuid.UUID itself, asyncpg returns a subclass
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content):
+    """
+    Encodes rows to JSON bytes, datetimes and UUIDs included
+    """
+    return orjson.dumps(content, default=default, option=OPTIONS)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
@@ -2,10 +2,23 @@ from piccolo.table import Table
 from piccolo.columns import *
 from piccolo.columns.m2m import M2M
 from datetime import timedelta, datetime
+from enum import IntEnum
 from piccolo.constraint import UniqueConstraint
+from piccolo.columns.combination import WhereRaw
 import asyncio
 
 STARTING_POINTS = 1000
+# points ledger rows folded into the balance snapshots by each compaction statement
+COMPACTION_BATCH = 5000
+# indexes spanning several columns or a subset of rows can't be declared on the columns: they are created by the
+# migrations, and by `create_extra_indexes` for databases built straight from the tables (i.e. tests)
+EXTRA_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS trackmania_record_player_track_created_at "
+    "ON trackmania_record (player, track, created_at)",
+    "CREATE INDEX IF NOT EXISTS prediction_unprocessed_ends_at ON prediction (ends_at) WHERE NOT processed",
+    "CREATE INDEX IF NOT EXISTS player_to_club_club_points ON player_to_club (club, points DESC, player)",
+    "CREATE INDEX IF NOT EXISTS points_ledger_tail ON points_ledger (club, player) WHERE NOT compacted",
+]
 
 class Player(Table):
     """
@@ -13,8 +26,6 @@ class Player(Table):
     """
     uuid = UUID(unique=True)
     name = Varchar()
-    # used for authentication through OpenPlanet
-    secret = Varchar(64, unique=True)
     tracks = M2M(LazyTableReference("PlayerToTrack", module_path=__name__))
     clubs = M2M(LazyTableReference("PlayerToClub", module_path=__name__))
 
@@ -44,6 +55,46 @@ class PlayerToTrack(Table):
     def get_last_played(cls, player, track):
         return cls.select(cls.last_played_at).where((cls.player == player) & (cls.track == track))
 
+    @classmethod
+    async def get_last_played_bulk(cls, pairs):
+        """
+        Bulk version of `get_last_played` for many (player, track) pairs, in a single query.
+        Returns when each pair was last played, pairs that were never played are left out.
+        """
+        if not pairs:
+            return {}
+        players, tracks = (list(column) for column in zip(*pairs))
+        rows = await cls.raw(
+            """
+            SELECT ptt.player, ptt.track, ptt.last_played_at
+            FROM unnest({}::integer[], {}::integer[]) AS r(player, track)
+            JOIN player_to_track ptt ON ptt.player = r.player AND ptt.track = r.track
+            """,
+            players, tracks
+        )
+        return {(row["player"], row["track"]): row["last_played_at"] for row in rows}
+
+    @classmethod
+    async def record_played_bulk(cls, plays):
+        """
+        Stores when (player id, track uuid, timestamp) tuples were played in a single statement, timestamps only move
+        forward. Unknown tracks are skipped.
+        """
+        if not plays:
+            return
+        players, tracks, timestamps = (list(column) for column in zip(*plays))
+        await cls.raw(
+            """
+            INSERT INTO player_to_track (player, track, last_played_at)
+            SELECT r.player, track.id, r.ts
+            FROM unnest({}::integer[], {}::uuid[], {}::timestamp[]) AS r(player, track, ts)
+            JOIN track ON track.uuid = r.track
+            ON CONFLICT (player, track) DO UPDATE
+            SET last_played_at = GREATEST(player_to_track.last_played_at, EXCLUDED.last_played_at)
+            """,
+            players, tracks, timestamps
+        )
+
 
 class TrackmaniaRecord(Table):
     """
@@ -60,6 +111,35 @@ class TrackmaniaRecord(Table):
     # since api calls to the Nadeo Services are rate limited, to avoid clogging the prediction monitor clients
     # can send this information to the server using their own token
     checked_by = Varchar(null=True)
+    # the same record can be fetched by the server and uploaded by several clients, it's stored once
+    record_constraint = UniqueConstraint(["player", "track", "nadeo_timestamp"])
+
+    @classmethod
+    async def ingest(cls, records, checked_by: int, now: datetime):
+        """
+        Stores (player uuid, track uuid, time, nadeo timestamp) records uploaded by a client in a single statement.
+        Records of unknown players or tracks and those already stored are skipped, returns how many were inserted.
+        """
+        if not records:
+            return 0
+        players, tracks, times, timestamps = (list(column) for column in zip(*records))
+        rows = await cls.raw(
+            """
+            WITH inserted AS (
+                INSERT INTO trackmania_record (player, track, time, nadeo_timestamp, created_at, checked_by)
+                SELECT player.id, track.id, r.time, r.ts, {}::timestamp,
+                    (SELECT uuid::text FROM player WHERE id = {}::integer)
+                FROM unnest({}::uuid[], {}::uuid[], {}::integer[], {}::timestamp[]) AS r(player, track, time, ts)
+                JOIN player ON player.uuid = r.player
+                JOIN track ON track.uuid = r.track
+                ON CONFLICT (player, track, nadeo_timestamp) DO NOTHING
+                RETURNING 1
+            )
+            SELECT count(*)::integer AS inserted FROM inserted
+            """,
+            now, checked_by, players, tracks, times, timestamps
+        )
+        return rows[0]["inserted"]
 
     @classmethod
     def get_first_created_after_timestamp(cls, player, track, ts: datetime):
@@ -72,6 +152,27 @@ class TrackmaniaRecord(Table):
             (cls.created_at > ts)
         ).order_by(cls.created_at).first()
 
+    @classmethod
+    def get_first_created_after_bulk(cls, lookups):
+        """
+        Bulk version of `get_first_created_after_timestamp` for many (key, player, track, timestamp) tuples, in a
+        single statement. Each returned row is the earliest record for one tuple, with the tuple's key as "key";
+        tuples without such a record have no row.
+        """
+        keys, players, tracks, timestamps = (list(column) for column in zip(*lookups)) if lookups else ([], [], [], [])
+        return cls.raw(
+            """
+            SELECT q.key, r.* FROM unnest({}::integer[], {}::integer[], {}::integer[], {}::timestamp[])
+                AS q(key, player, track, ts)
+            CROSS JOIN LATERAL (
+                SELECT * FROM trackmania_record
+                WHERE player = q.player AND track = q.track AND created_at > q.ts
+                ORDER BY created_at LIMIT 1
+            ) r
+            """,
+            keys, players, tracks, timestamps
+        )
+
 
 class Club(Table):
     """
@@ -95,6 +196,8 @@ class Club(Table):
     automated_open = Interval(default=timedelta(minutes=5))
     # when to check for prediction results after it's created
     automated_end = Interval(default=timedelta(hours=6))
+    # when automated predictions were last created for this club
+    last_automated_at = Timestamp(null=True, default=None)
 
 
 class PlayerToClub(Table):
@@ -102,17 +205,49 @@ class PlayerToClub(Table):
     Relationship table for players that are part of clubs
     """
     player = ForeignKey(Player)
-    club = ForeignKey(Club)
+    club = ForeignKey(Club, index=True)
+    # snapshot of the member's balance, changes since the last compaction are in the points ledger
     points = Integer(default=STARTING_POINTS)
     admin = Boolean()
     player_club_constraint = UniqueConstraint(["player", "club"])
 
     @classmethod
-    async def give_points(cls, player, club, points):
-        row = await cls.objects().get(
-            (cls.player == player) & (cls.club == club)
+    def get_balances(cls, club, players):
+        """
+        Current points of some members of a club: their snapshot plus the ledger rows that weren't compacted yet
+        """
+        return cls.raw(
+            """
+            SELECT ptc.player, (ptc.points + coalesce(sum(l.delta), 0))::integer AS points
+            FROM player_to_club ptc
+            LEFT JOIN points_ledger l ON l.player = ptc.player AND l.club = ptc.club AND NOT l.compacted
+            WHERE ptc.club = {}::integer AND ptc.player = ANY({}::integer[])
+            GROUP BY ptc.player, ptc.points
+            """,
+            club, list(players)
+        )
+
+    @classmethod
+    def get_ranking(cls, club):
+        """
+        Members of a club, richest first, with their rank. Members with the same points share a rank.
+        """
+        return cls.raw(
+            """
+            SELECT ptc.player AS id, player.uuid, player.name, balance.points,
+                rank() OVER (ORDER BY balance.points DESC)::integer AS rank
+            FROM player_to_club ptc
+            JOIN player ON player.id = ptc.player
+            LEFT JOIN (
+                SELECT player, sum(delta) AS delta FROM points_ledger WHERE club = {}::integer AND NOT compacted
+                GROUP BY player
+            ) tail ON tail.player = ptc.player
+            CROSS JOIN LATERAL (SELECT (ptc.points + coalesce(tail.delta, 0))::integer AS points) balance
+            WHERE ptc.club = {}::integer
+            ORDER BY balance.points DESC, ptc.player
+            """,
+            club, club
         )
-        await row.update_self({row.points: row.points + points})
 
 
 class TrackToClub(Table):
@@ -126,6 +261,12 @@ class TrackToClub(Table):
     track_club_constraint = UniqueConstraint(["track", "club"])
 
 
+class PredictionType(IntEnum):
+    VERSUS = 0
+    GUESS = 1
+    RAFFLE = 2
+
+
 class Prediction(Table):
     """
     Twitch-style predictions on TrackMania tracks
@@ -155,52 +296,326 @@ class Prediction(Table):
         """
         if not protagonists:
             protagonists = await self.get_m2m(self.protagonists)
-        return await asyncio.gather(*[TrackmaniaRecord.get_first_created_after_timestamp(
-            player=p.id,
-            track=self.track.id,
-            ts=self.ends_at
-        ) for p in protagonists])
-    
+        records = await TrackmaniaRecord.get_first_created_after_bulk([
+            (p.id, p.id, self.track.id, self.ends_at) for p in protagonists
+        ])
+        by_player = {record["key"]: record for record in records}
+        return [by_player.get(p.id) for p in protagonists]
+
+    async def settle(self, payouts: tuple[list[int], list[int], list[int]]):
+        """
+        Credits the given (players, LedgerReasons, points) columns and marks this prediction as processed in one
+        transaction, so either every point is distributed or none is. Returns the new points of the credited players.
+        """
+        balances = []
+        async with self._meta.db.transaction():
+            if payouts[0]:
+                credited = await PointsLedger.credit(self.club, self.id, payouts)
+                if credited:
+                    balances = await PlayerToClub.get_balances(self.club, {row["player"] for row in credited})
+            await Prediction.update({Prediction.processed: True}).where(Prediction.id == self.id)
+        self.processed = True
+        return {row["player"]: row["points"] for row in balances}
+
+    @classmethod
+    async def claim(cls, ids):
+        """
+        Locks one of the given predictions that is still to be settled, skipping those locked by other settlement
+        workers. Must run in a transaction, the lock is held until it ends. Returns the id, or None.
+        """
+        rows = await cls.raw(
+            "SELECT id FROM prediction WHERE id = ANY({}::integer[]) AND NOT processed "
+            "ORDER BY ends_at LIMIT 1 FOR UPDATE SKIP LOCKED",
+            list(ids)
+        )
+        return rows[0]["id"] if rows else None
+
+    @classmethod
+    def create_automated(cls, now: datetime, type: int, entry_fee: int):
+        """
+        Creates the automated predictions of every club that is due, in a single statement.
+        Each club gets `automated_amount` predictions on its least used tracks, with a random member as protagonist.
+        Returns the id, club, betting close and end of each new prediction.
+        """
+        return cls.raw(
+            """
+            WITH due AS (
+                UPDATE club SET last_automated_at = {}::timestamp
+                WHERE id IN (
+                    SELECT id FROM club
+                    WHERE automated_amount > 0
+                        AND (last_automated_at IS NULL OR last_automated_at + automated_frequency <= {}::timestamp)
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, automated_amount, automated_open, automated_end
+            ), picks AS (
+                SELECT ranked.id AS track_to_club, ranked.track, due.id AS club, member.player,
+                    nextval(pg_get_serial_sequence('prediction', 'id')) AS prediction,
+                    {}::timestamp + due.automated_open AS created_at, {}::timestamp + due.automated_end AS ends_at
+                FROM (
+                    SELECT ttc.id, ttc.track, ttc.club,
+                        row_number() OVER (PARTITION BY ttc.club ORDER BY ttc.counter, random()) AS rank
+                    FROM track_to_club ttc JOIN due ON due.id = ttc.club
+                ) ranked
+                JOIN due ON due.id = ranked.club
+                CROSS JOIN LATERAL (
+                    SELECT player FROM player_to_club WHERE club = due.id ORDER BY random() LIMIT 1
+                ) member
+                WHERE ranked.rank <= due.automated_amount
+            ), counters AS (
+                UPDATE track_to_club SET counter = counter + 1 FROM picks WHERE track_to_club.id = picks.track_to_club
+            ), predictions AS (
+                INSERT INTO prediction (id, track, club, type, entry_fee, created_at, ends_at, processed)
+                SELECT prediction, track, club, {}::smallint, {}::integer, created_at, ends_at, false FROM picks
+                RETURNING id, club, created_at, ends_at
+            ), protagonists AS (
+                INSERT INTO player_to_prediction (player, prediction) SELECT player, prediction FROM picks
+            )
+            SELECT id, club, created_at, ends_at FROM predictions
+            """,
+            now, now, now, now, type, entry_fee
+        )
+
+    @classmethod
+    def get_expired(cls, now: datetime, ids=None):
+        """
+        Predictions that ended and still need to be settled, only among `ids` if given.
+        NOTE: "NOT processed" is spelled out so that the partial index on unprocessed predictions can be used
+        """
+        query = cls.objects(cls.track).where(WhereRaw("NOT prediction.processed") & (cls.ends_at < now))
+        if ids is not None:
+            query = query.where(cls.id.is_in(list(ids)))
+        return query
+
     def get_bets(self):
         """
         Gets all bets related to this prediction
         """
         return Bet.objects(Bet.player).where(Bet.prediction == self.id)
+
+    async def get_bet_columns(self):
+        """
+        Players and outcomes of the bets on this prediction as two lists, in the order the bets were placed
+        """
+        rows = await Bet.raw(
+            "SELECT coalesce(array_agg(player ORDER BY id), ARRAY[]::integer[]) AS players, "
+            "coalesce(array_agg(outcome ORDER BY id), ARRAY[]::integer[]) AS outcomes "
+            "FROM bet WHERE prediction = {}::integer",
+            self.id
+        )
+        return rows[0]["players"], rows[0]["outcomes"]
     
     @classmethod
-    async def get_club_predictions(cls, club_id, hours=0):
+    async def get_club_feed(cls, club_id, hours=0):
         """
-        Gets all active predictions in a given club
+        Gets all active predictions in a given club, or those that ended at most "hours" ago, with their
+        protagonists and the amount of bets on each outcome.
+        The feed is built by a single statement and returned as an already encoded JSON array.
         """
-        out = []
-        # gets active predictions or those that ended at most "hours" ago
-        predictions = await cls.objects(cls.track).where(
-            (cls.club == club_id) & ((not cls.processed) | (cls.ends_at + timedelta(hours=hours) > datetime.now()))
+        rows = await cls.raw(
+            """
+            SELECT COALESCE(json_agg(feed ORDER BY feed.ends_at), '[]') AS feed FROM (
+                SELECT p.id, p.track, p.club, p.type, p.entry_fee, p.created_at, p.ends_at, p.processed,
+                    COALESCE((
+                        SELECT json_agg(json_build_object('uuid', pl.uuid, 'name', pl.name) ORDER BY pl.id)
+                        FROM player_to_prediction ptp JOIN player pl ON pl.id = ptp.player
+                        WHERE ptp.prediction = p.id
+                    ), '[]') AS protagonists,
+                    COALESCE((
+                        SELECT json_object_agg(pool.outcome, pool.bets) FROM (
+                            SELECT outcome, count(*) AS bets FROM bet WHERE bet.prediction = p.id GROUP BY outcome
+                        ) pool
+                    ), json_build_object()) AS pool
+                FROM prediction p
+                WHERE p.club = {} AND (NOT p.processed OR p.ends_at > {}::timestamp)
+            ) feed
+            """,
+            club_id, datetime.now() - timedelta(hours=hours)
         )
-        protagonists_list = await asyncio.gather(*[
-            prediction.get_m2m() for prediction in predictions
-        ])
-        for prediction, protagonists in zip(predictions, protagonists_list):
-            d = prediction.to_dict()
-            d["protagonists"] = [protagonist.to_dict() for protagonist in protagonists]
-            out.append(d)
-        return out
+        return rows[0]["feed"]
 
 class PlayerToPrediction(Table):
     """
     Relationship that tells which players are the protagonists / topic of each prediction
     """
     player = ForeignKey(Player)
-    prediction = ForeignKey(Prediction)
+    prediction = ForeignKey(Prediction, index=True)
     player_prediction_constraint = UniqueConstraint(["player", "prediction"])
 
+    @classmethod
+    async def get_protagonists(cls, predictions):
+        """
+        Protagonists of several predictions with one query, as {prediction id: [players]} in the order they were added
+        """
+        protagonists = {prediction: [] for prediction in predictions}
+        if protagonists:
+            rows = await cls.objects(cls.player).where(cls.prediction.is_in(list(protagonists))).order_by(cls.id)
+            for row in rows:
+                protagonists[row.prediction].append(row.player)
+        return protagonists
+
 
 class Bet(Table):
     """
     Relationship that tells which player is betting on which prediction
     """
     player = ForeignKey(Player)
-    prediction = ForeignKey(Prediction)
+    prediction = ForeignKey(Prediction, index=True)
     # which outcome has the player betted on
     outcome = Integer()
     bet_constraint = UniqueConstraint(["player", "prediction"])
+
+    @classmethod
+    async def place(cls, player: int, club: int, prediction: int, outcome: int, now: datetime):
+        """
+        Places a bet on a prediction of the club and records its entry fee in the points ledger. The bet is only
+        inserted while the prediction is open, the outcome is valid and the player can afford it.
+        The fee is taken from the member's snapshot by a single conditional UPDATE, so their row is only locked for the
+        duration of that statement. The UPDATE only applies if the snapshot is still the one the balance was computed
+        from: a bet or a compaction that committed in the meantime makes it miss, and the statement is run again
+        against the new balance. Credits never touch the snapshot and never wait on it.
+        Returns the id of the bet and the balance left, or None if the bet was refused.
+        """
+        while True:
+            rows = await cls.raw(
+                """
+                WITH p AS (
+                    SELECT id, CASE WHEN type = {}::smallint THEN 0 ELSE entry_fee END AS fee
+                    FROM prediction
+                    WHERE id = {}::integer AND club = {}::integer AND NOT processed AND created_at > {}::timestamp
+                    AND (type <> {}::smallint OR EXISTS (
+                        SELECT 1 FROM player_to_prediction WHERE prediction = {}::integer AND player = {}::integer
+                    ))
+                    AND NOT EXISTS (SELECT 1 FROM bet WHERE player = {}::integer AND prediction = {}::integer)
+                ), balance AS (
+                    SELECT ptc.points AS snapshot, (ptc.points + coalesce(sum(l.delta), 0))::integer AS points
+                    FROM player_to_club ptc
+                    LEFT JOIN points_ledger l ON l.player = ptc.player AND l.club = ptc.club AND NOT l.compacted
+                    WHERE ptc.player = {}::integer AND ptc.club = {}::integer
+                    GROUP BY ptc.points
+                ), debited AS (
+                    UPDATE player_to_club ptc SET points = ptc.points - p.fee
+                    FROM p, balance
+                    WHERE ptc.player = {}::integer AND ptc.club = {}::integer
+                    AND ptc.points = balance.snapshot AND balance.points >= p.fee
+                    RETURNING balance.points - p.fee AS points
+                ), placed AS (
+                    INSERT INTO bet (player, prediction, outcome)
+                    SELECT {}::integer, p.id, {}::integer FROM p, debited
+                    ON CONFLICT (player, prediction) DO NOTHING
+                    RETURNING id, prediction
+                ), debit AS (
+                    -- already part of the snapshot
+                    INSERT INTO points_ledger (player, club, prediction, reason, delta, created_at, compacted)
+                    SELECT {}::integer, {}::integer, placed.prediction, {}::smallint, -p.fee, {}::timestamp, true
+                    FROM placed, p WHERE p.fee > 0
+                )
+                SELECT (SELECT id FROM placed) AS bet, (SELECT points FROM debited) AS points,
+                    EXISTS (SELECT 1 FROM p, balance WHERE balance.points >= p.fee) AS allowed
+                """,
+                PredictionType.RAFFLE, prediction, club, now, PredictionType.VERSUS, prediction, outcome,
+                player, prediction, player, club, player, club, player, outcome,
+                player, club, LedgerReason.ENTRY_FEE, now
+            )
+            bet, points, allowed = rows[0]["bet"], rows[0]["points"], rows[0]["allowed"]
+            if bet is not None:
+                return bet, points
+            if not allowed:
+                return None
+            # the snapshot changed after the balance was read
+
+
+class LedgerReason(IntEnum):
+    PAYOUT = 0
+    PROTAGONIST_BONUS = 1
+    REFUND = 2
+    ENTRY_FEE = 3
+
+
+class PointsLedger(Table):
+    """
+    Append-only history of every change to the points of club members.
+    Rows are folded into `PlayerToClub.points` by `compact`, a balance is that snapshot plus the rows not compacted yet.
+    """
+    player = ForeignKey(Player)
+    club = ForeignKey(Club)
+    prediction = ForeignKey(Prediction, null=True)
+    # see LedgerReason
+    reason = SmallInt()
+    delta = Integer()
+    created_at = Timestamp()
+    # set once the delta is part of the member's snapshot
+    compacted = Boolean()
+    # idempotency key: a player is credited at most once per prediction for each reason
+    points_ledger_constraint = UniqueConstraint(["prediction", "player", "reason"])
+
+    @classmethod
+    def credit(cls, club, prediction, payouts: tuple[list[int], list[int], list[int]]):
+        """
+        Records the (players, reasons, points) columns of a prediction's payouts with a single insert. Payouts that were
+        already recorded are skipped, so they are never credited twice. No member row is written, so concurrent
+        settlements never wait on each other. Returns the credited players.
+        """
+        players, reasons, deltas = payouts
+        return cls.raw(
+            """
+            INSERT INTO points_ledger (player, club, prediction, reason, delta, created_at, compacted)
+            SELECT payout.player, {}::integer, {}::integer, payout.reason, payout.delta, {}::timestamp, false
+            FROM unnest({}::integer[], {}::smallint[], {}::integer[]) AS payout(player, reason, delta)
+            ON CONFLICT (prediction, player, reason) DO NOTHING
+            RETURNING player
+            """,
+            club, prediction, datetime.now(), list(players), list(reasons), list(deltas)
+        )
+
+    @classmethod
+    async def compact(cls, limit=COMPACTION_BATCH):
+        """
+        Folds up to `limit` of the oldest rows into the members' snapshots in a single statement, rows locked by
+        another compactor are skipped. Returns how many rows were folded.
+        """
+        rows = await cls.raw(
+            """
+            WITH folded AS (
+                UPDATE points_ledger SET compacted = true
+                WHERE id IN (
+                    SELECT id FROM points_ledger WHERE NOT compacted ORDER BY id LIMIT {}::integer
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING player, club, delta
+            ), snapshots AS (
+                UPDATE player_to_club SET points = player_to_club.points + total.delta
+                FROM (SELECT player, club, sum(delta)::integer AS delta FROM folded GROUP BY player, club) AS total
+                WHERE player_to_club.player = total.player AND player_to_club.club = total.club
+            )
+            SELECT count(*)::integer AS folded FROM folded
+            """,
+            limit
+        )
+        return rows[0]["folded"]
+
+
+class RevokedToken(Table):
+    """
+    Session token revoked before it expired, rows are deleted once the token would be expired anyway
+    """
+    jti = Varchar(length=16, unique=True)
+    # unix time, as in the token's "exp" claim
+    expires_at = BigInt()
+
+    @classmethod
+    def add(cls, claims):
+        return cls.insert(cls(jti=claims["jti"], expires_at=claims["exp"])).on_conflict(action="DO NOTHING")
+
+    @classmethod
+    async def get_active(cls, now: int):
+        """
+        Deletes the revocations of expired tokens and returns the others as claims
+        """
+        await cls.delete().where(cls.expires_at < now)
+        return await cls.select(cls.jti, cls.expires_at.as_alias("exp"))
+
+
+async def create_extra_indexes():
+    for ddl in EXTRA_INDEXES:
+        await Prediction.raw(ddl)
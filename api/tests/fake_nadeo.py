@@ -0,0 +1,80 @@
+"""
+Local stand-in for the Nadeo core services, used to test and benchmark `NadeoAPI` offline.
+Use `FakeNadeo().transport()` to route a client to it in-process, or run this module to serve it over HTTP.
+"""
+import base64
+import json
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from fastapi import FastAPI, Header, HTTPException, Request
+import httpx
+
+
+def encode_jwt(payload):
+    """
+    Builds an unsigned JWT-shaped token, `NadeoAPI` only reads its payload
+    """
+    def b64(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{b64({'alg': 'none'})}.{b64(payload)}.{secrets.token_hex(8)}"
+
+
+class FakeNadeo:
+    def __init__(self, token_lifetime=3600):
+        self.token_lifetime = token_lifetime
+        self.records = {}
+        self.access_tokens = set()
+        self.refresh_tokens = set()
+        self.calls = Counter()
+        self.app = FastAPI()
+        self.app.post("/v2/authentication/token/basic")(self.basic)
+        self.app.post("/v2/authentication/token/refresh")(self.refresh)
+        self.app.get("/v2/mapRecords/")(self.map_records)
+
+    def transport(self):
+        return httpx.ASGITransport(app=self.app)
+
+    def add_record(self, account_id, map_id, time, timestamp: datetime):
+        self.records[(str(account_id), str(map_id))] = {
+            "accountId": str(account_id),
+            "mapId": str(map_id),
+            "recordScore": {"time": time},
+            "timestamp": timestamp.astimezone(timezone.utc).isoformat(),
+        }
+
+    def issue(self):
+        access = encode_jwt({"exp": int(time.time()) + self.token_lifetime})
+        refresh = encode_jwt({"exp": int(time.time()) + 24 * 3600})
+        self.access_tokens.add(access)
+        self.refresh_tokens.add(refresh)
+        return {"accessToken": access, "refreshToken": refresh}
+
+    def check(self, authorization, tokens):
+        token = (authorization or "").removeprefix("nadeo_v1 t=")
+        if token not in tokens:
+            raise HTTPException(401, "invalid token")
+        return token
+
+    async def basic(self, request: Request):
+        self.calls["basic"] += 1
+        return self.issue()
+
+    async def refresh(self, authorization: str = Header(None)):
+        self.calls["refresh"] += 1
+        self.refresh_tokens.discard(self.check(authorization, self.refresh_tokens))
+        return self.issue()
+
+    async def map_records(self, accountIdList: str, mapId: str, authorization: str = Header(None)):
+        self.calls["mapRecords"] += 1
+        self.check(authorization, self.access_tokens)
+        return [
+            self.records[(account_id, mapId)] for account_id in accountIdList.split(",")
+            if (account_id, mapId) in self.records
+        ]
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(FakeNadeo().app, port=8001)
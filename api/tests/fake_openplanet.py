@@ -0,0 +1,29 @@
+"""
+Local stand-in for the OpenPlanet token validation endpoint, used to test and benchmark `/auth` offline.
+Route a client to it with `FakeOpenPlanet().transport()` and use it in place of `app.state.openplanet`.
+"""
+import secrets
+from fastapi import FastAPI, Form
+import httpx
+
+
+class FakeOpenPlanet:
+    def __init__(self):
+        # plugin token -> openplanet user
+        self.users = {}
+        self.app = FastAPI()
+        self.app.post("/api/auth/validate")(self.validate)
+
+    def transport(self):
+        return httpx.ASGITransport(app=self.app)
+
+    def issue(self, account_id, display_name):
+        """
+        Returns a token that validates as the given player
+        """
+        token = secrets.token_hex(16)
+        self.users[token] = {"account_id": str(account_id), "display_name": display_name}
+        return token
+
+    async def validate(self, token: str = Form()):
+        return self.users.get(token, {"error": "invalid token"})
@@ -0,0 +1,33 @@
+from unittest import TestCase
+from ..auth import TokenSigner, InvalidToken
+
+
+class TestTokenSigner(TestCase):
+    def setUp(self):
+        self.signer = TokenSigner({"a": b"0" * 32})
+
+    def test_verify(self):
+        token = self.signer.issue(1)
+        assert self.signer.verify(token)["sub"] == 1
+        kid, payload, signature = token.split(".")
+        # tampered, non-ASCII and expired tokens are invalid rather than errors
+        for bad in (f"{kid}.{payload}.{signature[:-1]}", f"{kid}.{payload}.{signature[:-1]}é", "é", "a.b",
+                    self.signer.issue(1, lifetime=-1)):
+            with self.assertRaises(InvalidToken):
+                self.signer.verify(bad)
+
+    def test_revoke(self):
+        token, other = self.signer.issue(1), self.signer.issue(1)
+        self.signer.revoke(self.signer.verify(token))
+        with self.assertRaises(InvalidToken):
+            self.signer.verify(token)
+        assert self.signer.verify(other)["sub"] == 1
+
+    def test_rotate(self):
+        token = self.signer.issue(1)
+        self.signer.rotate("b", b"1" * 32)
+        assert self.signer.issue(1).startswith("b.")
+        assert self.signer.verify(token)["sub"] == 1
+        self.signer.retire("a")
+        with self.assertRaises(InvalidToken):
+            self.signer.verify(token)
@@ -0,0 +1,65 @@
+from unittest import IsolatedAsyncioTestCase
+from datetime import datetime, timedelta
+import asyncio
+from ..deadlines import DeadlineQueue
+
+
+class TestDeadlineQueue(IsolatedAsyncioTestCase):
+    async def test_fires_on_deadline(self):
+        fired = []
+
+        async def on_due(ids):
+            fired.append((ids, datetime.now()))
+
+        queue = DeadlineQueue(on_due)
+        task = asyncio.create_task(queue.run())
+        start = datetime.now()
+        queue.push(1, start + timedelta(seconds=0.4))
+        await asyncio.sleep(0.05)
+        # an earlier deadline pushed later wakes the queue up sooner
+        queue.push(2, start + timedelta(seconds=0.2))
+        queue.push(2, start + timedelta(seconds=0.2))
+        await asyncio.sleep(0.6)
+        task.cancel()
+        assert [ids for ids, _ in fired] == [[2], [1]]
+        assert fired[0][1] - start < timedelta(seconds=0.3)
+        assert not queue.heap and not queue.queued
+
+    async def test_moved_deadline(self):
+        fired = []
+
+        async def on_due(ids):
+            fired.append((ids, datetime.now()))
+
+        queue = DeadlineQueue(on_due)
+        task = asyncio.create_task(queue.run())
+        start = datetime.now()
+        queue.push(1, start + timedelta(seconds=0.4))
+        queue.push(2, start + timedelta(seconds=0.1))
+        # the new deadlines replace the queued ones, earlier or later
+        queue.push(1, start + timedelta(seconds=0.1))
+        queue.push(2, start + timedelta(seconds=0.3))
+        await asyncio.sleep(0.6)
+        task.cancel()
+        assert [ids for ids, _ in fired] == [[1], [2]]
+        assert fired[0][1] - start < timedelta(seconds=0.2)
+        assert fired[1][1] - start >= timedelta(seconds=0.3)
+        assert not queue.heap and not queue.queued
+
+    async def test_survives_failures(self):
+        fired = []
+
+        async def on_due(ids):
+            fired.append(ids)
+            if ids == [1]:
+                raise RuntimeError("nadeo is down")
+
+        queue = DeadlineQueue(on_due)
+        task = asyncio.create_task(queue.run())
+        start = datetime.now()
+        queue.push(1, start + timedelta(seconds=0.1))
+        queue.push(2, start + timedelta(seconds=0.2))
+        await asyncio.sleep(0.4)
+        assert not task.done()
+        task.cancel()
+        assert fired == [[1], [2]]
@@ -1,11 +1,15 @@
 from unittest import IsolatedAsyncioTestCase
 import asyncio
+import os
 from piccolo.testing.model_builder import ModelBuilder
 from piccolo.table import create_db_tables, drop_db_tables
 from piccolo.conf.apps import Finder
 from fastapi.testclient import TestClient
-from ..endpoints import app
+from tempfile import TemporaryDirectory
+from ..endpoints import app, limiter
 from ..tables import *
+from ..auth import signer
+from datetime import datetime, timedelta
 
 client = TestClient(app)
 TABLES = Finder().get_table_classes()
@@ -13,18 +17,24 @@ TABLES = Finder().get_table_classes()
 class TestEndpoints(IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
         await create_db_tables(*TABLES),
+        # empty rate limit buckets for every test, instead of what earlier runs left in the shared file
+        self.buckets, self.limits_path = TemporaryDirectory(), limiter.path
+        limiter.path = os.path.join(self.buckets.name, "rate-limits")
 
     async def asyncTearDown(self):
         await drop_db_tables(*TABLES)
+        limiter.close()
+        limiter.path = self.limits_path
+        self.buckets.cleanup()
 
     async def test_club(self):
         await asyncio.gather(
-            ModelBuilder.build(Player, defaults={"id": 1, "name": "1", "secret": "1"}),
-            ModelBuilder.build(Player, defaults={"id": 2, "name": "2", "secret": "2"})
+            ModelBuilder.build(Player, defaults={"id": 1, "name": "1"}),
+            ModelBuilder.build(Player, defaults={"id": 2, "name": "2"})
         )
         # test club creation
-        headers1 = {"secret": "1"}
-        headers2 = {"secret": "2"}
+        headers1 = {"secret": signer.issue(1)}
+        headers2 = {"secret": signer.issue(2)}
         data = {"name": "test"}
         response = client.post("/clubs", headers=headers1, json=data)
         assert response.status_code == 200
@@ -34,24 +44,45 @@ class TestEndpoints(IsolatedAsyncioTestCase):
         response = client.get("/clubs/1", headers=headers1)
         assert response.status_code == 200
         assert response.json()["id"] == 1
+        etag = response.headers["etag"]
+        response = client.get("/clubs/1", headers={**headers1, "If-None-Match": etag})
+        assert response.status_code == 304
         new_settings = {
             "points_name": "shutupi",
             "automated_end": "PT1H"
         }
         response = client.post("/clubs/1", headers=headers1, json=new_settings)
         assert await Club.exists().where(Club.points_name == "shutupi")
+        # changes bump the club's version
+        response = client.get("/clubs/1", headers={**headers1, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()["points_name"] == "shutupi"
         response = client.get("/clubs/1", headers=headers2)
         assert response.status_code == 403
         # test club join and leave
         response = client.put("/clubs/players", headers=headers2, params=data)
-        for member in response.json()["players"]:
-            if member["name"] == "1":
-                assert member["admin"]
-            else:
-                assert not member["admin"]
+        assert response.json()["player_count"] == 2
+        response = client.get("/clubs/1/players", headers=headers2, params={"limit": 1})
+        players = response.json()["players"]
+        response = client.get("/clubs/1/players", headers=headers2, params={"cursor": response.json()["next_cursor"]})
+        assert response.json()["next_cursor"] is None
+        players += response.json()["players"]
+        assert [member["name"] for member in players] == ["1", "2"]
+        for member in players:
+            assert member["admin"] == (member["name"] == "1")
             assert member["points"] == 1000
+        # only admins can export the roster
+        response = client.get("/clubs/1/players/export", headers=headers2)
+        assert response.status_code == 403
+        response = client.get("/clubs/1/players/export", headers=headers1)
+        assert len(response.text.splitlines()) == 2
+        response = client.get("/clubs/1", headers=headers2)
+        assert response.status_code == 200
         response = client.delete("/clubs/players", headers=headers2, params=data)
         assert await PlayerToClub.count() == 1
+        # cached membership is dropped when leaving
+        response = client.get("/clubs/1", headers=headers2)
+        assert response.status_code == 403
         # test tracks addition and deletion
         data = [
             {
@@ -70,6 +101,8 @@ class TestEndpoints(IsolatedAsyncioTestCase):
         for _ in range(2):
             response = client.put("/clubs/1/tracks", headers=headers1, json=data)
             assert await Track.count() == 3
+        response = client.get("/clubs/1/tracks", headers=headers1, params={"limit": 2})
+        assert len(response.json()["tracks"]) == 2 and response.json()["next_cursor"]
         response = client.delete("/clubs/1/tracks", headers=headers1, params={"uuids": [data[2]["uuid"]]})
         assert await asyncio.gather(
             Track.count(),
@@ -77,6 +110,98 @@ class TestEndpoints(IsolatedAsyncioTestCase):
         ) == [3, 2]
         response = client.delete("/clubs/1", headers=headers1)
         assert await Club.count() == 0
+        response = client.get("/clubs/1", headers=headers1)
+        assert response.status_code == 404
+
+    async def test_session_token(self):
+        await ModelBuilder.build(Player, defaults={"id": 1, "name": "1"})
+        headers = {"secret": signer.issue(1)}
+        response = client.post("/clubs", headers=headers, json={"name": "test"})
+        assert response.status_code == 200
+        response = client.post("/clubs", headers={"secret": signer.issue(1, lifetime=-1)}, json={"name": "test2"})
+        assert response.status_code == 400
+        response = client.post("/clubs", headers={"secret": headers["secret"][:-2] + "xx"}, json={"name": "test2"})
+        assert response.status_code == 400
+        # revoked tokens are refused
+        response = client.delete("/auth", headers=headers)
+        assert response.status_code == 200
+        response = client.get("/clubs/1", headers=headers)
+        assert response.status_code == 400
 
     async def test_prediction(self):
-        pass
\ No newline at end of file
+        await asyncio.gather(
+            ModelBuilder.build(Player, defaults={"id": 1, "name": "1"}),
+            ModelBuilder.build(Player, defaults={"id": 2, "name": "2"}),
+            ModelBuilder.build(Player, defaults={"id": 3, "name": "3"}),
+            ModelBuilder.build(Track, defaults={"id": 1})
+        )
+        await Club.insert(Club(id=1, name="test"))
+        await PlayerToClub.insert(
+            PlayerToClub(player=1, club=1, admin=True),
+            PlayerToClub(player=2, club=1, points=50)
+        )
+        now = datetime.now()
+        await Prediction.insert(
+            Prediction(id=1, track=1, club=1, type=PredictionType.VERSUS, entry_fee=100,
+                       created_at=now + timedelta(minutes=5), ends_at=now + timedelta(hours=1)),
+            Prediction(id=2, track=1, club=1, type=PredictionType.GUESS, entry_fee=100,
+                       created_at=now - timedelta(minutes=5), ends_at=now + timedelta(hours=1))
+        )
+        await PlayerToPrediction.insert(PlayerToPrediction(player=1, prediction=1))
+        headers1 = {"secret": signer.issue(1)}
+        headers2 = {"secret": signer.issue(2)}
+        headers3 = {"secret": signer.issue(3)}
+        response = client.post("/clubs/1/predictions/1/bets", headers=headers1, json={"outcome": 2})
+        assert response.status_code == 400
+        response = client.post("/clubs/1/predictions/1/bets", headers=headers1, json={"outcome": 1})
+        assert response.status_code == 200
+        assert response.json()["points"] == 900
+        response = client.post("/clubs/1/predictions/1/bets", headers=headers1, json={"outcome": 1})
+        assert response.status_code == 409
+        # bets close at created_at
+        response = client.post("/clubs/1/predictions/2/bets", headers=headers1, json={"outcome": 1})
+        assert response.status_code == 409
+        response = client.post("/clubs/1/predictions/3/bets", headers=headers1, json={"outcome": 1})
+        assert response.status_code == 404
+        response = client.post("/clubs/1/predictions/1/bets", headers=headers3, json={"outcome": 1})
+        assert response.status_code == 403
+        # nothing is written when the player can't afford the entry fee
+        response = client.post("/clubs/1/bets", headers=headers2, json=[
+            {"prediction": 1, "outcome": 1}, {"prediction": 2, "outcome": 1}
+        ])
+        assert [bet["status"] for bet in response.json()] == [400, 409]
+        assert await Bet.count() == 1
+        assert await PlayerToClub.select(PlayerToClub.points).where(PlayerToClub.player == 2).first() == {"points": 50}
+        # the bets of a batch are placed in order, each against the balance left by the previous ones
+        await Prediction.insert(*[
+            Prediction(id=i, track=1, club=1, type=PredictionType.GUESS, entry_fee=500,
+                       created_at=now + timedelta(minutes=5), ends_at=now + timedelta(hours=1)) for i in (3, 4)
+        ])
+        response = client.post("/clubs/1/bets", headers=headers1, json=[
+            {"prediction": 3, "outcome": 1}, {"prediction": 4, "outcome": 1}
+        ])
+        assert [bet["status"] for bet in response.json()] == [200, 400]
+        assert response.json()[0]["bet"]["points"] == 400
+
+    async def test_records(self):
+        await asyncio.gather(
+            ModelBuilder.build(Player, defaults={"id": 1, "name": "1"}),
+            ModelBuilder.build(Track, defaults={"id": 1})
+        )
+        player, track = await asyncio.gather(
+            Player.objects().get(Player.id == 1),
+            Track.objects().get(Track.id == 1)
+        )
+        headers = {"secret": signer.issue(1)}
+        record = {"player": str(player.uuid), "track": str(track.uuid), "time": 42000,
+                  "timestamp": "2024-05-01T12:00:00+00:00"}
+        unknown_track = {**record, "track": "13f7c37b-6565-4091-81b7-bd5d834bd72f"}
+        later = {**record, "time": 41000, "timestamp": "2024-05-02T12:00:00+00:00"}
+        response = client.post("/records", headers=headers, json=[record, record, unknown_track, later])
+        assert response.json() == {"received": 4, "inserted": 2}
+        # records already stored are skipped
+        response = client.post("/records", headers=headers, json=[record])
+        assert response.json() == {"received": 1, "inserted": 0}
+        response = client.post("/records", headers=headers, json=[{**record, "time": -1}])
+        assert response.status_code == 422
+        assert await TrackmaniaRecord.count().where(TrackmaniaRecord.checked_by == str(player.uuid)) == 2
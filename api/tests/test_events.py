@@ -0,0 +1,43 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+import json
+from ..events import PoolAggregator
+
+SUBSCRIBERS = 5000
+
+
+def decode(event):
+    name, _, data = event.strip().partition("\n")
+    return name.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+class TestPoolAggregator(IsolatedAsyncioTestCase):
+    async def test_idle_subscribers(self):
+        pools = PoolAggregator()
+        pools.on_prediction_created({"id": 1, "club": 1})
+        subscriptions = [pools.subscribe(1, maxsize=8) for _ in range(SUBSCRIBERS)]
+        other_club = pools.subscribe(2)
+        # subscribers that never read are dropped once their buffer is full, the others keep up
+        readers = subscriptions[:10]
+        streams = [subscription.stream(keepalive=1) for subscription in readers]
+        received = [[] for _ in readers]
+
+        async def read():
+            # every reader gets each event before the next one is published, waiting on it rather than on timing
+            for stream, events in zip(streams, received):
+                events.append(decode(await asyncio.wait_for(anext(stream), timeout=1)))
+
+        await read()
+        for outcome in (1, 1, 2) * 4:
+            pools.on_bet_placed({"club": 1, "prediction": 1, "outcome": outcome})
+            await read()
+        pools.on_prediction_settled({"club": 1, "prediction": 1})
+        await read()
+        for events in received:
+            assert events[0] == ("snapshot", [{"prediction": 1, "pool": {}}])
+            assert events[-2] == ("pool", {"prediction": 1, "pool": {"1": 8, "2": 4}})
+            assert events[-1] == ("settled", {"club": 1, "prediction": 1, "void": False})
+        assert all(s.dropped for s in subscriptions[10:])
+        assert pools.subscribers[1] == set(readers)
+        assert other_club.queue.qsize() == 1
+        assert not pools.pools
@@ -0,0 +1,62 @@
+from unittest import IsolatedAsyncioTestCase, mock
+from piccolo.testing.model_builder import ModelBuilder
+from piccolo.conf.apps import Finder
+from piccolo.table import create_db_tables, drop_db_tables
+import asyncio
+from datetime import datetime, timedelta
+from ..heartbeats import HeartbeatBuffer, logger
+from ..tables import *
+
+TABLES = Finder().get_table_classes()
+
+
+class TestHeartbeatBuffer(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_db_tables(*TABLES)
+
+    async def asyncTearDown(self):
+        await drop_db_tables(*TABLES)
+
+    async def test_coalescing(self):
+        await asyncio.gather(
+            ModelBuilder.build(Player, defaults={"id": 1, "name": "1"}),
+            ModelBuilder.build(Player, defaults={"id": 2, "name": "2"}),
+            ModelBuilder.build(Track, defaults={"id": 1})
+        )
+        track = await Track.objects().get(Track.id == 1)
+        now = datetime.now().replace(microsecond=0)
+        buffer = HeartbeatBuffer(interval=0.05)
+        task = asyncio.create_task(buffer.run())
+        for minute in range(10):
+            buffer.add(1, track.uuid, now + timedelta(minutes=minute))
+        # out of order heartbeats don't move the timestamp back
+        buffer.add(2, track.uuid, now + timedelta(minutes=1))
+        buffer.add(2, track.uuid, now)
+        await asyncio.sleep(0.1)
+        assert buffer.written == 2 and buffer.saved == 10
+        buffer.add(1, track.uuid, now)
+        # the rest is flushed on shutdown
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        rows = await PlayerToTrack.select(PlayerToTrack.player, PlayerToTrack.last_played_at).order_by(
+            PlayerToTrack.player
+        )
+        assert rows == [
+            {"player": 1, "last_played_at": now + timedelta(minutes=9)},
+            {"player": 2, "last_played_at": now + timedelta(minutes=1)},
+        ]
+        assert buffer.received == 13 and buffer.written == 3
+
+    async def test_failed_flush(self):
+        buffer = HeartbeatBuffer(interval=0.05)
+        buffer.add(1, "track", datetime.now())
+        failing = mock.AsyncMock(side_effect=RuntimeError("database is down"))
+        with mock.patch.object(PlayerToTrack, "record_played_bulk", failing), self.assertLogs(logger) as logs:
+            task = asyncio.create_task(buffer.run())
+            await asyncio.sleep(0.08)
+            # failures are logged and the heartbeats kept, the loop goes on
+            assert not task.done()
+            assert logs.records[0].levelname == "ERROR"
+            assert len(buffer.pending) == 1 and buffer.written == 0
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
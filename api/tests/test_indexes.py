@@ -0,0 +1,103 @@
+from piccolo.testing.test_case import IsolatedAsyncioTestCase
+from piccolo.conf.apps import Finder
+from piccolo.table import create_db_tables, drop_db_tables
+
+import json
+from datetime import datetime, timedelta
+from ..tables import *
+
+TABLES = Finder().get_table_classes()
+PLAYERS = 2_000
+PREDICTIONS = 20_000
+
+
+def scans(plan):
+    """
+    Yields (node type, relation, index) for every node of an EXPLAIN plan
+    """
+    yield plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")
+    for child in plan.get("Plans", []):
+        yield from scans(child)
+
+
+class TestIndexes(IsolatedAsyncioTestCase):
+    """
+    Makes sure the hot queries keep using indexes on a dataset large enough for a sequential scan to be costly
+    """
+    async def asyncSetUp(self):
+        await drop_db_tables(*TABLES)
+        await create_db_tables(*TABLES)
+        await create_extra_indexes()
+        now = datetime.now()
+        await Club.raw("INSERT INTO club (name) SELECT i::text FROM generate_series(1, 100) AS i")
+        await Track.raw("INSERT INTO track (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, 100) AS i")
+        await Player.raw(
+            "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+            PLAYERS
+        )
+        await PlayerToClub.raw("INSERT INTO player_to_club (player, club) SELECT id, id % 100 + 1 FROM player")
+        # almost every prediction is already settled
+        await Prediction.raw(
+            "INSERT INTO prediction (track, club, ends_at, processed) "
+            "SELECT i % 100 + 1, i % 100 + 1, {}::timestamp - i * interval '1 minute', i > 100 FROM generate_series(1, {}::integer) AS i",
+            now, PREDICTIONS
+        )
+        await PlayerToPrediction.raw(
+            "INSERT INTO player_to_prediction (player, prediction) SELECT id % {}::integer + 1, id FROM prediction", PLAYERS
+        )
+        await Bet.raw(
+            "INSERT INTO bet (player, prediction, outcome) "
+            "SELECT pl.id, p.id, 0 FROM prediction p JOIN player pl ON pl.id % 200 = p.id % 200"
+        )
+        await TrackmaniaRecord.raw(
+            "INSERT INTO trackmania_record (player, track, time, nadeo_timestamp, created_at) "
+            "SELECT i % {}::integer + 1, i % 100 + 1, i, {}::timestamp - i * interval '1 second', "
+            "{}::timestamp - i * interval '1 second' FROM generate_series(1, 200000) AS i",
+            PLAYERS, now, now
+        )
+        await Prediction.raw("ANALYZE")
+
+    async def asyncTearDown(self):
+        await drop_db_tables(*TABLES)
+
+    async def explain(self, query):
+        sql, args = query.querystrings[0].compile_string(engine_type="postgres")
+        connection = await Prediction._meta.db.get_new_connection()
+        try:
+            plan = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+        finally:
+            await connection.close()
+        return list(scans(json.loads(plan)[0]["Plan"]))
+
+    async def assert_index_scan(self, query, table, index):
+        """
+        Checks that `table` is read through `index`, bitmap index scans don't name the table so the index is matched
+        by name
+        """
+        nodes = await self.explain(query)
+        assert ("Seq Scan", table, None) not in nodes, nodes
+        assert any(name == index for _, _, name in nodes), nodes
+
+    async def test_first_record_lookup(self):
+        query = TrackmaniaRecord.get_first_created_after_bulk([(1, 1, 1, datetime.now() - timedelta(days=1))])
+        await self.assert_index_scan(query, "trackmania_record", "trackmania_record_player_track_created_at")
+
+    async def test_settlement_scan(self):
+        query = Prediction.get_expired(datetime.now())
+        await self.assert_index_scan(query, "prediction", "prediction_unprocessed_ends_at")
+
+    async def test_prediction_bets(self):
+        prediction = await Prediction.objects().get(Prediction.id == 1)
+        await self.assert_index_scan(prediction.get_bets(), "bet", "bet_prediction")
+
+    async def test_club_members(self):
+        query = PlayerToClub.select().where(PlayerToClub.club == 1)
+        # the ranking index starts with the club, so it serves these lookups too
+        await self.assert_index_scan(query, "player_to_club", "player_to_club_club_points")
+
+    async def test_prediction_protagonists(self):
+        query = PlayerToPrediction.select().where(PlayerToPrediction.prediction == 1)
+        await self.assert_index_scan(query, "player_to_prediction", "player_to_prediction_prediction")
+
+    async def test_leaderboard_ranking(self):
+        await self.assert_index_scan(PlayerToClub.get_ranking(1), "player_to_club", "player_to_club_club_points")
@@ -0,0 +1,25 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+from ..leader import LeaderElection
+
+
+class TestLeaderElection(IsolatedAsyncioTestCase):
+    async def test_failover(self):
+        events = []
+        workers = [
+            LeaderElection(
+                on_elected=lambda i=i: events.append(("elected", i)),
+                on_deposed=lambda i=i: events.append(("deposed", i)),
+                interval=0.1
+            ) for i in range(2)
+        ]
+        workers[0].start()
+        await asyncio.sleep(0.3)
+        workers[1].start()
+        await asyncio.sleep(0.3)
+        assert events == [("elected", 0)]
+        # the leader going away releases the lock for the other worker
+        await workers[0].stop()
+        await asyncio.sleep(0.3)
+        assert events == [("elected", 0), ("deposed", 0), ("elected", 1)]
+        await workers[1].stop()
@@ -0,0 +1,56 @@
+from unittest import IsolatedAsyncioTestCase
+from piccolo.conf.apps import Finder
+from piccolo.table import create_db_tables, drop_db_tables
+import random
+from ..leaderboard import LeaderboardCache
+from ..tables import *
+
+TABLES = Finder().get_table_classes()
+MEMBERS = 200
+
+
+class TestLeaderboard(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_db_tables(*TABLES)
+        await Club.insert(Club(id=1, name="test"))
+        await Player.raw(
+            "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+            MEMBERS
+        )
+        # few distinct amounts, so that many members share a rank
+        await PlayerToClub.raw(
+            "INSERT INTO player_to_club (player, club, points) SELECT id, 1, (id % 7) * 100 FROM player"
+        )
+
+    async def asyncTearDown(self):
+        await drop_db_tables(*TABLES)
+
+    async def assert_ranks_match(self, board):
+        ranking = await PlayerToClub.get_ranking(1)
+        assert [(row["id"], row["rank"]) for row in ranking] == [(row["id"], row["rank"]) for row in board.top(MEMBERS)]
+        for row in ranking:
+            assert board.rank(row["id"]) == row["rank"]
+
+    async def test_incremental_updates(self):
+        cache = LeaderboardCache()
+        board = await cache.get(1)
+        assert len(board) == MEMBERS
+        await self.assert_ranks_match(board)
+        # bets and settlements move members around without reloading the leaderboard
+        rng = random.Random(0)
+        balances = [(rng.randint(1, MEMBERS), rng.randrange(0, 1000, 50)) for _ in range(50)]
+        for player, points in balances[:25]:
+            cache.on_bet_placed({"club": 1, "prediction": 1, "outcome": 0, "player": player, "points": points})
+        cache.on_prediction_settled({"club": 1, "prediction": 1, "balances": balances[25:]})
+        for player, points in balances:
+            await PlayerToClub.update({PlayerToClub.points: points}).where(
+                (PlayerToClub.player == player) & (PlayerToClub.club == 1)
+            )
+        assert await cache.get(1) is board
+        await self.assert_ranks_match(board)
+        # unknown members and oversized settlements reload the leaderboard
+        cache.on_bet_placed({"club": 1, "prediction": 1, "outcome": 0, "player": MEMBERS + 1, "points": 0})
+        assert await cache.get(1) is not board
+        board = await cache.get(1)
+        cache.on_prediction_settled({"club": 1, "prediction": 1, "balances": None})
+        assert await cache.get(1) is not board
@@ -0,0 +1,101 @@
+from unittest import IsolatedAsyncioTestCase
+from tempfile import TemporaryDirectory
+from datetime import datetime
+from uuid import uuid4
+import asyncio
+import time
+from ..nadeo_api import NadeoAPI, NadeoToken, plan_record_requests
+from .fake_nadeo import FakeNadeo, encode_jwt
+
+
+class TestNadeoAPI(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.token_dir = TemporaryDirectory()
+        self.fake = FakeNadeo()
+        self.api = NadeoAPI(
+            base_url="http://nadeo.test",
+            transport=self.fake.transport(),
+            wait_between_requests=0,
+            token_dir=self.token_dir.name
+        )
+
+    async def asyncTearDown(self):
+        await self.api.close()
+        self.token_dir.cleanup()
+
+    async def test_get_records(self):
+        players, track = [uuid4(), uuid4()], uuid4()
+        self.fake.add_record(players[0], track, 42000, datetime.now())
+        records = await self.api.get_records(players, track)
+        assert [r["recordScore"]["time"] for r in records] == [42000]
+        # token is authenticated once and then reused
+        await self.api.get_records(players, track)
+        assert self.fake.calls["basic"] == 1
+
+    async def test_token_refresh(self):
+        # tokens expiring within the refresh margin are renewed before being used
+        self.fake.token_lifetime = 60
+        await self.api.get_records([uuid4()], uuid4())
+        await self.api.get_records([uuid4()], uuid4())
+        assert self.fake.calls["basic"] == 1
+        assert self.fake.calls["refresh"] == 1
+        # a new client picks up the persisted token
+        api = NadeoAPI(base_url="http://nadeo.test", transport=self.fake.transport(), token_dir=self.token_dir.name)
+        assert api.load_token("NadeoServices") == self.api.tokens["NadeoServices"]
+        await api.close()
+
+    async def test_rate_limit_does_not_block(self):
+        self.api.wait_between_requests = 0.2
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        start = time.monotonic()
+        await asyncio.gather(*[self.api.get_records([uuid4()], uuid4()) for _ in range(3)])
+        elapsed = time.monotonic() - start
+        task.cancel()
+        # authentication + 3 calls, spaced by the wait
+        assert elapsed >= 0.6
+        assert ticks >= 30
+
+    async def test_get_records_bulk(self):
+        players, tracks = [uuid4() for _ in range(3)], [uuid4() for _ in range(2)]
+        for player in players:
+            self.fake.add_record(player, tracks[0], 42000, datetime.now())
+        self.fake.add_record(players[0], tracks[1], 43000, datetime.now())
+        pairs = [(player, track) for player in players for track in tracks]
+        records, deferred = await self.api.get_records_bulk(pairs + pairs[:2])
+        assert self.fake.calls["mapRecords"] == 2
+        assert len(records) == 4 and not deferred
+        records, deferred = await self.api.get_records_bulk(pairs, budget=1)
+        assert self.fake.calls["mapRecords"] == 3
+        assert len(deferred) == 3
+
+    async def test_get_records_bulk_budget_counts_tokens(self):
+        pairs = [(uuid4(), track) for track in (uuid4(), uuid4())]
+        # logging in takes one request of the budget
+        records, deferred = await self.api.get_records_bulk(pairs, budget=2)
+        assert self.fake.calls["basic"] == 1 and self.fake.calls["mapRecords"] == 1
+        assert len(deferred) == 1
+        # and so does a refresh, once the token is about to expire
+        token = self.api.tokens["NadeoServices"]
+        self.api.tokens["NadeoServices"] = NadeoToken(encode_jwt({"exp": int(time.time()) + 60}), token.refresh_token)
+        records, deferred = await self.api.get_records_bulk(pairs, budget=2)
+        assert self.fake.calls["refresh"] == 1 and self.fake.calls["mapRecords"] == 2
+        assert len(deferred) == 1
+        # nothing is sent without a budget left
+        records, deferred = await self.api.get_records_bulk(pairs, budget=0)
+        assert sum(self.fake.calls.values()) == 4
+        assert len(deferred) == 2
+
+    def test_plan_record_requests(self):
+        pairs = [(a, m) for a in range(250) for m in ("a", "b")]
+        plan = plan_record_requests(pairs, max_accounts=100)
+        assert len(plan) == 6
+        assert {map_id for _, map_id in plan} == {"a", "b"}
+        assert all(len(accounts) <= 100 for accounts, _ in plan)
@@ -0,0 +1,43 @@
+from unittest import TestCase
+from datetime import datetime, timedelta
+from ..prediction import PointsDistributor
+from ..tables import *
+
+now = datetime.now()
+
+
+def record(player, time, improved=True):
+    return {"player": player, "time": time, "nadeo_timestamp": now + timedelta(minutes=1 if improved else -1)}
+
+
+class TestPointsDistributor(TestCase):
+    def prediction(self, type):
+        return Prediction(id=1, club=1, type=type, entry_fee=100, created_at=now)
+
+    def test_guess(self):
+        distributor = PointsDistributor(self.prediction(PredictionType.GUESS), [1, 2, 3], [40000, 41000, 40000])
+        # the pool is shared by the closest guesses, the protagonist gets 5% of it for improving
+        assert distributor.compute_payouts([record(9, 40100)]) == (
+            [1, 3, 9], [LedgerReason.PAYOUT, LedgerReason.PAYOUT, LedgerReason.PROTAGONIST_BONUS], [150, 150, 15]
+        )
+        assert distributor.compute_payouts([record(9, 40100, improved=False)]) == (
+            [1, 3], [LedgerReason.PAYOUT] * 2, [150, 150]
+        )
+
+    def test_versus(self):
+        distributor = PointsDistributor(self.prediction(PredictionType.VERSUS), [1, 2, 3, 4], [5, 6, 6, 6])
+        players, _, deltas = distributor.compute_payouts([record(5, 42000), record(6, 41000, improved=False)])
+        # 400 points can't be split evenly, the earliest bet gets the point left over
+        assert (players, deltas) == ([2, 3, 4], [134, 133, 133])
+        assert distributor.compute_refunds() == ([1, 2, 3, 4], [LedgerReason.REFUND] * 4, [100] * 4)
+
+    def test_raffle(self):
+        distributor = PointsDistributor(self.prediction(PredictionType.RAFFLE), [1, 2], [0, 0])
+        players, _, deltas = distributor.compute_payouts(None)
+        assert players[0] in (1, 2) and deltas == [100]
+        # raffles are free to enter
+        assert distributor.compute_refunds()[2] == [0, 0]
+
+    def test_no_bets(self):
+        distributor = PointsDistributor(self.prediction(PredictionType.GUESS), [], [])
+        assert distributor.compute_payouts([record(9, 40100)]) == ([], [], [])
@@ -0,0 +1,155 @@
+from piccolo.testing.test_case import IsolatedAsyncioTestCase
+from piccolo.conf.apps import Finder
+from piccolo.table import create_db_tables, drop_db_tables
+from tempfile import TemporaryDirectory
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import mock
+from uuid import uuid4
+import asyncio
+from ..nadeo_api import NadeoAPI
+from ..notify import listener, PREDICTION_CREATED
+from ..prediction import PredictionManager, PointsDistributor, VOID, logger
+from ..tables import *
+from .fake_nadeo import FakeNadeo
+
+TABLES = Finder().get_table_classes()
+
+
+class TestSettlement(IsolatedAsyncioTestCase):
+    """
+    Settles expired predictions end to end, with records fetched from a local stand-in of nadeo
+    """
+    async def asyncSetUp(self):
+        await drop_db_tables(*TABLES)
+        await create_db_tables(*TABLES)
+        self.token_dir = TemporaryDirectory()
+        self.nadeo = FakeNadeo()
+        self.manager = self.new_manager()
+        self.now = datetime.now()
+        self.uuids = [uuid4() for _ in range(3)]
+        await Player.insert(*[Player(id=i + 1, uuid=uuid, name=str(i + 1)) for i, uuid in enumerate(self.uuids)])
+        self.track = uuid4()
+        await Track.insert(Track(id=1, uuid=self.track, name="track"))
+        await Club.insert(Club(id=1, name="club"))
+        await PlayerToClub.insert(*[PlayerToClub(player=i, club=1) for i in (1, 2, 3)])
+
+    def new_manager(self):
+        return PredictionManager(nadeo_api=NadeoAPI(
+            base_url="http://nadeo.test", transport=self.nadeo.transport(), wait_between_requests=0,
+            token_dir=self.token_dir.name
+        ))
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        self.token_dir.cleanup()
+        await drop_db_tables(*TABLES)
+
+    async def add_prediction(self, id, type, protagonists, bets):
+        await Prediction.insert(Prediction(
+            id=id, track=1, club=1, type=type, entry_fee=100,
+            created_at=self.now - timedelta(hours=2), ends_at=self.now - timedelta(hours=1)
+        ))
+        await PlayerToPrediction.insert(*[PlayerToPrediction(player=p, prediction=id) for p in protagonists])
+        await Bet.insert(*[Bet(player=player, prediction=id, outcome=outcome) for player, outcome in bets])
+
+    async def credits(self, prediction):
+        rows = await PointsLedger.select(PointsLedger.player, PointsLedger.reason, PointsLedger.delta).where(
+            PointsLedger.prediction == prediction
+        ).order_by(PointsLedger.id)
+        return [(row["player"], row["reason"], row["delta"]) for row in rows]
+
+    async def test_process_expired_predictions(self):
+        # both protagonists improved after the predictions were created, player 1 is the fastest
+        self.nadeo.add_record(self.uuids[0], self.track, 42000, self.now - timedelta(minutes=90))
+        self.nadeo.add_record(self.uuids[1], self.track, 43000, self.now - timedelta(minutes=90))
+        await self.add_prediction(1, PredictionType.GUESS, [1], [(2, 42100), (3, 50000)])
+        await self.add_prediction(2, PredictionType.VERSUS, [1, 2], [(2, 2), (3, 1)])
+        # nobody played the track of this one since it was created
+        await self.add_prediction(3, PredictionType.GUESS, [3], [(2, 1)])
+        await self.manager.process_expired_predictions()
+        assert not await Prediction.exists().where(Prediction.processed == False)
+        assert await self.credits(1) == [(2, LedgerReason.PAYOUT, 200), (1, LedgerReason.PROTAGONIST_BONUS, 10)]
+        assert await self.credits(2) == [(3, LedgerReason.PAYOUT, 200), (1, LedgerReason.PROTAGONIST_BONUS, 10)]
+        assert await self.credits(3) == [(2, LedgerReason.REFUND, 100)]
+        # the records of every protagonist on the track came from a single request
+        assert self.nadeo.calls["mapRecords"] == 1
+        assert await TrackmaniaRecord.count() == 2
+
+    async def test_deferred_by_nadeo_budget(self):
+        self.manager.calls_per_tick = 0
+        self.nadeo.add_record(self.uuids[0], self.track, 42000, self.now - timedelta(minutes=90))
+        await self.add_prediction(1, PredictionType.GUESS, [1], [(2, 42100)])
+        await self.manager.process_expired_predictions()
+        # left for when the budget reopens
+        assert await Prediction.exists().where(Prediction.processed == False)
+        assert 1 in self.manager.deadlines.queued
+
+    async def test_settle_due_ids(self):
+        for i in (1, 2):
+            await self.add_prediction(i, PredictionType.GUESS, [1], [(2, 1)])
+        # only the predictions handed over by the deadline queue are settled, the sweep catches the rest
+        await self.manager.settle([2])
+        rows = await Prediction.select(Prediction.id, Prediction.processed).order_by(Prediction.id)
+        assert rows == [{"id": 1, "processed": False}, {"id": 2, "processed": True}]
+        await self.manager.settle()
+        assert not await Prediction.exists().where(Prediction.processed == False)
+
+    async def test_close_unsubscribes(self):
+        manager = self.new_manager()
+        assert manager.on_prediction_created in listener.callbacks[PREDICTION_CREATED]
+        await manager.close()
+        assert manager.on_prediction_created not in listener.callbacks[PREDICTION_CREATED]
+        assert manager.on_listener_connect not in listener.on_connect
+        # the manager of the test is still subscribed
+        assert self.manager.on_prediction_created in listener.callbacks[PREDICTION_CREATED]
+
+    async def settle_backlog(self, managers, fail=()):
+        """
+        Runs two settlement workers per manager over every expired prediction, settling `fail` raises.
+        Returns how many times each prediction was settled.
+        """
+        settled = Counter()
+        void_prediction = PointsDistributor.void_prediction
+
+        async def settle(distributor):
+            settled[distributor.prediction.id] += 1
+            # gives the other workers a chance to claim the same prediction
+            await asyncio.sleep(0.01)
+            if distributor.prediction.id in fail:
+                raise RuntimeError("settlement failed")
+            return await void_prediction(distributor)
+
+        predictions = await Prediction.get_expired(datetime.now())
+        with mock.patch.object(PointsDistributor, "void_prediction", settle):
+            await asyncio.gather(*[
+                manager.settlement_worker(ready)
+                for manager in managers
+                for ready in [{prediction.id: (prediction, VOID) for prediction in predictions}]
+                for _ in range(2)
+            ])
+        return settled
+
+    async def test_settled_once(self):
+        for i in range(1, 21):
+            await self.add_prediction(i, PredictionType.GUESS, [1], [(2, 1)])
+        other = self.new_manager()
+        try:
+            settled = await self.settle_backlog([self.manager, other])
+        finally:
+            await other.close()
+        assert settled == {i: 1 for i in range(1, 21)}
+        assert not await Prediction.exists().where(Prediction.processed == False)
+        assert await PointsLedger.count() == 20
+
+    async def test_failed_settlement(self):
+        for i in (1, 2):
+            await self.add_prediction(i, PredictionType.GUESS, [1], [(2, 1)])
+        with self.assertLogs(logger, "ERROR"):
+            settled = await self.settle_backlog([self.manager], fail={1})
+        assert settled == {1: 1, 2: 1}
+        # rolled back, and queued to be tried again
+        rows = await Prediction.select(Prediction.id, Prediction.processed).order_by(Prediction.id)
+        assert rows == [{"id": 1, "processed": False}, {"id": 2, "processed": True}]
+        assert await PointsLedger.count() == 1
+        assert 1 in self.manager.deadlines.queued
@@ -0,0 +1,40 @@
+from unittest import TestCase
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+import os
+from ..ratelimit import SharedRateLimiter
+
+WORKERS = 4
+
+
+def take_tokens(path, attempts):
+    limiter = SharedRateLimiter(path)
+    return sum(limiter.hit("bets:player:1", 100, 60, now=0) == 0 for _ in range(attempts))
+
+
+class TestSharedRateLimiter(TestCase):
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "buckets")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_buckets(self):
+        limiter = SharedRateLimiter(self.path)
+        assert [limiter.hit("auth:address:1", 2, 60, now=0) for _ in range(3)] == [0, 0, 30]
+        # other keys have their own bucket
+        assert limiter.hit("auth:address:2", 2, 60, now=0) == 0
+        # tokens come back over time
+        assert limiter.hit("auth:address:1", 2, 60, now=15) == 15
+        assert limiter.hit("auth:address:1", 2, 60, now=30) == 0
+        # every limiter on the same file shares the buckets
+        assert SharedRateLimiter(self.path).hit("auth:address:1", 2, 60, now=30) == 30
+        limiter.enabled = False
+        assert limiter.hit("auth:address:1", 2, 60, now=30) == 0
+
+    def test_workers(self):
+        # worker processes hammering the same bucket take exactly its capacity between them
+        with get_context("fork").Pool(WORKERS) as pool:
+            taken = pool.starmap(take_tokens, [(self.path, 100)] * WORKERS)
+        assert sum(taken) == 100
@@ -0,0 +1,28 @@
+from unittest import IsolatedAsyncioTestCase
+from ..responses import ClubResponses
+
+
+class TestClubResponses(IsolatedAsyncioTestCase):
+    async def test_versions(self):
+        responses = ClubResponses()
+        builds = []
+
+        def builder(body):
+            async def build():
+                builds.append(body)
+                return body
+            return build
+
+        body, etag = await responses.get(1, ("summary",), builder(b'{"id": 1}'))
+        # polling an unchanged club doesn't build the response again
+        assert await responses.get(1, ("summary",), builder(b"unused")) == (body, etag)
+        assert builds == [b'{"id": 1}']
+        # other clubs and notifications of other clubs don't matter
+        responses.on_change({"club": 2})
+        assert await responses.get(1, ("summary",), builder(b"unused")) == (body, etag)
+        responses.on_change({"club": 1, "prediction": 1})
+        assert (await responses.get(1, ("summary",), builder(b'{"id": 2}')))[1] != etag
+        # the same content has the same etag in every worker, whatever its version
+        responses.bump(1)
+        assert (await responses.get(1, ("summary",), builder(b'{"id": 1}')))[1] == etag
+        assert builds == [b'{"id": 1}', b'{"id": 2}', b'{"id": 1}']
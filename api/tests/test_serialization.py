@@ -0,0 +1,21 @@
+from unittest import TestCase
+from datetime import datetime, timedelta
+from uuid import UUID
+import json
+from ..serialization import dumps, iso_duration
+
+
+class TestSerialization(TestCase):
+    def test_durations(self):
+        assert iso_duration(timedelta(minutes=5)) == "PT5M"
+        assert iso_duration(timedelta(days=1, hours=6)) == "P1DT6H"
+        assert iso_duration(timedelta(hours=1, seconds=1.5)) == "PT1H1.5S"
+        assert iso_duration(timedelta(0)) == "PT0S"
+        assert iso_duration(-timedelta(minutes=5)) == "-PT5M"
+
+    def test_rows(self):
+        uuid = UUID("13f7c37b-6565-4091-81b7-bd5d834bd72f")
+        row = {"uuid": uuid, "at": datetime(2024, 5, 1, 12), "open": timedelta(minutes=5), "pool": {1: 2}}
+        assert json.loads(dumps(row)) == {
+            "uuid": str(uuid), "at": "2024-05-01T12:00:00", "open": "PT5M", "pool": {"1": 2}
+        }
@@ -4,7 +4,8 @@ from piccolo.conf.apps import Finder
 from piccolo.table import create_db_tables, drop_db_tables
 
 import asyncio
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 from ..tables import *
 
 TABLES = Finder().get_table_classes()
@@ -45,4 +46,91 @@ class TestEndpoints(IsolatedAsyncioTestCase):
             m2m=Prediction.protagonists
         )
         records = await prediction.get_records()
-        assert [tr["id"] for tr in records] == [2, 4]
\ No newline at end of file
+        assert [tr["id"] for tr in records] == [2, 4]
+        # bulk lookup over several timestamps at once
+        records = await TrackmaniaRecord.get_first_created_after_bulk([
+            (10, 1, 1, timestamps[1]),
+            (20, 2, 1, timestamps[2]),
+            (30, 1, 1, timestamps[3]),
+        ])
+        assert {r["key"]: r["id"] for r in records} == {10: 2, 20: 5}
+
+    async def test_settle(self):
+        await Club.insert(Club(name="1"))
+        await PlayerToClub.insert(
+            PlayerToClub(player=1, club=1),
+            PlayerToClub(player=2, club=1),
+        )
+        await Prediction.insert(
+            Prediction(track=1, club=1, ends_at=timestamps[1])
+        )
+        prediction = await Prediction.objects().get(Prediction.id == 1)
+        payouts = ([1, 1, 2], [LedgerReason.PAYOUT, LedgerReason.PROTAGONIST_BONUS, LedgerReason.REFUND], [150, 10, 50])
+        balances = await prediction.settle(payouts)
+        assert balances == {1: STARTING_POINTS + 160, 2: STARTING_POINTS + 50}
+        assert await Prediction.exists().where(Prediction.processed == True)
+        assert await PointsLedger.count() == 3
+        # payouts are credited at most once
+        assert await prediction.settle(payouts) == {}
+        # the snapshots only change once the ledger is compacted, balances stay the same
+        points = await PlayerToClub.select(PlayerToClub.points).order_by(PlayerToClub.player).output(as_list=True)
+        assert points == [STARTING_POINTS, STARTING_POINTS]
+        assert await PointsLedger.compact(limit=2) == 2
+        assert await PointsLedger.compact() == 1
+        assert await PointsLedger.compact() == 0
+        points = await PlayerToClub.select(PlayerToClub.points).order_by(PlayerToClub.player).output(as_list=True)
+        assert points == [STARTING_POINTS + 160, STARTING_POINTS + 50]
+        balances = await PlayerToClub.get_balances(1, [1, 2])
+        assert {row["player"]: row["points"] for row in balances} == {1: STARTING_POINTS + 160, 2: STARTING_POINTS + 50}
+
+    async def test_club_feed(self):
+        await Club.insert(Club(name="1"))
+        await Prediction.insert(
+            Prediction(track=1, club=1, ends_at=timestamps[1]),
+            Prediction(track=1, club=1, ends_at=timestamps[1], processed=True),
+        )
+        await PlayerToPrediction.insert(
+            PlayerToPrediction(player=1, prediction=1),
+            PlayerToPrediction(player=2, prediction=1),
+        )
+        await Bet.insert(
+            Bet(player=1, prediction=1, outcome=2),
+            Bet(player=2, prediction=1, outcome=2),
+        )
+        feed = json.loads(await Prediction.get_club_feed(1))
+        assert [p["id"] for p in feed] == [1]
+        assert [p["name"] for p in feed[0]["protagonists"]] == ["1", "2"]
+        assert feed[0]["pool"] == {"2": 2}
+
+    async def test_create_automated(self):
+        await Club.insert(Club(name="1", automated_amount=1), Club(name="2"))
+        await Track.insert(Track(id=2))
+        await TrackToClub.insert(
+            TrackToClub(track=1, club=1, counter=5),
+            TrackToClub(track=2, club=1, counter=0),
+            TrackToClub(track=1, club=2, counter=0),
+        )
+        # club 2 has no members and gets no prediction
+        await PlayerToClub.insert(PlayerToClub(player=1, club=1))
+        now = datetime.now()
+        created = await Prediction.create_automated(now, 1, 100)
+        assert len(created) == 1
+        prediction = await Prediction.objects().get(Prediction.id == created[0]["id"])
+        assert (prediction.track, prediction.club, prediction.entry_fee) == (2, 1, 100)
+        assert prediction.ends_at == now + timedelta(hours=6)
+        assert await PlayerToPrediction.exists().where(
+            (PlayerToPrediction.player == 1) & (PlayerToPrediction.prediction == prediction.id)
+        )
+        assert await TrackToClub.exists().where((TrackToClub.track == 2) & (TrackToClub.counter == 1))
+        # clubs aren't due again until their frequency elapsed
+        assert await Prediction.create_automated(now + timedelta(minutes=1), 1, 100) == []
+        assert len(await Prediction.create_automated(now + timedelta(minutes=30), 1, 100)) == 1
+
+    async def test_last_played_bulk(self):
+        await ModelBuilder.build(Track, defaults={"id": 2})
+        await PlayerToTrack.insert(
+            PlayerToTrack(player=1, track=1, last_played_at=timestamps[1]),
+            PlayerToTrack(player=2, track=2, last_played_at=timestamps[2]),
+        )
+        last_played = await PlayerToTrack.get_last_played_bulk({(1, 1), (2, 1), (2, 2)})
+        assert last_played == {(1, 1): timestamps[1], (2, 2): timestamps[2]}
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -7,6 +8,10 @@ from piccolo_admin.endpoints import create_admin
 
 from api.endpoints import app as api
 from api.piccolo_app import APP_CONFIG
+from api.leader import LeaderElection
+from api.prediction import PredictionManager
+from api.heartbeats import heartbeats
+from api.notify import listener
 
 
 
@@ -30,7 +35,22 @@ async def close_database_connection_pool():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await open_database_connection_pool()
+    # every worker competes for leadership, only the leader runs the scheduler
+    manager = PredictionManager()
+    election = LeaderElection(on_elected=manager.start, on_deposed=manager.shutdown)
+    election.start()
+    # one connection per worker listens to the changes made by any of them, for the live pools, leaderboards,
+    # cached responses and the leader's deadlines
+    notifications = asyncio.create_task(listener.run())
+    flusher = asyncio.create_task(heartbeats.run())
     yield
+    notifications.cancel()
+    # the last heartbeats are written when the flusher is cancelled
+    flusher.cancel()
+    await asyncio.gather(flusher, return_exceptions=True)
+    await election.stop()
+    await manager.close()
+    await api.state.openplanet.aclose()
     await close_database_connection_pool()
 
 
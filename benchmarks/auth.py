@@ -0,0 +1,32 @@
+"""
+Per-request authentication overhead: in-process token verification against a primary key lookup of the player,
+the lower bound of any database backed check.
+"""
+import time
+from api.auth import signer
+from api.tables import Player
+from .common import Timer, connection_pool, reset_db, run
+
+ITERATIONS = 100_000
+LOOKUPS = 1_000
+
+
+async def main():
+    token = signer.issue(1)
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        signer.verify(token)
+    elapsed = time.perf_counter() - start
+    print(f"token verification: {elapsed / ITERATIONS * 1e6:.2f} us per request")
+    timer = Timer()
+    async with connection_pool():
+        await reset_db()
+        await Player.insert(Player(uuid="13f7c37b-6565-4091-81b7-bd5d834bd72f", name="bench"))
+        async with timer(f"{LOOKUPS} player lookups"):
+            for _ in range(LOOKUPS):
+                await Player.objects().get(Player.id == 1)
+    print(f"database lookup: {min(timer.samples[f'{LOOKUPS} player lookups']) / LOOKUPS * 1e6:.2f} us per request")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,49 @@
+"""
+Time taken by a tick of the automated prediction generator when every club is due.
+"""
+from datetime import datetime
+from api.prediction import AUTOMATED_ENTRY_FEE, PredictionType
+from api.tables import *
+from .common import Timer, connection_pool, reset_db, run
+
+CLUBS = (1000, 10000)
+TRACKS_PER_CLUB = 10
+MEMBERS_PER_CLUB = 20
+
+
+async def seed(clubs):
+    await reset_db()
+    await Club.raw("INSERT INTO club (name) SELECT i::text FROM generate_series(1, {}::integer) AS i", clubs)
+    await Track.raw(
+        "INSERT INTO track (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        TRACKS_PER_CLUB * 10
+    )
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        clubs * MEMBERS_PER_CLUB // 10
+    )
+    await TrackToClub.raw(
+        "INSERT INTO track_to_club (track, club, counter) "
+        "SELECT t.id, c.id, (t.id * c.id) % 7 FROM club c JOIN track t ON t.id % 10 = c.id % 10"
+    )
+    await PlayerToClub.raw(
+        "INSERT INTO player_to_club (player, club) "
+        "SELECT p.id, c.id FROM club c JOIN player p ON p.id % {}::integer = c.id % {}::integer",
+        clubs // 10, clubs // 10
+    )
+    await Club.raw("ANALYZE")
+
+
+async def main():
+    timer = Timer()
+    async with connection_pool():
+        for clubs in CLUBS:
+            await seed(clubs)
+            async with timer(f"automated predictions, {clubs} clubs"):
+                created = await Prediction.create_automated(datetime.now(), PredictionType.GUESS, AUTOMATED_ENTRY_FEE)
+            print(f"{clubs} clubs: {len(created)} predictions created")
+    timer.report()
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,82 @@
+"""
+Load test of the bet placement endpoint: every member of a club bets on the same prediction at once, as they do
+when an automated prediction opens. Some members can't afford the entry fee and every bet is sent twice, yet no
+balance may go negative and exactly one fee must be taken per placed bet.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from httpx import ASGITransport, AsyncClient
+from api.auth import signer
+from api.endpoints import app
+from api.tables import *
+from .common import connection_pool, percentile, reset_db, run
+
+MEMBERS = 3000
+ENTRY_FEE = 100
+# every n-th member only has half of the entry fee
+BROKE_EVERY = 4
+
+
+async def seed():
+    await reset_db()
+    now = datetime.now()
+    await Club.insert(Club(id=1, name="bench"))
+    await Track.insert(Track(id=1, name="bench"))
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        MEMBERS
+    )
+    await PlayerToClub.raw(
+        "INSERT INTO player_to_club (player, club, points) "
+        "SELECT id, 1, CASE WHEN id % {}::integer = 0 THEN {}::integer ELSE {}::integer END FROM player",
+        BROKE_EVERY, ENTRY_FEE // 2, STARTING_POINTS
+    )
+    await Prediction.insert(Prediction(
+        id=1, track=1, club=1, type=PredictionType.GUESS, entry_fee=ENTRY_FEE,
+        created_at=now + timedelta(minutes=5), ends_at=now + timedelta(hours=1)
+    ))
+    await Club.raw("ANALYZE")
+
+
+async def main():
+    async with connection_pool():
+        await seed()
+        latencies = []
+        statuses = {}
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            async def bet(player, guess):
+                start = time.perf_counter()
+                response = await client.post(
+                    "/clubs/1/predictions/1/bets",
+                    headers={"secret": signer.issue(player)},
+                    json={"outcome": guess}
+                )
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*[bet(player, 30000 + i) for player in range(1, MEMBERS + 1) for i in range(2)])
+            elapsed = time.perf_counter() - start
+        # entry fees are taken from the snapshots right away, this folds anything else left in the ledger
+        while await PointsLedger.compact():
+            pass
+        bets, negative, points = await asyncio.gather(
+            Bet.count(),
+            PlayerToClub.count().where(PlayerToClub.points < 0),
+            PlayerToClub.raw("SELECT sum(points)::integer AS total FROM player_to_club")
+        )
+    expected_bets = MEMBERS - MEMBERS // BROKE_EVERY
+    expected_points = (
+        expected_bets * (STARTING_POINTS - ENTRY_FEE) + (MEMBERS // BROKE_EVERY) * (ENTRY_FEE // 2)
+    )
+    print(f"{len(latencies)} requests in {elapsed:.2f} s, statuses {statuses}")
+    print(f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+    assert negative == 0, f"{negative} negative balances"
+    assert bets == expected_bets, f"{bets} bets placed, expected {expected_bets}"
+    assert points[0]["total"] == expected_points, f"{points[0]['total']} points left, expected {expected_points}"
+    print("no negative balances, one entry fee taken per placed bet")
+
+
+if __name__ == "__main__":
+    run(main)
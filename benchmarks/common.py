@@ -0,0 +1,94 @@
+"""
+Helpers shared by the benchmark scripts.
+Benchmarks need a real Postgres database and recreate every table, so run them against the test one:
+
+    PICCOLO_CONF=piccolo_conf_test python -m benchmarks.<name>
+"""
+import asyncio
+import json
+import subprocess
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from piccolo.conf.apps import Finder
+from piccolo.engine import engine_finder
+from piccolo.table import create_db_tables, drop_db_tables
+
+TABLES = Finder().get_table_classes()
+# JSON results of the runs, to compare them over time
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+async def reset_db():
+    await drop_db_tables(*TABLES)
+    await create_db_tables(*TABLES)
+
+
+@asynccontextmanager
+async def connection_pool():
+    engine = engine_finder()
+    await engine.start_connection_pool()
+    try:
+        yield engine
+    finally:
+        await engine.close_connection_pool()
+
+
+class Timer:
+    """
+    Collects wall clock timings, `async with timer("name"):` adds one sample
+    """
+    def __init__(self):
+        self.samples = {}
+
+    @asynccontextmanager
+    async def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - start)
+
+    def report(self):
+        for name, samples in self.samples.items():
+            best = min(samples) * 1000
+            print(f"{name:<40} best {best:10.2f} ms over {len(samples)} run(s)")
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def latency_summary(samples):
+    """
+    p50/p95/p99 of wall clock samples, in milliseconds
+    """
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {f"p{p}_ms": round(percentile(samples, p / 100) * 1000, 3) for p in (50, 95, 99)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name, results):
+    """
+    Writes the results of a run to `benchmarks/results/<name>-<timestamp>.json`, returns the path
+    """
+    now = datetime.now()
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"{name}-{now:%Y%m%dT%H%M%S}.json"
+    path.write_text(json.dumps({"benchmark": name, "ran_at": now.isoformat(), "commit": git_commit(), **results}, indent=2))
+    return path
+
+
+def run(main):
+    asyncio.run(main())
@@ -0,0 +1,281 @@
+"""
+End-to-end load test: seeds synthetic clubs, players and tracks, drives the endpoints the plugin uses through the
+ASGI app, then settles every prediction against local stand-ins of Nadeo and OpenPlanet.
+Reports throughput and p50/p95/p99 latency per endpoint and saves them to `benchmarks/results/`.
+
+    PICCOLO_CONF=piccolo_conf_test python -m benchmarks.e2e [small|medium|large]
+"""
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+import httpx
+from piccolo.testing.model_builder import ModelBuilder
+from api.auth import signer
+from api.endpoints import app, limiter
+from api.nadeo_api import NadeoAPI
+from api.prediction import PredictionManager
+from api.tables import *
+from api.tests.fake_nadeo import FakeNadeo
+from api.tests.fake_openplanet import FakeOpenPlanet
+from .common import connection_pool, latency_summary, reset_db, run, save_results
+
+SCALES = {
+    "small": {"clubs": 4, "members": 25, "tracks": 10, "predictions": 2},
+    "medium": {"clubs": 20, "members": 100, "tracks": 50, "predictions": 4},
+    "large": {"clubs": 50, "members": 400, "tracks": 200, "predictions": 8},
+}
+# requests in flight at once
+CONCURRENCY = 64
+ENTRY_FEE = 100
+PROTAGONISTS = 2
+# sessions opened through /auth, the other players get a token directly
+LOGINS = 200
+RECORDS_PER_UPLOAD = 20
+# rows per insert, below the postgres limit on query parameters
+INSERT_CHUNK = 1000
+
+
+async def insert(table, rows):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        await table.insert(*rows[i:i + INSERT_CHUNK])
+
+
+async def seed(scale):
+    """
+    Builds random players, clubs and tracks, every club plays every track and its first member is its admin.
+    Returns the members of each club as {club id: [player rows]}.
+    """
+    await reset_db()
+    await create_extra_indexes()
+    now = datetime.now()
+    player_count = scale["clubs"] * scale["members"]
+    players = await asyncio.gather(*[
+        ModelBuilder.build(Player, defaults={"id": i}, persist=False) for i in range(1, player_count + 1)
+    ])
+    tracks = await asyncio.gather(*[
+        ModelBuilder.build(Track, defaults={"id": i}, persist=False) for i in range(1, scale["tracks"] + 1)
+    ])
+    clubs = await asyncio.gather(*[
+        ModelBuilder.build(Club, defaults={
+            "id": i, "name": f"club {i}", "restricted": False, "visibility": True,
+            "automated_open": timedelta(minutes=5), "automated_end": timedelta(hours=6),
+            "automated_frequency": timedelta(minutes=30), "last_automated_at": now,
+        }, persist=False) for i in range(1, scale["clubs"] + 1)
+    ])
+    await insert(Player, players)
+    await insert(Track, tracks)
+    await insert(Club, clubs)
+    members = {club.id: players[(club.id - 1) * scale["members"]:club.id * scale["members"]] for club in clubs}
+    await insert(PlayerToClub, [
+        PlayerToClub(player=player.id, club=club, points=STARTING_POINTS, admin=i == 0)
+        for club, players in members.items() for i, player in enumerate(players)
+    ])
+    await insert(TrackToClub, [
+        TrackToClub(track=track.id, club=club.id, counter=0) for club in clubs for track in tracks
+    ])
+    # rows were inserted with explicit ids
+    for table in ("player", "track", "club"):
+        await Player.raw(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+    await Player.raw("ANALYZE")
+    return members, tracks
+
+
+class Load:
+    """
+    Sends requests with bounded concurrency and collects the latency and status codes of each endpoint
+    """
+    def __init__(self, client: httpx.AsyncClient, concurrency=CONCURRENCY):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.latencies = {}
+        self.statuses = {}
+        self.elapsed = {}
+
+    async def request(self, name, method, url, **kwargs):
+        async with self.semaphore:
+            start = time.perf_counter()
+            response = await self.client.request(method, url, **kwargs)
+            self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        statuses = self.statuses.setdefault(name, {})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return response
+
+    async def phase(self, name, requests):
+        """
+        Runs the requests of one endpoint concurrently, timing the whole batch for the throughput
+        """
+        start = time.perf_counter()
+        responses = await asyncio.gather(*requests)
+        self.elapsed[name] = time.perf_counter() - start
+        return responses
+
+    def results(self):
+        results = {}
+        for name, samples in self.latencies.items():
+            statuses = self.statuses[name]
+            results[name] = {
+                "requests": len(samples),
+                "errors": sum(count for status, count in statuses.items() if status >= 400),
+                "throughput": round(len(samples) / self.elapsed[name], 1),
+                **latency_summary(samples),
+            }
+        return results
+
+
+async def drive_endpoints(members, tracks, predictions_per_club, openplanet: FakeOpenPlanet):
+    """
+    Replays what the plugins of every member do while predictions are open, returns the per-endpoint results
+    and the ids of the predictions that were created
+    """
+    now = datetime.now()
+    headers = {player.id: {"secret": signer.issue(player.id)} for players in members.values() for player in players}
+    everyone = [(club, player) for club, players in members.items() for player in players]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        load = Load(client)
+        await load.phase("POST /auth", [
+            load.request("POST /auth", "POST", "/auth", json={"token": openplanet.issue(player.uuid, player.name)})
+            for _, player in everyone[:LOGINS]
+        ])
+        responses = await load.phase("GET /clubs/{id}", [
+            load.request("GET /clubs/{id}", "GET", f"/clubs/{club}", headers=headers[player.id])
+            for club, player in everyone
+        ])
+        # polling an unchanged club, answered with 304
+        await load.phase("GET /clubs/{id} revalidated", [
+            load.request("GET /clubs/{id} revalidated", "GET", f"/clubs/{club}",
+                         headers={**headers[player.id], "If-None-Match": response.headers["etag"]})
+            for (club, player), response in zip(everyone, responses)
+        ])
+        responses = await load.phase("POST /clubs/{id}/predictions", [
+            load.request("POST /clubs/{id}/predictions", "POST", f"/clubs/{club}/predictions",
+                         headers=headers[players[0].id], json={
+                             "track": random.choice(tracks).id, "type": PredictionType.GUESS,
+                             "entry_fee": ENTRY_FEE, "ends_at": (now + timedelta(hours=1, minutes=1)).isoformat(),
+                             "protagonists": [
+                                 {"uuid": str(p.uuid), "name": p.name} for p in random.sample(players, PROTAGONISTS)
+                             ],
+                         })
+            for club, players in members.items() for _ in range(predictions_per_club)
+        ])
+        predictions = {}
+        for response in responses:
+            prediction = response.json()
+            predictions.setdefault(prediction["club"], []).append(prediction["id"])
+        await load.phase("GET /clubs/{id}/predictions", [
+            load.request("GET /clubs/{id}/predictions", "GET", f"/clubs/{club}/predictions",
+                         headers=headers[player.id])
+            for club, player in everyone
+        ])
+        await load.phase("POST /clubs/{id}/predictions/{id}/bets", [
+            load.request("POST /clubs/{id}/predictions/{id}/bets", "POST",
+                         f"/clubs/{club}/predictions/{prediction}/bets",
+                         headers=headers[player.id], json={"outcome": random.randint(30000, 60000)})
+            for club, player in everyone for prediction in predictions.get(club, [])
+        ])
+        await load.phase("GET /clubs/{id}/leaderboard", [
+            load.request("GET /clubs/{id}/leaderboard", "GET", f"/clubs/{club}/leaderboard",
+                         headers=headers[player.id])
+            for club, player in everyone
+        ])
+        await load.phase("POST /heartbeat", [
+            load.request("POST /heartbeat", "POST", "/heartbeat", headers=headers[player.id],
+                         json={"track": str(random.choice(tracks).uuid)})
+            for _, player in everyone
+        ])
+        await load.phase("POST /records", [
+            load.request("POST /records", "POST", "/records", headers=headers[player.id], json=[
+                {"player": str(player.uuid), "track": str(track.uuid), "time": random.randint(30000, 60000),
+                 "timestamp": (now - timedelta(days=1)).astimezone().isoformat()}
+                for track in random.sample(tracks, min(RECORDS_PER_UPLOAD, len(tracks)))
+            ])
+            for _, player in everyone
+        ])
+    return load.results(), [prediction for ids in predictions.values() for prediction in ids]
+
+
+async def settle(predictions, nadeo: FakeNadeo):
+    """
+    Moves the predictions into the past, gives their protagonists a record on nadeo and runs settlement ticks
+    until every prediction is processed
+    """
+    now = datetime.now()
+    await Prediction.update({
+        Prediction.created_at: now - timedelta(hours=2), Prediction.ends_at: now - timedelta(hours=1)
+    }).where(Prediction.id.is_in(predictions))
+    rows = await PlayerToPrediction.select(
+        PlayerToPrediction.player.uuid, PlayerToPrediction.prediction.track.uuid
+    ).where(PlayerToPrediction.prediction.is_in(predictions))
+    for row in rows:
+        nadeo.add_record(row["player.uuid"], row["prediction.track.uuid"], random.randint(30000, 60000),
+                         now - timedelta(minutes=90))
+    bets = await Bet.count()
+    with TemporaryDirectory() as token_dir:
+        nadeo_api = NadeoAPI(base_url="http://nadeo.test", transport=nadeo.transport(), wait_between_requests=0,
+                             token_dir=token_dir)
+        manager = PredictionManager(nadeo_api=nadeo_api)
+        ticks = []
+        start = time.perf_counter()
+        while await Prediction.exists().where(Prediction.processed == False):
+            tick = time.perf_counter()
+            await manager.process_expired_predictions()
+            ticks.append(time.perf_counter() - tick)
+        elapsed = time.perf_counter() - start
+        await manager.close()
+    start = time.perf_counter()
+    folded = 0
+    while batch := await PointsLedger.compact():
+        folded += batch
+    compaction = time.perf_counter() - start
+    assert not await PlayerToClub.exists().where(PlayerToClub.points < 0), "negative balance after settlement"
+    return {
+        "predictions": len(predictions),
+        "bets": bets,
+        "ticks": len(ticks),
+        "nadeo_calls": sum(nadeo.calls.values()),
+        "predictions_per_second": round(len(predictions) / elapsed, 1),
+        "bets_per_second": round(bets / elapsed, 1),
+        "ledger_rows_compacted": folded,
+        "compaction_seconds": round(compaction, 3),
+        **{f"tick_{key}": value for key, value in latency_summary(ticks).items()},
+    }
+
+
+def report(results):
+    for name, endpoint in results["endpoints"].items():
+        print(f"{name:<40} {endpoint['requests']:>7} req {endpoint['errors']:>5} err "
+              f"{endpoint['throughput']:>9.1f} req/s  p50 {endpoint['p50_ms']:8.2f} ms  "
+              f"p95 {endpoint['p95_ms']:8.2f} ms  p99 {endpoint['p99_ms']:8.2f} ms")
+    settlement = results["settlement"]
+    print(f"settlement: {settlement['predictions']} predictions, {settlement['bets']} bets in {settlement['ticks']} "
+          f"tick(s), {settlement['predictions_per_second']} predictions/s, {settlement['bets_per_second']} bets/s, "
+          f"{settlement['nadeo_calls']} nadeo calls")
+
+
+async def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else "small"
+    scale = SCALES[name]
+    random.seed(0)
+    openplanet, nadeo = FakeOpenPlanet(), FakeNadeo()
+    production_openplanet = app.state.openplanet
+    app.state.openplanet = httpx.AsyncClient(base_url="http://openplanet.test", transport=openplanet.transport())
+    # logins all come from the same address, and the load is meant to go past what the limits allow
+    limiter.enabled = False
+    try:
+        async with connection_pool():
+            members, tracks = await seed(scale)
+            endpoints, predictions = await drive_endpoints(members, tracks, scale["predictions"], openplanet)
+            settlement = await settle(predictions, nadeo)
+    finally:
+        await app.state.openplanet.aclose()
+        app.state.openplanet = production_openplanet
+        limiter.enabled = True
+    results = {"scale": name, **scale, "endpoints": endpoints, "settlement": settlement}
+    report(results)
+    print(f"results saved to {save_results('e2e', results)}")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,49 @@
+"""
+Cost of fanning out live pool events to the idle subscribers of a club: time to deliver a burst of bets to every
+subscriber and memory held per subscriber. No database is needed, the notifications are fed to the aggregator.
+"""
+import asyncio
+import time
+import tracemalloc
+from api.events import PoolAggregator
+from .common import run
+
+SUBSCRIBERS = 5000
+BETS = 200
+
+
+async def main():
+    pools = PoolAggregator()
+    pools.on_prediction_created({"id": 1, "club": 1})
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subscriptions = [pools.subscribe(1) for _ in range(SUBSCRIBERS)]
+    per_subscriber = (tracemalloc.get_traced_memory()[0] - before) / SUBSCRIBERS
+    tracemalloc.stop()
+    delivered = 0
+
+    async def read(subscription):
+        nonlocal delivered
+        async for event in subscription.stream():
+            if event.startswith("event: pool"):
+                delivered += 1
+
+    tasks = [asyncio.create_task(read(subscription)) for subscription in subscriptions]
+    start = time.perf_counter()
+    for i in range(BETS):
+        pools.on_bet_placed({"club": 1, "prediction": 1, "outcome": i % 3})
+        # let the subscribers drain, as the event loop would between notifications
+        await asyncio.sleep(0)
+    while any(not subscription.dropped and not subscription.queue.empty() for subscription in subscriptions):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    dropped = sum(subscription.dropped for subscription in subscriptions)
+    print(f"{SUBSCRIBERS} subscribers, {per_subscriber / 1024:.2f} KiB each")
+    print(f"{delivered} pool events delivered in {elapsed * 1000:.2f} ms, "
+          f"{elapsed / BETS * 1000:.3f} ms per bet, {dropped} subscribers dropped")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,54 @@
+"""
+Playtime heartbeats written through the coalescing buffer against one upsert per heartbeat.
+"""
+import random
+from datetime import datetime, timedelta
+from api.heartbeats import HeartbeatBuffer
+from api.tables import *
+from .common import Timer, connection_pool, reset_db, run
+
+PLAYERS = 5000
+TRACKS = 20
+# heartbeats sent by every player between two flushes
+HEARTBEATS_PER_FLUSH = 5
+SINGLE_ROW_SAMPLE = 2000
+
+
+async def seed():
+    await reset_db()
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        PLAYERS
+    )
+    await Track.raw(
+        "INSERT INTO track (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        TRACKS
+    )
+    tracks = [row["uuid"] for row in await Track.select(Track.uuid)]
+    # every player keeps playing the same track
+    return {player: random.choice(tracks) for player in range(1, PLAYERS + 1)}
+
+
+async def main():
+    timer = Timer()
+    async with connection_pool():
+        playing = await seed()
+        now = datetime.now()
+        heartbeats = [
+            (player, track, now + timedelta(minutes=minute))
+            for minute in range(HEARTBEATS_PER_FLUSH) for player, track in playing.items()
+        ]
+        buffer = HeartbeatBuffer()
+        async with timer(f"buffered, {len(heartbeats)} heartbeats"):
+            for heartbeat in heartbeats:
+                buffer.add(*heartbeat)
+            await buffer.flush()
+        print(f"{buffer.received} heartbeats, {buffer.written} rows written, {buffer.saved} writes saved")
+        async with timer(f"one upsert per heartbeat, {SINGLE_ROW_SAMPLE} heartbeats"):
+            for heartbeat in heartbeats[:SINGLE_ROW_SAMPLE]:
+                await PlayerToTrack.record_played_bulk([heartbeat])
+    timer.report()
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,118 @@
+"""
+Contention between concurrent settlements paying the same club members: crediting the points in place, as settlement
+used to, against appending to the points ledger and compacting it afterwards.
+Lock waits are sampled from pg_stat_activity while the settlements run.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+import asyncpg
+from api.tables import *
+from .common import connection_pool, reset_db, run
+
+MEMBERS = 500
+PREDICTIONS = 400
+WORKERS = 8
+PAYOUT = 10
+
+
+async def seed():
+    await reset_db()
+    await create_extra_indexes()
+    now = datetime.now()
+    await Club.insert(Club(name="bench"))
+    await Track.insert(Track(name="bench"))
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        MEMBERS
+    )
+    await PlayerToClub.raw("INSERT INTO player_to_club (player, club) SELECT id, 1 FROM player")
+    await Prediction.raw(
+        "INSERT INTO prediction (track, club, type, entry_fee, created_at, ends_at, processed) "
+        "SELECT 1, 1, {}::smallint, {}::integer, {}::timestamp, {}::timestamp, false FROM generate_series(1, {}::integer)",
+        PredictionType.GUESS, PAYOUT, now - timedelta(hours=2), now - timedelta(hours=1), PREDICTIONS
+    )
+    return await Prediction.objects()
+
+
+async def credit_in_place(prediction, payouts):
+    players, reasons, deltas = payouts
+    async with Prediction._meta.db.transaction():
+        await PointsLedger.raw(
+            """
+            WITH credited AS (
+                INSERT INTO points_ledger (player, club, prediction, reason, delta, created_at, compacted)
+                SELECT payout.player, {}::integer, {}::integer, payout.reason, payout.delta, {}::timestamp, true
+                FROM unnest({}::integer[], {}::smallint[], {}::integer[]) AS payout(player, reason, delta)
+                ON CONFLICT (prediction, player, reason) DO NOTHING
+                RETURNING player, delta
+            )
+            UPDATE player_to_club SET points = player_to_club.points + total.delta
+            FROM (SELECT player, sum(delta) AS delta FROM credited GROUP BY player) AS total
+            WHERE player_to_club.player = total.player AND player_to_club.club = {}::integer
+            """,
+            prediction.club, prediction.id, datetime.now(),
+            players, reasons, deltas, prediction.club
+        )
+        await Prediction.update({Prediction.processed: True}).where(Prediction.id == prediction.id)
+
+
+async def settle_all(predictions, settle):
+    """
+    Settles the predictions with concurrent workers, returns the elapsed time, the failed attempts (deadlocks) and
+    the average amount of sessions waiting on a lock
+    """
+    queue = list(predictions)
+    payouts = (list(range(1, MEMBERS + 1)), [LedgerReason.PAYOUT] * MEMBERS, [PAYOUT] * MEMBERS)
+    failures = 0
+    samples = []
+
+    async def worker():
+        nonlocal failures
+        while queue:
+            prediction = queue.pop()
+            try:
+                await settle(prediction, payouts)
+            except asyncpg.PostgresError:
+                failures += 1
+                queue.append(prediction)
+
+    async def sample_lock_waits():
+        while True:
+            rows = await Prediction.raw(
+                "SELECT count(*)::integer AS waiting FROM pg_stat_activity "
+                "WHERE wait_event_type = 'Lock' AND datname = current_database()"
+            )
+            samples.append(rows[0]["waiting"])
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample_lock_waits())
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(WORKERS)])
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    return elapsed, failures, sum(samples) / max(len(samples), 1)
+
+
+def report(name, elapsed, failures, waiting):
+    print(f"{name:<12} {PREDICTIONS / elapsed:10.1f} settlements/s, {failures} deadlocks, "
+          f"{waiting:5.2f} sessions waiting on locks on average")
+
+
+async def main():
+    async with connection_pool():
+        predictions = await seed()
+        report("in place", *await settle_all(predictions, credit_in_place))
+        predictions = await seed()
+        report("append-only", *await settle_all(predictions, lambda prediction, payouts: prediction.settle(payouts)))
+        start = time.perf_counter()
+        folded = 0
+        while batch := await PointsLedger.compact():
+            folded += batch
+        elapsed = time.perf_counter() - start
+        print(f"compaction   {folded / elapsed:10.0f} ledger rows/s")
+        assert not await PlayerToClub.exists().where(PlayerToClub.points != STARTING_POINTS + PREDICTIONS * PAYOUT)
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,45 @@
+"""
+Measures the Nadeo client against the local fake server: request throughput over the pooled session and how
+responsive the event loop stays while calls wait on the rate limit.
+"""
+import asyncio
+import time
+from tempfile import TemporaryDirectory
+from uuid import uuid4
+from api.nadeo_api import NadeoAPI
+from api.tests.fake_nadeo import FakeNadeo
+from .common import Timer, run
+
+REQUESTS = 500
+
+
+async def loop_lag(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        samples.append(time.perf_counter() - start - 0.005)
+
+
+async def main():
+    timer = Timer()
+    fake = FakeNadeo()
+    players, track = [uuid4() for _ in range(4)], uuid4()
+    with TemporaryDirectory() as token_dir:
+        api = NadeoAPI(base_url="http://nadeo.test", transport=fake.transport(), wait_between_requests=0,
+                       token_dir=token_dir)
+        async with timer(f"{REQUESTS} mapRecords calls, no spacing"):
+            await asyncio.gather(*[api.get_records(players, track) for _ in range(REQUESTS)])
+        api.wait_between_requests = 0.05
+        stop, lag = asyncio.Event(), []
+        probe = asyncio.create_task(loop_lag(stop, lag))
+        async with timer("20 mapRecords calls, 50ms spacing"):
+            await asyncio.gather(*[api.get_records(players, track) for _ in range(20)])
+        stop.set()
+        await probe
+        await api.close()
+    timer.report()
+    print(f"max event loop lag while rate limited: {max(lag) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    run(main)
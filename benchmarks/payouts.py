@@ -0,0 +1,74 @@
+"""
+CPU time spent computing the payouts of large predictions: the previous per-bet Python implementation against the
+vectorized `PointsDistributor`. No database is needed.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+from api.prediction import PointsDistributor
+from api.tables import *
+from .common import run
+
+SIZES = (1_000, 100_000, 1_000_000)
+ROUNDS = 5
+
+
+class LegacyDistributor:
+    """
+    GUESS payouts as computed before, with one list of bets per outcome
+    """
+    def __init__(self, prediction, bets):
+        self.prediction = prediction
+        self.bet_buckets = defaultdict(list)
+        self.total_bets = 0
+        for bet in bets:
+            self.total_bets += 1
+            self.bet_buckets[bet.outcome].append(bet)
+
+    def compute_payouts(self, records):
+        payouts = defaultdict(int)
+        protagonist_bonus = int(self.prediction.entry_fee * self.total_bets * 0.05)
+        target = records[0]["time"]
+        closest_guess = min(self.bet_buckets.keys(), key=lambda guess: abs(target - guess))
+        win = int(self.prediction.entry_fee * self.total_bets / len(self.bet_buckets[closest_guess]))
+        for bet in self.bet_buckets[closest_guess]:
+            payouts[(bet.player.id, LedgerReason.PAYOUT)] += win
+        if records[0]["nadeo_timestamp"] > self.prediction.created_at:
+            payouts[(records[0]["player"], LedgerReason.PROTAGONIST_BONUS)] += protagonist_bonus
+        return payouts
+
+
+def cpu_ms(compute):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.process_time()
+        compute()
+        elapsed = (time.process_time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def main():
+    now = datetime.now()
+    prediction = Prediction(id=1, club=1, type=PredictionType.GUESS, entry_fee=100, created_at=now)
+    records = [{"player": 1, "time": 45000, "nadeo_timestamp": now + timedelta(minutes=1)}]
+    rng = np.random.default_rng(0)
+    for size in SIZES:
+        players = np.arange(1, size + 1)
+        # coarse guesses, so that large pools have many winners
+        outcomes = rng.integers(300, 600, size) * 100
+        bets = [
+            SimpleNamespace(player=SimpleNamespace(id=int(player)), outcome=int(outcome))
+            for player, outcome in zip(players, outcomes)
+        ]
+        # bets are loaded from the database as plain lists
+        columns = players.tolist(), outcomes.tolist()
+        legacy = cpu_ms(lambda: LegacyDistributor(prediction, bets).compute_payouts(records))
+        vectorized = cpu_ms(lambda: PointsDistributor(prediction, *columns).compute_payouts(records))
+        print(f"{size:>9} bets: per-bet {legacy:10.2f} ms, vectorized {vectorized:8.2f} ms of CPU")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,66 @@
+"""
+Compares the club prediction feed built with one query per prediction and pydantic validation against the single
+statement `Prediction.get_club_feed`.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from api.models import PlayerModel, PredictionOut
+from api.tables import *
+from .common import Timer, connection_pool, reset_db, run
+
+SIZES = (10, 100, 1000)
+RUNS = 5
+
+
+async def seed(predictions):
+    await reset_db()
+    await Club.insert(Club(name="bench"))
+    await Track.insert(Track(uuid="13f7c37b-6565-4091-81b7-bd5d834bd72f", name="bench"))
+    await Player.raw("INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, 50) AS i")
+    ends_at = datetime.now() + timedelta(hours=1)
+    await Prediction.raw(
+        "INSERT INTO prediction (track, club, type, entry_fee, created_at, ends_at, processed) "
+        "SELECT 1, 1, 0, 100, {}::timestamp, {}::timestamp, false FROM generate_series(1, {}::integer)",
+        datetime.now(), ends_at, predictions
+    )
+    await PlayerToPrediction.raw(
+        "INSERT INTO player_to_prediction (player, prediction) "
+        "SELECT pl.id, p.id FROM prediction p JOIN player pl ON pl.id IN (p.id % 50 + 1, (p.id + 1) % 50 + 1)"
+    )
+    await Bet.raw(
+        "INSERT INTO bet (player, prediction, outcome) "
+        "SELECT pl.id, p.id, p.id % 50 + 1 FROM prediction p CROSS JOIN player pl"
+    )
+
+
+async def legacy_feed(club_id):
+    predictions = await Prediction.objects().where(
+        (Prediction.club == club_id) & (Prediction.processed == False)
+    )
+    # one query per prediction, piccolo's m2m queries can only be gathered once turned into coroutines
+    protagonists_list = await asyncio.gather(*[
+        prediction.get_m2m(Prediction.protagonists).run() for prediction in predictions
+    ])
+    out = []
+    for prediction, protagonists in zip(predictions, protagonists_list):
+        d = prediction.to_dict()
+        d["protagonists"] = [PlayerModel(**protagonist.to_dict()) for protagonist in protagonists]
+        out.append(PredictionOut(**d).model_dump_json())
+    return out
+
+
+async def main():
+    timer = Timer()
+    async with connection_pool():
+        for size in SIZES:
+            await seed(size)
+            for _ in range(RUNS):
+                async with timer(f"N+1 feed, {size} predictions"):
+                    await legacy_feed(1)
+                async with timer(f"single statement feed, {size} predictions"):
+                    await Prediction.get_club_feed(1)
+    timer.report()
+
+
+if __name__ == "__main__":
+    run(main)
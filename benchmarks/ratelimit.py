@@ -0,0 +1,43 @@
+"""
+Cost of a rate limit check against the shared memory token buckets, from one process and from several worker
+processes checking the same buckets at once. No database is needed.
+"""
+import os
+import time
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from api.ratelimit import SharedRateLimiter
+from .common import run
+
+CHECKS = 200_000
+PLAYERS = 5000
+WORKERS = (1, 2, 4, 8)
+
+
+def check(path, checks=CHECKS):
+    """
+    CPU microseconds per check of one process, cycling through the buckets of many players
+    """
+    limiter = SharedRateLimiter(path)
+    keys = [f"post_bet:player:{player}" for player in range(PLAYERS)]
+    limiter.hit(keys[0], 60, 60)
+    start = time.process_time()
+    for i in range(checks):
+        limiter.hit(keys[i % PLAYERS], 60, 60)
+    return (time.process_time() - start) / checks * 1e6
+
+
+async def main():
+    with TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "buckets")
+        for workers in WORKERS:
+            with get_context("fork").Pool(workers) as pool:
+                start = time.perf_counter()
+                per_check = pool.map(check, [path] * workers)
+                elapsed = time.perf_counter() - start
+            print(f"{workers} worker(s): {sum(per_check) / workers:6.2f} us of CPU per check, "
+                  f"{workers * CHECKS / elapsed:10.0f} checks/s in total")
+
+
+if __name__ == "__main__":
+    run(main)
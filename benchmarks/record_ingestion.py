@@ -0,0 +1,77 @@
+"""
+Throughput of client record uploads, in records per second, against inserting the same records one row at a time.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from httpx import ASGITransport, AsyncClient
+from api.auth import signer
+from api.endpoints import app, MAX_BATCH_RECORDS
+from api.tables import *
+from .common import connection_pool, reset_db, run
+
+PLAYERS = 1000
+TRACKS = 50
+RECORDS = 50_000
+# share of the uploaded records that were already stored by someone else
+DUPLICATES = 0.2
+SINGLE_ROW_SAMPLE = 2000
+
+
+async def seed():
+    await reset_db()
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        PLAYERS
+    )
+    await Track.raw(
+        "INSERT INTO track (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        TRACKS
+    )
+    players = [row["uuid"] for row in await Player.select(Player.uuid)]
+    tracks = [row["uuid"] for row in await Track.select(Track.uuid)]
+    start = datetime(2024, 1, 1)
+    return [
+        {"player": str(random.choice(players)), "track": str(random.choice(tracks)),
+         "time": random.randint(20_000, 90_000), "timestamp": (start + timedelta(seconds=i)).isoformat()}
+        for i in range(RECORDS)
+    ]
+
+
+async def main():
+    async with connection_pool():
+        records = await seed()
+        duplicates = random.sample(records, int(RECORDS * DUPLICATES))
+        await TrackmaniaRecord.ingest(
+            [(r["player"], r["track"], r["time"], datetime.fromisoformat(r["timestamp"])) for r in duplicates],
+            checked_by=1, now=datetime.now()
+        )
+        inserted = 0
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            headers = {"secret": signer.issue(1)}
+            start = time.perf_counter()
+            for i in range(0, RECORDS, MAX_BATCH_RECORDS):
+                response = await client.post("/records", headers=headers, json=records[i:i + MAX_BATCH_RECORDS])
+                inserted += response.json()["inserted"]
+            elapsed = time.perf_counter() - start
+        print(f"batched upload: {RECORDS / elapsed:12.0f} records/s ({inserted} new of {RECORDS})")
+
+        await TrackmaniaRecord.delete(force=True)
+        players = {str(row["uuid"]): row["id"] for row in await Player.select(Player.uuid, Player.id)}
+        tracks = {str(row["uuid"]): row["id"] for row in await Track.select(Track.uuid, Track.id)}
+        rows = [
+            TrackmaniaRecord(
+                player=players[r["player"]], track=tracks[r["track"]], time=r["time"],
+                nadeo_timestamp=datetime.fromisoformat(r["timestamp"]), created_at=datetime.now()
+            )
+            for r in records[:SINGLE_ROW_SAMPLE]
+        ]
+        start = time.perf_counter()
+        for row in rows:
+            await TrackmaniaRecord.insert(row)
+        elapsed = time.perf_counter() - start
+        print(f"single row inserts: {SINGLE_ROW_SAMPLE / elapsed:8.0f} records/s")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,56 @@
+"""
+Compares per-row payouts (one read and one write per winning bet) with the set-based `Prediction.settle`.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from api.tables import *
+from api.prediction import PredictionType
+from .common import Timer, connection_pool, reset_db, run
+
+SIZES = (100, 2000, 10000)
+ENTRY_FEE = 100
+
+
+async def seed(bettors):
+    await reset_db()
+    await Club.insert(Club(name="bench"))
+    await Track.insert(Track(uuid="13f7c37b-6565-4091-81b7-bd5d834bd72f", name="bench"))
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i",
+        bettors
+    )
+    await PlayerToClub.raw("INSERT INTO player_to_club (player, club, points, admin) SELECT id, 1, 1000, false FROM player")
+    now = datetime.now()
+    await Prediction.insert(Prediction(
+        track=1, club=1, type=PredictionType.GUESS, entry_fee=ENTRY_FEE,
+        created_at=now - timedelta(hours=2), ends_at=now - timedelta(hours=1)
+    ))
+    await Bet.raw("INSERT INTO bet (player, prediction, outcome) SELECT id, 1, id % 10 FROM player")
+    return await Prediction.objects().get(Prediction.id == 1)
+
+
+async def legacy_give_points(player, club, points):
+    row = await PlayerToClub.objects().get((PlayerToClub.player == player) & (PlayerToClub.club == club))
+    await row.update_self({PlayerToClub.points: row.points + points})
+
+
+async def main():
+    timer = Timer()
+    async with connection_pool():
+        for size in SIZES:
+            prediction = await seed(size)
+            players = [bet["player"] for bet in await Bet.select(Bet.player)]
+            payouts = (players, [LedgerReason.PAYOUT] * len(players), [ENTRY_FEE] * len(players))
+            async with timer(f"per-row payouts, {size} bets"):
+                await asyncio.gather(*[legacy_give_points(p, 1, ENTRY_FEE) for p in players])
+                await Prediction.update({Prediction.processed: True}).where(Prediction.id == prediction.id)
+            async with timer(f"set-based settle, {size} bets"):
+                await prediction.settle(payouts)
+            while await PointsLedger.compact():
+                pass
+            assert not await PlayerToClub.exists().where(PlayerToClub.points != 1000 + 2 * ENTRY_FEE)
+    timer.report()
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,55 @@
+"""
+Backlog drain rate of the settlement loop, in predictions per second, with different amounts of concurrent workers.
+Every prediction already has its records uploaded, so nadeo is never called.
+"""
+import time
+from datetime import datetime, timedelta
+from api.prediction import PredictionManager, PredictionType
+from api.tables import *
+from .common import connection_pool, reset_db, run
+
+BACKLOG = 2000
+BETTORS = 50
+WORKERS = (1, 4, 8)
+
+
+async def seed():
+    await reset_db()
+    await create_extra_indexes()
+    now = datetime.now()
+    await Club.insert(Club(name="bench"))
+    await Track.insert(Track(uuid="13f7c37b-6565-4091-81b7-bd5d834bd72f", name="bench"))
+    await Player.raw(
+        "INSERT INTO player (uuid, name) SELECT gen_random_uuid(), i::text FROM generate_series(1, {}::integer) AS i", BETTORS
+    )
+    await PlayerToClub.raw("INSERT INTO player_to_club (player, club, points, admin) SELECT id, 1, 1000, false FROM player")
+    await Prediction.raw(
+        "INSERT INTO prediction (track, club, type, entry_fee, created_at, ends_at, processed) "
+        "SELECT 1, 1, {}::smallint, 10, {}::timestamp, {}::timestamp, false FROM generate_series(1, {}::integer)",
+        PredictionType.GUESS, now - timedelta(hours=2), now - timedelta(hours=1), BACKLOG
+    )
+    await PlayerToPrediction.raw("INSERT INTO player_to_prediction (player, prediction) SELECT 1, id FROM prediction")
+    await TrackmaniaRecord.insert(TrackmaniaRecord(
+        player=1, track=1, time=42000, nadeo_timestamp=now - timedelta(minutes=90), created_at=now
+    ))
+    await Bet.raw(
+        "INSERT INTO bet (player, prediction, outcome) "
+        "SELECT pl.id, p.id, 41000 + pl.id * 100 FROM prediction p CROSS JOIN player pl"
+    )
+
+
+async def main():
+    async with connection_pool():
+        for workers in WORKERS:
+            await seed()
+            manager = PredictionManager(workers=workers)
+            start = time.perf_counter()
+            await manager.process_expired_predictions()
+            elapsed = time.perf_counter() - start
+            await manager.close()
+            assert not await Prediction.exists().where(Prediction.processed == False)
+            print(f"{workers} worker(s): {BACKLOG / elapsed:.1f} predictions/s")
+
+
+if __name__ == "__main__":
+    run(main)
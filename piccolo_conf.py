@@ -3,7 +3,6 @@ from configparser import RawConfigParser, UNNAMED_SECTION
 from piccolo.conf.apps import AppRegistry
 from platformdirs import user_data_dir
 from pathlib import Path
-import os
 
 secrets = RawConfigParser(allow_unnamed_section=True)
 secrets.read("secrets.ini")
@@ -14,6 +13,17 @@ DATA_DIR = user_data_dir("gambr", "kjossul")
 Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 DB_USER = secrets.get(UNNAMED_SECTION, "psql_user")
 DB_PWD = secrets.get(UNNAMED_SECTION, "psql_pwd")
+# keys used to sign session tokens, formatted as "key_id:hex_key,...". The first one signs new tokens, the others
+# are still accepted so keys can be rotated without logging everyone out. All workers must share them.
+SESSION_KEYS = {
+    kid: bytes.fromhex(key)
+    for kid, key in (k.split(":") for k in secrets.get(UNNAMED_SECTION, "session_keys").split(",") if k)
+}
+if not SESSION_KEYS:
+    raise ValueError("session_keys in secrets.ini must list at least one key")
+# file holding the rate limits shared by the workers of a host, in /dev/shm unless set.
+# Deployments on the same host need one each
+RATE_LIMIT_PATH = secrets.get(UNNAMED_SECTION, "rate_limit_path", fallback=None)
 
 DB = PostgresEngine(
     config={